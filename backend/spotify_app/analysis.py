@@ -0,0 +1,135 @@
+"""
+Multi-process BPM/key analysis engine
+
+Essentia analysis is CPU bound, so it runs in a pool of worker processes
+(one per core by default) instead of the download threads. Each worker
+builds the rhythm and key extractors once and reuses them for every file
+it analyzes. Workers only return results; database writes stay in the
+calling process.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+# Camelot key notation
+# Map includes both spellings (e.g., "Bb" and "B-flat")
+CAMELOT_MAP = {
+    # Major keys (outer wheel)
+    ('C', 'major'): '8B',
+    ('Db', 'major'): '3B',
+    ('D-flat', 'major'): '3B',
+    ('D', 'major'): '10B',
+    ('Eb', 'major'): '5B',
+    ('E-flat', 'major'): '5B',
+    ('E', 'major'): '12B',
+    ('F', 'major'): '7B',
+    ('F#', 'major'): '2B',
+    ('Gb', 'major'): '2B',
+    ('G', 'major'): '9B',
+    ('Ab', 'major'): '4B',
+    ('A-flat', 'major'): '4B',
+    ('A', 'major'): '11B',
+    ('Bb', 'major'): '6B',
+    ('B-flat', 'major'): '6B',
+    ('B', 'major'): '1B',
+    # Minor keys (inner wheel)
+    ('C', 'minor'): '5A',
+    ('Db', 'minor'): '12A',
+    ('D-flat', 'minor'): '12A',
+    ('D', 'minor'): '7A',
+    ('Eb', 'minor'): '2A',
+    ('E-flat', 'minor'): '2A',
+    ('E', 'minor'): '9A',
+    ('F', 'minor'): '4A',
+    ('F#', 'minor'): '11A',
+    ('Gb', 'minor'): '11A',
+    ('G', 'minor'): '6A',
+    ('Ab', 'minor'): '1A',
+    ('A-flat', 'minor'): '1A',
+    ('A', 'minor'): '8A',
+    ('Bb', 'minor'): '3A',
+    ('B-flat', 'minor'): '3A',
+    ('B', 'minor'): '10A',
+}
+
+# Algorithms built once per worker process by _init_worker
+_extractors = {}
+
+
+def _init_worker():
+    import essentia.standard as es
+
+    _extractors['rhythm'] = es.RhythmExtractor2013(method="multifeature")
+    _extractors['key'] = es.KeyExtractor()
+
+
+def _analyze_file(file_path):
+    """Runs in a worker process: return BPM and Camelot key for one file"""
+    import essentia.standard as es
+
+    # The loader is bound to a filename, so it is the only per-file algorithm
+    audio = es.MonoLoader(filename=file_path)()
+    bpm, _, _, _, _ = _extractors['rhythm'](audio)
+    key, scale, _ = _extractors['key'](audio)
+
+    return {
+        'bpm': round(bpm),  # Round to whole number
+        'key': CAMELOT_MAP.get((key, scale), f"{key} {scale}"),
+    }
+
+
+class AnalysisEngine:
+    def __init__(self, processes=None):
+        self.processes = processes
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                processes = self.processes or settings.ANALYSIS_PROCESSES or os.cpu_count() or 1
+                # spawn: the web process is multi-threaded, which makes fork unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=processes,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                )
+            return self._executor
+
+    def submit(self, file_path):
+        """Schedule analysis of one file and return a Future"""
+        try:
+            return self._pool().submit(_analyze_file, file_path)
+        except BrokenProcessPool:
+            # A worker died (e.g. crashed on a corrupt file); start a fresh pool
+            self.shutdown(wait=False)
+            return self._pool().submit(_analyze_file, file_path)
+
+    def analyze(self, file_path):
+        """Analyze one file, blocking until a worker has finished it"""
+        return self.submit(file_path).result()
+
+    def analyze_batch(self, file_paths):
+        """
+        Analyze many files across all workers.
+        Yields (file_path, result, error) tuples as workers finish them.
+        """
+        futures = {self.submit(path): path for path in file_paths}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+analysis_engine = AnalysisEngine()
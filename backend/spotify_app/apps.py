@@ -1,5 +1,43 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
+
+
+# Entry points of production servers, which run the background services too
+SERVER_COMMANDS = {'gunicorn', 'uvicorn', 'daphne', 'hypercorn'}
+
+
+def _is_server_process():
+    """
+    True for the process that serves requests; management commands, the
+    autoreloader, test runners and other scripts don't run background services
+    """
+    command = os.path.basename(sys.argv[0]) if sys.argv else ''
+    if command in SERVER_COMMANDS:
+        return True
+    if command != 'manage.py':
+        return False
+    if len(sys.argv) < 2 or sys.argv[1] != 'runserver':
+        return False
+    return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
+
 
 class SpotifyAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'spotify_app'
\ No newline at end of file
+    name = 'spotify_app'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .db import configure_connection
+        connection_created.connect(configure_connection, dispatch_uid='spotify_app.configure_connection')
+
+        # Resume queued downloads left behind by a restart
+        if settings.DOWNLOAD_QUEUE_AUTOSTART and _is_server_process():
+            from .download_queue import download_queue
+            download_queue.start()
+        # Catch up on playlist folder changes missed while stopped
+        if settings.PLAYLIST_RECONCILER_AUTOSTART and _is_server_process():
+            from .reconciler import playlist_reconciler
+            playlist_reconciler.start()
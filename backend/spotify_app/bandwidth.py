@@ -0,0 +1,90 @@
+"""
+Download bandwidth shared by all concurrent jobs
+
+DOWNLOAD_BANDWIDTH_LIMIT_KBPS is a budget for all downloads together rather
+than per job. Each job in the download stage registers its yt-dlp params,
+and whenever a job starts or finishes the budget is split evenly across the
+active jobs, and across each job's connections (the concurrent fragment
+downloads of HLS streams). yt-dlp reads params['ratelimit'] as it goes (and
+copies it for every fragment), so running jobs pick up their new share
+without restarting.
+
+The limit is a hard cap. A job is never given less than MIN_JOB_RATE, so
+at most limit // MIN_JOB_RATE jobs (at least one) download at once; any
+more wait in share() until a running job finishes.
+"""
+import contextlib
+import threading
+
+from django.conf import settings
+
+# Never throttle a job below this (bytes/sec); jobs wait for a turn instead
+MIN_JOB_RATE = 32 * 1024
+
+
+class BandwidthBudget:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._jobs = []  # (yt-dlp params, connections) of the jobs downloading now
+        self._waiting = 0
+
+    @property
+    def limit(self):
+        """Total budget in bytes/sec, None when unlimited"""
+        return settings.DOWNLOAD_BANDWIDTH_LIMIT_KBPS * 1024 or None
+
+    def max_jobs(self):
+        """How many jobs may download at once, None when unlimited"""
+        return max(self.limit // MIN_JOB_RATE, 1) if self.limit else None
+
+    def _rebalance(self):
+        # Called with the lock held
+        if not self._jobs:
+            return
+        share = self.limit // len(self._jobs) if self.limit else None
+        for params, connections in self._jobs:
+            params['ratelimit'] = max(share // connections, 1) if share else None
+
+    @contextlib.contextmanager
+    def share(self, params, connections=1):
+        """
+        Give a job's yt-dlp params its share of the budget while the block runs,
+        waiting first if max_jobs() jobs are already downloading
+        """
+        job = (params, max(connections, 1))
+        with self._slot_freed:
+            self._waiting += 1
+            try:
+                while self.max_jobs() and len(self._jobs) >= self.max_jobs():
+                    self._slot_freed.wait()
+            finally:
+                self._waiting -= 1
+            self._jobs.append(job)
+            self._rebalance()
+        try:
+            yield
+        finally:
+            with self._slot_freed:
+                # By identity: params of different jobs may well be equal
+                self._jobs = [other for other in self._jobs if other is not job]
+                self._rebalance()
+                self._slot_freed.notify()
+
+    def stats(self):
+        with self._lock:
+            active = len(self._jobs)
+            return {
+                'limit_bytes_per_second': self.limit,
+                'max_active_jobs': self.max_jobs(),
+                'active_jobs': active,
+                'waiting_jobs': self._waiting,
+                'per_job_bytes_per_second': self.limit // active if self.limit and active else None,
+                # What the running jobs are allowed in total, never above the limit
+                'effective_bytes_per_second': sum(
+                    params['ratelimit'] * connections for params, connections in self._jobs
+                ) if self.limit else None,
+            }
+
+
+download_bandwidth = BandwidthBudget()
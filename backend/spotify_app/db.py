@@ -0,0 +1,30 @@
+"""
+Per-connection database tuning
+
+SQLite is shared by request threads and download workers that write
+concurrently. Every new SQLite connection is switched to WAL (readers no
+longer block the writer and vice versa) with synchronous=NORMAL, which is
+safe in WAL mode and avoids an fsync per commit. The busy timeout is set via
+DATABASES OPTIONS['timeout'] in settings. PostgreSQL needs no tuning here.
+"""
+from django.conf import settings
+
+
+def configure_connection(sender, connection, **kwargs):
+    """connection_created receiver"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}')
+        cursor.execute(f'PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}')
+
+
+def describe_connection(connection):
+    """Backend and the settings that matter for concurrent writes, for reports"""
+    info = {'vendor': connection.vendor, 'conn_max_age': connection.settings_dict.get('CONN_MAX_AGE')}
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            info['journal_mode'] = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+            info['synchronous'] = cursor.execute('PRAGMA synchronous').fetchone()[0]
+            info['busy_timeout_ms'] = cursor.execute('PRAGMA busy_timeout').fetchone()[0]
+    return info
@@ -0,0 +1,236 @@
+"""
+Bounded download worker pool
+
+SoundCloudSong.download_status is the persistent job queue: rows in
+'pending' are waiting for a worker. A fixed number of worker threads take
+jobs off an in-process queue and run them through the download, transcode
+and analysis stages, each of which has its own concurrency limit.
+
+The queue runs in the server process only (see apps.py). Other processes,
+such as management commands, just leave their jobs 'pending'; the running
+queue polls for pending rows every DOWNLOAD_HEARTBEAT_SECONDS. A worker
+claims a row atomically and records a DownloadClaim with its queue's owner
+id, whose heartbeat the queue renews while the job runs. Rows in
+'downloading' or 'analyzing' are only put back to 'pending' once their
+claim is gone or its heartbeat is older than DOWNLOAD_CLAIM_TIMEOUT, i.e.
+the process running them died, so a job another process is still running
+is never started twice.
+"""
+import contextlib
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .bandwidth import download_bandwidth
+from .models import DownloadClaim, SoundCloudSong
+from .playlists import invalidate_playlist_summaries
+from .progress import progress_writer
+from .reconciler import playlist_reconciler
+
+STAGES = ('download', 'transcode', 'analysis')
+
+# Window used to compute throughput over recently finished jobs
+THROUGHPUT_WINDOW_SECONDS = 600
+
+
+class DownloadQueue:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._workers = []
+        self._queued_ids = set()
+        self._stage_limits = {}
+        self._active = {stage: 0 for stage in STAGES}
+        self._finished = deque(maxlen=1000)  # (finished_at, duration, status)
+        self._completed_total = 0
+        self._failed_total = 0
+
+    def start(self):
+        """Start the worker threads and the monitor that resumes jobs (idempotent)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+            self._stage_limits = {
+                'download': settings.DOWNLOAD_CONCURRENCY,
+                'transcode': settings.TRANSCODE_CONCURRENCY,
+                'analysis': settings.ANALYSIS_CONCURRENCY,
+            }
+            self._semaphores = {
+                stage: threading.BoundedSemaphore(limit)
+                for stage, limit in self._stage_limits.items()
+            }
+            for i in range(settings.DOWNLOAD_WORKERS):
+                worker = threading.Thread(target=self._work, name=f'download-worker-{i}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+        threading.Thread(target=self._monitor, name='download-monitor', daemon=True).start()
+
+    def enqueue(self, soundcloud_song_id):
+        """
+        Queue a SoundCloudSong whose download_status is 'pending'. Without a
+        running queue in this process the row stays pending for the queue of
+        the server process, which picks it up on its next poll.
+        """
+        with self._lock:
+            if not self._started or soundcloud_song_id in self._queued_ids:
+                return
+            self._queued_ids.add(soundcloud_song_id)
+        self._queue.put(soundcloud_song_id)
+
+    def _monitor(self):
+        while True:
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"Error renewing download claims: {e}")
+            self.resume()
+            time.sleep(settings.DOWNLOAD_HEARTBEAT_SECONDS)
+
+    def heartbeat(self):
+        """Renew the claims of the jobs this queue is running"""
+        DownloadClaim.objects.filter(owner=self.owner).update(heartbeat=timezone.now())
+
+    def recover(self):
+        """Put jobs whose process died (no claim, or a stale one) back to 'pending'"""
+        stale = timezone.now() - timedelta(seconds=settings.DOWNLOAD_CLAIM_TIMEOUT)
+        with transaction.atomic():
+            DownloadClaim.objects.filter(heartbeat__lt=stale).delete()
+            return SoundCloudSong.objects.filter(
+                download_status__in=['downloading', 'analyzing'], download_claim__isnull=True
+            ).update(download_status='pending', download_progress=0)
+
+    def resume(self):
+        """Re-queue pending jobs and those interrupted mid-download"""
+        try:
+            reset = self.recover()
+            pending_ids = list(
+                SoundCloudSong.objects.filter(download_status='pending')
+                .order_by('created_at')
+                .values_list('id', flat=True)
+            )
+            for soundcloud_song_id in pending_ids:
+                self.enqueue(soundcloud_song_id)
+            if reset:
+                print(f"Resumed {len(pending_ids)} download jobs ({reset} interrupted)")
+        except Exception as e:
+            print(f"Error resuming download jobs: {e}")
+        finally:
+            close_old_connections()
+
+    @contextlib.contextmanager
+    def _stage(self, name):
+        with self._semaphores[name]:
+            with self._lock:
+                self._active[name] += 1
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._active[name] -= 1
+
+    def _work(self):
+        while True:
+            soundcloud_song_id = self._queue.get()
+            with self._lock:
+                self._queued_ids.discard(soundcloud_song_id)
+            try:
+                self._run(soundcloud_song_id)
+            except Exception as e:
+                print(f"Download worker error for job {soundcloud_song_id}: {e}")
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def _run(self, soundcloud_song_id):
+        # Imported here as the views package imports this module
+        from .views.utils import download_soundcloud_track
+
+        # Claim the row so a job queued twice, by several processes (or deleted
+        # meanwhile) runs at most once
+        with transaction.atomic():
+            claimed = SoundCloudSong.objects.filter(
+                id=soundcloud_song_id, download_status='pending'
+            ).update(download_status='downloading', download_progress=0)
+            if not claimed:
+                return
+            DownloadClaim.objects.update_or_create(
+                soundcloud_song_id=soundcloud_song_id,
+                defaults={'owner': self.owner, 'heartbeat': timezone.now()},
+            )
+
+        try:
+            soundcloud_song = SoundCloudSong.objects.get(id=soundcloud_song_id)
+            started_at = time.monotonic()
+            download_soundcloud_track(
+                soundcloud_song.url,
+                soundcloud_song.title,
+                soundcloud_song.artist,
+                soundcloud_song.id,
+                stage=self._stage,
+            )
+        finally:
+            DownloadClaim.objects.filter(soundcloud_song_id=soundcloud_song_id, owner=self.owner).delete()
+        status = (
+            SoundCloudSong.objects.filter(id=soundcloud_song_id)
+            .values_list('download_status', flat=True)
+            .first()
+        )
+        # Download counts and BPM ranges of the song's playlists changed
+        invalidate_playlist_summaries()
+        if status == 'completed':
+            # Put the new file into the playlists the song is already in
+            playlist_reconciler.request()
+        with self._lock:
+            self._finished.append((time.time(), time.monotonic() - started_at, status))
+            if status == 'failed':
+                self._failed_total += 1
+            else:
+                self._completed_total += 1
+
+    def stats(self):
+        """Queue depth per status plus worker utilisation and throughput"""
+        by_status = dict(
+            SoundCloudSong.objects.values_list('download_status')
+            .annotate(n=Count('id'))
+            .values_list('download_status', 'n')
+        )
+
+        with self._lock:
+            cutoff = time.time() - THROUGHPUT_WINDOW_SECONDS
+            recent = [(at, duration) for at, duration, status in self._finished
+                      if at >= cutoff and status != 'failed']
+            return {
+                'running': self._started,
+                'workers': len(self._workers),
+                'queued': self._queue.qsize(),
+                'stage_limits': dict(self._stage_limits),
+                'active': dict(self._active),
+                'status_counts': {
+                    status: by_status.get(status, 0)
+                    for status, _ in SoundCloudSong.DOWNLOAD_STATUS_CHOICES
+                },
+                'completed_total': self._completed_total,
+                'failed_total': self._failed_total,
+                'throughput_per_minute': round(len(recent) * 60 / THROUGHPUT_WINDOW_SECONDS, 2),
+                'avg_job_seconds': round(sum(d for _, d in recent) / len(recent), 1) if recent else None,
+                'progress_writes': progress_writer.stats(),
+                'bandwidth': download_bandwidth.stats(),
+            }
+
+
+download_queue = DownloadQueue()
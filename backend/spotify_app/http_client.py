@@ -0,0 +1,89 @@
+"""
+Pooled HTTP sessions for external APIs
+
+One requests.Session per remote service keeps TCP/TLS connections alive
+between calls. Every request gets connect/read timeouts, is retried with
+exponential backoff on 429 and 5xx (honouring Retry-After) and records its
+latency and status class in metrics under http.<service>.
+
+Spotify API calls answered with 401 (the access token was revoked or
+expired early) drop the cached token and are retried once with a new one.
+"""
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+
+# Never sleep longer than this on a single Retry-After
+MAX_RETRY_AFTER = 30
+
+
+class _Retry(Retry):
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, MAX_RETRY_AFTER)
+
+
+class ApiSession(requests.Session):
+    def __init__(self, name, retry_methods=Retry.DEFAULT_ALLOWED_METHODS):
+        super().__init__()
+        self.name = name
+        self.timeout = (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT)
+
+        retry = _Retry(
+            total=settings.HTTP_MAX_RETRIES,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=retry_methods,
+            respect_retry_after_header=True,
+            raise_on_status=False,  # Hand the last response back to the caller
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.HTTP_POOL_SIZE, max_retries=retry)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        started_at = time.monotonic()
+        try:
+            response = super().request(method, url, **kwargs)
+        except requests.RequestException:
+            metrics.incr(f'http.{self.name}.error')
+            raise
+        finally:
+            metrics.observe(f'http.{self.name}', time.monotonic() - started_at)
+        metrics.incr(f'http.{self.name}.{response.status_code // 100}xx')
+        return response
+
+
+class SpotifyApiSession(ApiSession):
+    def request(self, method, url, **kwargs):
+        response = super().request(method, url, **kwargs)
+        headers = kwargs.get('headers') or {}
+        authorization = headers.get('Authorization', '')
+        if response.status_code != 401 or not authorization.startswith('Bearer '):
+            return response
+
+        from .spotify_auth import spotify_token_provider  # It posts with spotify_accounts
+
+        stale_token = authorization[len('Bearer '):]
+        spotify_token_provider.invalidate(stale_token)
+        token = spotify_token_provider.get_token()
+        if not token or token == stale_token:
+            return response
+        metrics.incr(f'http.{self.name}.unauthorized_retry')
+        kwargs['headers'] = {**headers, 'Authorization': f'Bearer {token}'}
+        return super().request(method, url, **kwargs)
+
+
+spotify_accounts = ApiSession('spotify_accounts', retry_methods=Retry.DEFAULT_ALLOWED_METHODS | {'POST'})
+spotify_api = SpotifyApiSession('spotify_api')
+soundcloud_api = ApiSession('soundcloud_api')
+# soundcloud.com and its asset CDN, used to discover the client_id
+soundcloud_web = ApiSession('soundcloud_web')
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from spotify_app.matching import find_matches
+from spotify_app.models import SpotifySong
+from spotify_app.views.utils import get_spotify_access_token
+
+
+class Command(BaseCommand):
+    help = ('Search SoundCloud for unsaved songs and save (and download) the matches '
+            'scoring at least MATCH_AUTO_ACCEPT_SCORE')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Only consider this many of the newest unsaved songs')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Songs matched per batch (default: 50)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report the best candidate of each song without saving anything')
+
+    def handle(self, *args, **options):
+        access_token = get_spotify_access_token()
+        if not access_token:
+            raise CommandError('Unable to retrieve Spotify access token')
+
+        spotify_ids = list(
+            SpotifySong.objects.filter(is_saved=False).order_by('-added_at')
+            .values_list('spotify_id', flat=True)[:options['limit']]
+        )
+        threshold = settings.MATCH_AUTO_ACCEPT_SCORE
+        self.stdout.write(f'Matching {len(spotify_ids)} songs (auto-accept at {threshold})...')
+
+        accepted = review = failed = 0
+        batch_size = options['batch_size']
+        for i in range(0, len(spotify_ids), batch_size):
+            results = find_matches(spotify_ids[i:i + batch_size], access_token,
+                                   auto_accept=not options['dry_run'])
+            for result in results.values():
+                matches = result['soundcloud_matches']
+                if matches is None:
+                    failed += 1
+                    continue
+                best = matches[0] if matches else None
+                if result['auto_accepted'] or (options['dry_run'] and best and best['score'] >= threshold):
+                    accepted += 1
+                    self.stdout.write(f"  {best['score']:.2f}  {result['artist']} - {result['title']}  ->  {best['title']}")
+                else:
+                    review += 1
+
+        verb = 'Would accept' if options['dry_run'] else 'Accepted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {accepted} matches, {review} left for review, {failed} searches failed'
+        ))
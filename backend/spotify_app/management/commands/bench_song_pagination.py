@@ -0,0 +1,79 @@
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from spotify_app.models import SpotifySong
+from spotify_app.views import get_spotify_songs
+from spotify_app.views.spotify_views import _encode_cursor
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare offset and cursor pagination latency of the saved songs list at shallow and deep pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=40000, help='Synthetic saved songs to create')
+        parser.add_argument('--page-size', type=int, default=15)
+        parser.add_argument('--pages', default='1,2000', help='Comma-separated 1-based pages to time')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # Everything runs in a transaction that is rolled back, leaving the database untouched
+        try:
+            with transaction.atomic():
+                self._run(options)
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def _run(self, options):
+        page_size = options['page_size']
+        pages = [int(p) for p in options['pages'].split(',')]
+
+        now = timezone.now()
+        SpotifySong.objects.bulk_create([
+            SpotifySong(
+                title=f'Bench {i}', artist='Bench', spotify_id=f'bench-{i}',
+                added_at=now, saved_at=now - timedelta(seconds=i), is_saved=True,
+            )
+            for i in range(options['songs'])
+        ], batch_size=1000)
+
+        user = get_user_model()(username='bench')
+        factory = APIRequestFactory()
+
+        def timed(params):
+            samples = []
+            for _ in range(options['repeat']):
+                request = factory.get('/api/spotify/songs/', params)
+                force_authenticate(request, user)
+                started_at = time.perf_counter()
+                response = get_spotify_songs(request)
+                samples.append((time.perf_counter() - started_at) * 1000)
+                assert response.status_code == 200, response.data
+            return statistics.median(samples)
+
+        self.stdout.write(f"{'page':>8} {'offset ms':>12} {'cursor ms':>12}")
+        for page in pages:
+            offset_ms = timed({'page': page - 1, 'page_size': page_size})
+
+            cursor = ''
+            if page > 1:
+                # Cursor of the last row on the previous page
+                last_row = (
+                    SpotifySong.objects.filter(is_saved=True).order_by('-saved_at', '-id')
+                    .values('saved_at', 'id')[(page - 1) * page_size - 1]
+                )
+                cursor = _encode_cursor(last_row)
+            cursor_ms = timed({'cursor': cursor, 'page_size': page_size})
+
+            self.stdout.write(f'{page:>8} {offset_ms:>12.2f} {cursor_ms:>12.2f}')
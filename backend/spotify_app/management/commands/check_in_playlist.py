@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, OuterRef
+
+from spotify_app.models import PlaylistSong, SpotifySong
+from spotify_app.playlists import refresh_in_playlist
+
+
+class Command(BaseCommand):
+    help = 'Check that SpotifySong.in_playlist matches playlist membership'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Correct inconsistent songs instead of only reporting them')
+
+    def handle(self, *args, **options):
+        listed = Exists(PlaylistSong.objects.filter(spotify_song=OuterRef('pk')))
+        unmarked = SpotifySong.objects.filter(in_playlist=False).filter(listed)
+        stale = SpotifySong.objects.filter(in_playlist=True).filter(~listed)
+
+        problems = 0
+        for label, songs in (('in a playlist but not flagged', unmarked),
+                             ('flagged but in no playlist', stale)):
+            count = songs.count()
+            problems += count
+            if count:
+                sample = ', '.join(songs.values_list('spotify_id', flat=True)[:10])
+                self.stdout.write(f'{count} songs {label}: {sample}{"..." if count > 10 else ""}')
+
+        if not problems:
+            self.stdout.write(self.style.SUCCESS('in_playlist is consistent'))
+        elif options['fix']:
+            fixed = refresh_in_playlist()
+            self.stdout.write(self.style.SUCCESS(f'Fixed {fixed} songs'))
+        else:
+            raise CommandError(f'{problems} inconsistent songs, run with --fix to correct them')
@@ -0,0 +1,58 @@
+import filecmp
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from spotify_app.materialize import COPY, LINK_MODES, download_path, is_materialized, materialize, playlist_dir
+from spotify_app.models import Playlist
+
+
+class Command(BaseCommand):
+    help = 'Replace full MP3 copies in playlist folders with links to the library files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=LINK_MODES, default=None,
+                            help='Link mode to use (default: PLAYLIST_LINK_MODE)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would be replaced')
+
+    def handle(self, *args, **options):
+        mode = options['mode'] or settings.PLAYLIST_LINK_MODE
+        if mode == COPY:
+            raise CommandError('Nothing to dedupe with link mode "copy"')
+
+        library = download_path()
+        replaced = skipped = 0
+        reclaimed = 0
+        for name in Playlist.objects.values_list('name', flat=True):
+            folder = playlist_dir(name)
+            if not os.path.isdir(folder):
+                continue
+
+            for entry in os.scandir(folder):
+                if not entry.name.endswith('.mp3') or not entry.is_file(follow_symlinks=False):
+                    continue
+                source = os.path.join(library, entry.name)
+                if not os.path.isfile(source) or is_materialized(source, entry.path):
+                    continue
+                # Only replace true copies; a differing file may be a user's own edit
+                if not filecmp.cmp(source, entry.path, shallow=False):
+                    skipped += 1
+                    self.stderr.write(f'Differs from library file, left alone: {entry.path}')
+                    continue
+
+                size = entry.stat(follow_symlinks=False).st_size
+                if options['dry_run']:
+                    self.stdout.write(f'Would replace {entry.path}')
+                    used = mode
+                else:
+                    used = materialize(source, entry.path, mode)
+                if used != COPY:
+                    replaced += 1
+                    reclaimed += size
+
+        verb = 'Would replace' if options['dry_run'] else 'Replaced'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {replaced} copies ({reclaimed / 1024 / 1024:.1f} MB), {skipped} differing files skipped'
+        ))
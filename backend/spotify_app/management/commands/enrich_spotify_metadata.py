@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from spotify_app.models import SpotifySong
+from spotify_app.spotify_metadata import TRACKS_BATCH, fetch_tracks, store_tracks
+from spotify_app.views.utils import get_spotify_access_token
+
+
+class Command(BaseCommand):
+    help = 'Store album, duration, release date and preview URL of library songs, 50 tracks per Spotify call'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Refetch songs that already have metadata')
+
+    def handle(self, *args, **options):
+        access_token = get_spotify_access_token()
+        if not access_token:
+            raise CommandError('Unable to retrieve Spotify access token')
+
+        songs = SpotifySong.objects.all()
+        if not options['all']:
+            songs = songs.filter(metadata_fetched_at__isnull=True)
+        spotify_ids = list(songs.values_list('spotify_id', flat=True))
+        self.stdout.write(f'Fetching metadata of {len(spotify_ids)} songs...')
+
+        started_at = time.monotonic()
+        stored = calls = 0
+        # Chunks of several batches, so progress is saved along the way
+        chunk_size = TRACKS_BATCH * 10
+        for i in range(0, len(spotify_ids), chunk_size):
+            chunk = spotify_ids[i:i + chunk_size]
+            stored += store_tracks(fetch_tracks(chunk, access_token))
+            calls += -(-len(chunk) // TRACKS_BATCH)
+            self.stdout.write(f'  {min(i + chunk_size, len(spotify_ids))}/{len(spotify_ids)}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored metadata of {stored} songs with {calls} Spotify calls in {time.monotonic() - started_at:.1f}s'
+        ))
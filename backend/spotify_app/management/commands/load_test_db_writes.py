@@ -0,0 +1,126 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.utils import timezone
+
+from spotify_app.db import describe_connection
+from spotify_app.models import SoundCloudSong, SpotifySong
+
+PREFIX = 'loadtest-'
+
+
+class Command(BaseCommand):
+    help = ('Measure database write throughput with concurrent simulated download jobs '
+            'and request threads, against the configured database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=20,
+                            help='Concurrent simulated download jobs (default: 20)')
+        parser.add_argument('--updates', type=int, default=50,
+                            help='Progress updates written per job (default: 50)')
+        parser.add_argument('--readers', type=int, default=4,
+                            help='Threads reading the song list meanwhile, like API requests (default: 4)')
+
+    def handle(self, *args, **options):
+        jobs, updates = options['jobs'], options['updates']
+        self.stdout.write(f'Database: {describe_connection(connection)}')
+
+        song_ids = self._create_rows(jobs)
+        try:
+            results = self._run(song_ids, updates, options['readers'])
+        finally:
+            SpotifySong.objects.filter(spotify_id__startswith=PREFIX).delete()
+
+        latencies = sorted(results['latencies'])
+        writes = len(latencies)
+        elapsed = results['elapsed']
+        self.stdout.write(f'{jobs} jobs x {updates + 3} writes, {options["readers"]} readers, {elapsed:.2f}s')
+        self.stdout.write(f'  writes/s:         {writes / elapsed:.0f}')
+        self.stdout.write(f'  reads/s:          {results["reads"] / elapsed:.0f}')
+        if latencies:
+            self.stdout.write(f'  write p50/p95/max: {statistics.median(latencies) * 1000:.1f} / '
+                              f'{latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} / '
+                              f'{latencies[-1] * 1000:.1f} ms')
+        style = self.style.ERROR if results['errors'] else self.style.SUCCESS
+        self.stdout.write(style(f'  lock errors:      {results["errors"]}'))
+
+    def _create_rows(self, jobs):
+        now = timezone.now()
+        SpotifySong.objects.filter(spotify_id__startswith=PREFIX).delete()
+        spotify_songs = SpotifySong.objects.bulk_create([
+            SpotifySong(spotify_id=f'{PREFIX}{i}', title=f'Load test {i}', artist='Load test', added_at=now)
+            for i in range(jobs)
+        ])
+        if spotify_songs[0].pk is None:  # Backends that don't return ids from bulk_create
+            spotify_songs = list(SpotifySong.objects.filter(spotify_id__startswith=PREFIX))
+        soundcloud_songs = SoundCloudSong.objects.bulk_create([
+            SoundCloudSong(
+                spotify_song=song, soundcloud_id=f'{PREFIX}{song.pk}', title=song.title,
+                artist=song.artist, duration_ms=0, url='https://soundcloud.com/',
+            )
+            for song in spotify_songs
+        ])
+        if soundcloud_songs[0].pk is None:
+            soundcloud_songs = list(SoundCloudSong.objects.filter(soundcloud_id__startswith=PREFIX))
+        return [song.pk for song in soundcloud_songs]
+
+    def _run(self, song_ids, updates, readers):
+        lock = threading.Lock()
+        results = {'latencies': [], 'errors': 0, 'reads': 0}
+        stop = threading.Event()
+        start = threading.Barrier(len(song_ids) + readers + 1)
+
+        def write(query, **values):
+            started_at = time.perf_counter()
+            try:
+                query.update(**values)
+            except OperationalError:
+                with lock:
+                    results['errors'] += 1
+                return
+            with lock:
+                results['latencies'].append(time.perf_counter() - started_at)
+
+        def job(song_id):
+            # The write pattern of one download: claim, progress, status changes
+            try:
+                row = SoundCloudSong.objects.filter(id=song_id)
+                start.wait()
+                write(row, download_status='downloading', download_progress=0)
+                for i in range(updates):
+                    write(row, download_progress=int(i * 80 / updates))
+                write(row, download_status='analyzing', download_progress=90)
+                write(row, download_status='completed', download_progress=100, bpm=120.0)
+            finally:
+                connections.close_all()
+
+        def reader():
+            try:
+                start.wait()
+                while not stop.is_set():
+                    try:
+                        list(SpotifySong.objects.filter(is_saved=True).order_by('-saved_at', '-id')[:15])
+                        with lock:
+                            results['reads'] += 1
+                    except OperationalError:
+                        with lock:
+                            results['errors'] += 1
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=job, args=(song_id,)) for song_id in song_ids]
+        reader_threads = [threading.Thread(target=reader) for _ in range(readers)]
+        for thread in threads + reader_threads:
+            thread.start()
+        start.wait()
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        results['elapsed'] = time.perf_counter() - started_at
+        stop.set()
+        for thread in reader_threads:
+            thread.join()
+        return results
@@ -0,0 +1,55 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from spotify_app.analysis import AnalysisEngine
+from spotify_app.models import SoundCloudSong
+from spotify_app.playlists import invalidate_playlist_summaries
+
+
+class Command(BaseCommand):
+    help = 'Re-analyze BPM and key of downloaded tracks using all CPU cores'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing-only', action='store_true',
+                            help='Only analyze tracks without a BPM or key')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Number of worker processes (default: ANALYSIS_PROCESSES)')
+
+    def handle(self, *args, **options):
+        songs = SoundCloudSong.objects.filter(download_status='completed')
+        if options['missing_only']:
+            songs = songs.filter(bpm__isnull=True) | songs.filter(key__isnull=True)
+
+        songs_by_path = {}
+        for song in songs.only('id', 'title', 'artist'):
+            if os.path.exists(song.file_path):
+                songs_by_path[song.file_path] = song.id
+
+        total = len(songs_by_path)
+        self.stdout.write(f'Analyzing {total} tracks...')
+
+        engine = AnalysisEngine(options['processes'])
+        started_at = time.monotonic()
+        analyzed = failed = 0
+        try:
+            for file_path, result, error in engine.analyze_batch(songs_by_path):
+                if error is not None:
+                    failed += 1
+                    self.stderr.write(f'Failed to analyze {file_path}: {error}')
+                    continue
+                SoundCloudSong.objects.filter(id=songs_by_path[file_path]).update(
+                    bpm=result['bpm'], key=result['key']
+                )
+                analyzed += 1
+                if analyzed % 100 == 0:
+                    self.stdout.write(f'  {analyzed}/{total}')
+        finally:
+            engine.shutdown()
+            invalidate_playlist_summaries()
+
+        elapsed = time.monotonic() - started_at
+        self.stdout.write(self.style.SUCCESS(
+            f'Analyzed {analyzed} tracks ({failed} failed) in {elapsed:.1f}s'
+        ))
@@ -0,0 +1,208 @@
+"""
+SoundCloud match search and ranking for many Spotify songs at once
+
+Title, artists and duration of the tracks come from spotify_metadata (stored
+or cached locally, otherwise fetched in batches). SoundCloud searches then run
+concurrently on a shared thread pool of SOUNDCLOUD_SEARCH_CONCURRENCY
+workers, so the number of outstanding searches is bounded across all
+requests. Songs with the same normalised query share one search, and
+search_soundcloud caches results per query.
+
+Candidates are ranked by score_candidate: title and artist token overlap,
+duration difference, and a penalty for versions the Spotify track isn't
+(remixes, edits, live recordings...). Extended mixes are not penalised since
+they're what a DJ usually wants; only their longer duration is tolerated.
+With auto-accept, a best candidate scoring at least MATCH_AUTO_ACCEPT_SCORE
+is saved and queued for download straight away.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .download_queue import download_queue
+from .models import SoundCloudSong, SpotifySong
+from .progress import download_progress
+from .reconciler import playlist_reconciler
+from .spotify_metadata import get_tracks
+
+_pool = ThreadPoolExecutor(max_workers=settings.SOUNDCLOUD_SEARCH_CONCURRENCY, thread_name_prefix='match-search')
+
+_WORD = re.compile(r'[^\W_]+')
+# Words in upload titles that say nothing about which recording it is
+NOISE_WORDS = {'feat', 'ft', 'featuring', 'original', 'mix', 'official', 'audio', 'video',
+               'free', 'download', 'dl', 'out', 'now', 'premiere', 'hq', 'the', 'a'}
+# Words marking a different version than the original recording
+VERSION_WORDS = {'remix', 'edit', 'bootleg', 'flip', 'vip', 'rework', 'mashup', 'cover', 'live',
+                 'instrumental', 'acapella', 'nightcore', 'sped', 'slowed', 'reprise'}
+EXTENDED_WORDS = {'extended', 'club'}
+
+# Full duration score within this difference, none beyond DURATION_MAX_DELTA_MS
+DURATION_TOLERANCE_MS = 2000
+DURATION_MAX_DELTA_MS = 30000
+EXTENDED_DURATION_SCORE = 0.7
+VERSION_PENALTY = 0.3
+
+
+def _tokens(text):
+    return set(_WORD.findall(text.casefold()))
+
+
+def _duration_score(spotify_ms, candidate_ms, extended):
+    if not spotify_ms or not candidate_ms:
+        return None
+    if extended and candidate_ms > spotify_ms:
+        return EXTENDED_DURATION_SCORE
+    delta = abs(spotify_ms - candidate_ms)
+    if delta <= DURATION_TOLERANCE_MS:
+        return 1.0
+    return max(0.0, 1 - (delta - DURATION_TOLERANCE_MS) / (DURATION_MAX_DELTA_MS - DURATION_TOLERANCE_MS))
+
+
+def score_candidate(song, candidate):
+    """
+    How likely (0-1) a SoundCloud search result is the Spotify track.
+    song: dict with title, artist and duration_ms (may be None);
+    candidate: a search_soundcloud result.
+    """
+    title = _tokens(song['title'])
+    artist = _tokens(song['artist'])
+    candidate_title = _tokens(candidate.get('title', ''))
+    uploader = _tokens(candidate.get('artist', ''))
+
+    wanted = title - NOISE_WORDS - VERSION_WORDS - EXTENDED_WORDS or title
+    title_score = len(wanted & candidate_title) / len(wanted) if wanted else 0.0
+    artist_score = len(artist & (candidate_title | uploader)) / len(artist) if artist else 0.0
+
+    # A remix when the original is wanted, or the other way around
+    penalty = 0.0
+    if (candidate_title & VERSION_WORDS) - title:
+        penalty += VERSION_PENALTY
+    if (title & VERSION_WORDS) - candidate_title:
+        penalty += VERSION_PENALTY
+
+    extended = bool((candidate_title & EXTENDED_WORDS) - title)
+    duration_score = _duration_score(song.get('duration_ms'), candidate.get('duration_ms'), extended)
+    if duration_score is None:
+        score = (0.45 * title_score + 0.2 * artist_score) / 0.65
+    else:
+        score = 0.45 * title_score + 0.2 * artist_score + 0.35 * duration_score
+    return round(min(1.0, max(0.0, score - penalty)), 3)
+
+
+def rank_candidates(song, candidates):
+    """Candidates with a 'score' each, best first (stable for equal scores)"""
+    scored = [{**candidate, 'score': score_candidate(song, candidate)} for candidate in candidates]
+    return sorted(scored, key=lambda candidate: candidate['score'], reverse=True)
+
+
+def match_from_song(soundcloud_song):
+    """A saved SoundCloudSong in the shape of a search result"""
+    return {
+        'id': soundcloud_song.soundcloud_id,
+        'title': soundcloud_song.title,
+        'artist': soundcloud_song.artist,
+        'icon': soundcloud_song.icon,
+        'duration_ms': soundcloud_song.duration_ms,
+        'url': soundcloud_song.url,
+        'stream_url': soundcloud_song.stream_url,
+    }
+
+
+def save_match(spotify_song, soundcloud_data):
+    """Save a SoundCloud match for a Spotify song and queue its download"""
+    from .views.utils import partial_downloads  # views import this module
+
+    previous = SoundCloudSong.objects.filter(spotify_song=spotify_song).values_list('id', 'soundcloud_id').first()
+    if previous and previous[1] != str(soundcloud_data.get('id')):
+        # A partial download of the replaced track is of no use any more
+        playlist_reconciler.discard(paths=partial_downloads(previous[0]))
+
+    soundcloud_song, _ = SoundCloudSong.objects.update_or_create(
+        spotify_song=spotify_song,
+        defaults={
+            'soundcloud_id': str(soundcloud_data.get('id')),
+            'title': soundcloud_data.get('title', ''),
+            'artist': soundcloud_data.get('artist', ''),
+            'icon': soundcloud_data.get('icon', ''),
+            'duration_ms': soundcloud_data.get('duration_ms', 0),
+            'url': soundcloud_data.get('url', ''),
+            'stream_url': soundcloud_data.get('stream_url', ''),
+            'download_status': 'pending',
+            'download_progress': 0
+        }
+    )
+
+    # Mark Spotify song as saved and set saved_at timestamp
+    spotify_song.is_saved = True
+    spotify_song.saved_at = timezone.now()
+    spotify_song.save()
+
+    download_progress.update(spotify_song.spotify_id, status='pending', progress=0)
+    download_queue.enqueue(soundcloud_song.id)
+    return soundcloud_song
+
+
+def _in_pool(func, *args):
+    # Pool threads are long-lived: drop their database connection once it's stale
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def find_matches(spotify_ids, access_token=None, auto_accept=False):
+    """
+    Ranked SoundCloud candidates for each spotify_id; saved songs return their
+    saved match. With auto_accept, library songs whose best candidate scores
+    at least MATCH_AUTO_ACCEPT_SCORE are saved with it and queued.
+    Returns {spotify_id: result}; ids Spotify doesn't know are left out.
+    Tracks not known locally are fetched as in get_tracks, which raises
+    TokenUnavailable or requests.RequestException when that fails.
+    """
+    from .views.utils import normalize_query, search_soundcloud  # views import this module
+
+    spotify_ids = list(dict.fromkeys(spotify_ids))
+    songs = get_tracks(spotify_ids, access_token)
+    library = {song.spotify_id: song for song in SpotifySong.objects.filter(spotify_id__in=spotify_ids)}
+    saved = {
+        soundcloud_song.spotify_song.spotify_id: soundcloud_song
+        for soundcloud_song in SoundCloudSong.objects.filter(
+            spotify_song__spotify_id__in=spotify_ids, spotify_song__is_saved=True
+        ).select_related('spotify_song')
+    }
+
+    searches = {}  # normalised query -> future
+    for spotify_id, song in songs.items():
+        if spotify_id in saved:
+            continue
+        query = normalize_query(f"{song['title']} {song['artist']}")
+        if query not in searches:
+            searches[query] = _pool.submit(_in_pool, search_soundcloud, song['title'], song['artist'])
+        song['_search'] = searches[query]
+
+    results = {}
+    for spotify_id in spotify_ids:
+        song = songs.get(spotify_id)
+        if song is None:
+            continue
+        auto_accepted = False
+        if spotify_id in saved:
+            matches = [match_from_song(saved[spotify_id])]
+        else:
+            matches = song.pop('_search').result()
+            if matches is not None:
+                matches = rank_candidates(song, matches)
+                if (auto_accept and matches and spotify_id in library
+                        and matches[0]['score'] >= settings.MATCH_AUTO_ACCEPT_SCORE):
+                    save_match(library[spotify_id], matches[0])
+                    auto_accepted = True
+        results[spotify_id] = {
+            **song,
+            'soundcloud_matches': matches,
+            'soundcloud_error': matches is None,
+            'auto_accepted': auto_accepted,
+        }
+    return results
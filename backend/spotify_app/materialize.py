@@ -0,0 +1,131 @@
+"""
+Materialisation of playlist folders
+
+A playlist folder (/downloads/<playlist>/) holds one entry per downloaded
+track, pointing at the library file in /downloads. How that entry is made
+is chosen per deployment with PLAYLIST_LINK_MODE:
+
+- hardlink: a second name for the same inode, no extra space, constant time.
+  Needs the playlist folder on the same filesystem as the library.
+- reflink: a copy-on-write clone (Btrfs, XFS, ZFS, APFS-style filesystems
+  exposing FICLONE), a separate file that shares blocks with the original.
+- symlink: a relative symbolic link, so it also resolves on the host side of
+  a volume mount. Some DJ software and file-sync tools don't follow them.
+- copy: a full copy, the previous behaviour.
+- auto (default): hardlink, then reflink, then copy, whichever works first.
+
+If the chosen mode isn't supported for a file (e.g. hardlinks across
+filesystems) it falls back to a copy, so materialising never fails just
+because of the link type.
+"""
+import errno
+import os
+import shutil
+import sys
+
+from django.conf import settings
+
+HARDLINK = 'hardlink'
+REFLINK = 'reflink'
+SYMLINK = 'symlink'
+COPY = 'copy'
+AUTO = 'auto'
+
+LINK_MODES = (HARDLINK, REFLINK, SYMLINK, COPY, AUTO)
+
+# ioctl number of FICLONE on Linux (_IOW(0x94, 9, int))
+FICLONE = 0x40049409
+
+# Errors meaning "this link type doesn't work here", as opposed to real I/O failures
+_UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS}
+
+
+def download_path():
+    """The library folder (container path, see DOWNLOAD_ROOT)"""
+    return settings.DOWNLOAD_ROOT
+
+
+def incoming_path():
+    """Raw downloads, kept apart from the finished MP3s until transcoded"""
+    return os.path.join(settings.DOWNLOAD_ROOT, '.incoming')
+
+
+def playlist_dir(playlist_name):
+    return os.path.join(download_path(), playlist_name)
+
+
+def _hardlink(source, dest):
+    os.link(source, dest)
+
+
+def _reflink(source, dest):
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, 'reflink is only supported on Linux')
+    import fcntl
+
+    with open(source, 'rb') as src, open(dest, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(dest)
+            raise
+    shutil.copystat(source, dest)
+
+
+def _symlink(source, dest):
+    os.symlink(os.path.relpath(source, os.path.dirname(dest)), dest)
+
+
+def _copy(source, dest):
+    shutil.copy2(source, dest)
+
+
+_STRATEGIES = {
+    HARDLINK: _hardlink,
+    REFLINK: _reflink,
+    SYMLINK: _symlink,
+    COPY: _copy,
+}
+
+
+def _attempts(mode):
+    if mode == AUTO:
+        return [HARDLINK, REFLINK, COPY]
+    if mode not in _STRATEGIES:
+        raise ValueError(f'Unknown PLAYLIST_LINK_MODE {mode!r}, expected one of {", ".join(LINK_MODES)}')
+    return [mode] if mode == COPY else [mode, COPY]
+
+
+def materialize(source, dest, mode=None):
+    """
+    Make dest refer to the library file source, replacing whatever is at dest.
+    The entry is created under a temporary name and renamed into place, so
+    dest is never missing or half-written. Returns the mode actually used.
+    """
+    mode = mode or settings.PLAYLIST_LINK_MODE
+    directory = os.path.dirname(dest)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f'.{os.path.basename(dest)}.tmp')
+
+    for attempt in _attempts(mode):
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            _STRATEGIES[attempt](source, tmp_path)
+        except OSError as e:
+            if attempt == COPY or e.errno not in _UNSUPPORTED:
+                raise
+            continue
+        if attempt in (COPY, REFLINK):
+            os.chmod(tmp_path, 0o666)
+        os.replace(tmp_path, dest)
+        return attempt
+
+
+def is_materialized(source, dest):
+    """Whether dest is a hardlink or symlink to source (reflinks can't be told from copies)"""
+    try:
+        return os.path.samefile(source, dest)
+    except OSError:
+        return False
@@ -0,0 +1,45 @@
+"""
+In-process counters and timings
+
+Cheap, thread-safe counters for the hot paths (token cache, HTTP clients,
+queues). Values are per process and reset on restart; GET metrics/ returns
+a snapshot.
+"""
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = {}
+
+
+def incr(name, value=1):
+    """Increment a counter"""
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name, seconds):
+    """Record a duration, keeping count, total and max"""
+    with _lock:
+        timing = _timings.setdefault(name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        ms = seconds * 1000
+        timing['count'] += 1
+        timing['total_ms'] += ms
+        timing['max_ms'] = max(timing['max_ms'], ms)
+
+
+def snapshot():
+    """Current counters and timings (with averages)"""
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'timings': {
+                name: {
+                    'count': t['count'],
+                    'avg_ms': round(t['total_ms'] / t['count'], 2) if t['count'] else 0,
+                    'max_ms': round(t['max_ms'], 2),
+                }
+                for name, t in _timings.items()
+            },
+        }
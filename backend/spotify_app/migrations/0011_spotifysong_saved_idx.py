@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0010_auto_20251108_2319'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='spotifysong',
+            index=models.Index(fields=['is_saved', '-saved_at', '-id'], name='spotifysong_saved_idx'),
+        ),
+    ]
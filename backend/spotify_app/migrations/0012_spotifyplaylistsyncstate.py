@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0011_spotifysong_saved_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpotifyPlaylistSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('playlist_id', models.CharField(max_length=255, unique=True)),
+                ('snapshot_id', models.CharField(blank=True, default='', max_length=255)),
+                ('last_position', models.IntegerField(default=0)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0012_spotifyplaylistsyncstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceCredential',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('value', models.CharField(max_length=255)),
+                ('fetched_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0013_servicecredential'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RekordboxSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target', models.CharField(max_length=500)),
+                ('playlist_name', models.CharField(max_length=255)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('target_signature', models.CharField(blank=True, default='', max_length=64)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('target', 'playlist_name')},
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:45
+
+from django.db import migrations
+
+# Same as spotify_app.playlists.POSITION_GAP at the time of this migration
+POSITION_GAP = 1024
+
+
+def space_positions(apps, schema_editor):
+    """Respace positions from 0, 1, 2, ... to POSITION_GAP apart, keeping the order"""
+    PlaylistSong = apps.get_model('spotify_app', 'PlaylistSong')
+    entries = []
+    playlist_id = None
+    for entry in PlaylistSong.objects.order_by('playlist_id', 'position', 'id'):
+        if entry.playlist_id != playlist_id:
+            playlist_id = entry.playlist_id
+            rank = 0
+        rank += 1
+        entry.position = rank * POSITION_GAP
+        entries.append(entry)
+    PlaylistSong.objects.bulk_update(entries, ['position'], batch_size=500)
+
+
+def compact_positions(apps, schema_editor):
+    PlaylistSong = apps.get_model('spotify_app', 'PlaylistSong')
+    entries = []
+    playlist_id = None
+    for entry in PlaylistSong.objects.order_by('playlist_id', 'position', 'id'):
+        if entry.playlist_id != playlist_id:
+            playlist_id = entry.playlist_id
+            rank = 0
+        entry.position = rank
+        rank += 1
+        entries.append(entry)
+    PlaylistSong.objects.bulk_update(entries, ['position'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0014_rekordboxsyncstate'),
+    ]
+
+    operations = [
+        migrations.RunPython(space_positions, compact_positions),
+    ]
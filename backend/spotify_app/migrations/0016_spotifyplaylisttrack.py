@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0015_playlistsong_gap_positions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spotifyplaylistsyncstate',
+            name='membership_snapshot_id',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.CreateModel(
+            name='SpotifyPlaylistTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('playlist_id', models.CharField(max_length=255)),
+                ('spotify_id', models.CharField(max_length=255)),
+            ],
+            options={
+                'unique_together': {('playlist_id', 'spotify_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0016_spotifyplaylisttrack'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spotifysong',
+            name='album_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='spotifysong',
+            name='duration_ms',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='spotifysong',
+            name='metadata_fetched_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='spotifysong',
+            name='preview_url',
+            field=models.URLField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='spotifysong',
+            name='release_date',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0017_spotifysong_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='soundcloudsong',
+            name='download_bytes',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='soundcloudsong',
+            name='download_resumed_bytes',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='soundcloudsong',
+            name='download_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-17 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0018_soundcloudsong_download_throughput'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingRemoval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('file', 'File'), ('folder', 'Playlist folder')], max_length=10)),
+                ('path', models.CharField(max_length=1000)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('kind', 'path')},
+            },
+        ),
+    ]
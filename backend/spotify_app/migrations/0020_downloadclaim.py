@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-17 21:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0019_pendingremoval'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadClaim',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner', models.CharField(max_length=100)),
+                ('heartbeat', models.DateTimeField()),
+                ('soundcloud_song', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='download_claim', to='spotify_app.soundcloudsong')),
+            ],
+        ),
+    ]
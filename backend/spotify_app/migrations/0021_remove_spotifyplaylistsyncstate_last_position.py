@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-17 21:21
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0020_downloadclaim'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='spotifyplaylistsyncstate',
+            name='last_position',
+        ),
+    ]
@@ -1,3 +1,6 @@
+import os
+
+from django.conf import settings
 from django.db import models
 
 class SpotifySong(models.Model):
@@ -9,13 +12,53 @@ class SpotifySong(models.Model):
     added_at = models.DateTimeField()  # When song was added to Spotify playlist
     saved_at = models.DateTimeField(null=True, blank=True)  # When the song was saved
     in_playlist = models.BooleanField(default=False)  # Track if song is already in a playlist
+    # Track metadata from Spotify, stored so detail and match views don't refetch it
+    album_name = models.CharField(max_length=255, blank=True, default='')
+    duration_ms = models.IntegerField(null=True, blank=True)
+    release_date = models.CharField(max_length=10, blank=True, default='')  # YYYY, YYYY-MM or YYYY-MM-DD
+    preview_url = models.URLField(max_length=500, blank=True, null=True)
+    metadata_fetched_at = models.DateTimeField(null=True, blank=True)  # None until the fields above are filled
 
     class Meta:
         ordering = ['-saved_at']  # newest first
+        indexes = [
+            # Keyset pagination of the saved songs library
+            models.Index(fields=['is_saved', '-saved_at', '-id'], name='spotifysong_saved_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.artist}"
 
+class SpotifyPlaylistSyncState(models.Model):
+    """Snapshot of a Spotify playlist as of its last sync"""
+    playlist_id = models.CharField(max_length=255, unique=True)
+    snapshot_id = models.CharField(max_length=255, blank=True, default='')
+    membership_snapshot_id = models.CharField(max_length=255, blank=True, default='')  # Of SpotifyPlaylistTrack rows
+    synced_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.playlist_id} @ {self.snapshot_id}"
+
+class SpotifyPlaylistTrack(models.Model):
+    """Local index of the tracks currently in a Spotify playlist"""
+    playlist_id = models.CharField(max_length=255)
+    spotify_id = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ['playlist_id', 'spotify_id']
+
+    def __str__(self):
+        return f"{self.spotify_id} in {self.playlist_id}"
+
+class ServiceCredential(models.Model):
+    """Credential scraped from a third-party service, cached across restarts"""
+    name = models.CharField(max_length=100, unique=True)
+    value = models.CharField(max_length=255)
+    fetched_at = models.DateTimeField()
+
+    def __str__(self):
+        return self.name
+
 class SoundCloudSong(models.Model):
     DOWNLOAD_STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -38,10 +81,35 @@ class SoundCloudSong(models.Model):
     download_progress = models.IntegerField(default=0)  # 0-100
     bpm = models.FloatField(null=True, blank=True)  # Beats per minute
     key = models.CharField(max_length=10, null=True, blank=True)  # Musical key (e.g., "A", "C#m")
+    # Last download: bytes transferred, time spent transferring them and bytes reused from a partial file
+    download_bytes = models.BigIntegerField(null=True, blank=True)
+    download_seconds = models.FloatField(null=True, blank=True)
+    download_resumed_bytes = models.BigIntegerField(null=True, blank=True)
 
     def __str__(self):
         return f"{self.title} - {self.artist} (SoundCloud)"
 
+    @property
+    def download_throughput(self):
+        """Bytes per second of the last download"""
+        if not self.download_bytes or not self.download_seconds:
+            return None
+        return round(self.download_bytes / self.download_seconds)
+
+    @property
+    def file_path(self):
+        """Location of the downloaded MP3 (container path, mapped to host via volume)"""
+        return os.path.join(settings.DOWNLOAD_ROOT, f'{self.artist} - {self.title}.mp3')
+
+class DownloadClaim(models.Model):
+    """The download queue process working on a SoundCloudSong, kept alive by its heartbeat"""
+    soundcloud_song = models.OneToOneField(SoundCloudSong, on_delete=models.CASCADE, related_name='download_claim')
+    owner = models.CharField(max_length=100)  # host:pid:id of the queue that claimed the job
+    heartbeat = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.soundcloud_song_id} claimed by {self.owner}"
+
 class Playlist(models.Model):
     name = models.CharField(max_length=255, unique=True)
     description = models.TextField(blank=True, null=True)
@@ -64,4 +132,37 @@ class PlaylistSong(models.Model):
         unique_together = ['playlist', 'spotify_song']
     
     def __str__(self):
-        return f"{self.playlist.name} - {self.spotify_song.title}"
\ No newline at end of file
+        return f"{self.playlist.name} - {self.spotify_song.title}"
+
+class RekordboxSyncState(models.Model):
+    """Content hash of a playlist as last written to a Rekordbox library file"""
+    target = models.CharField(max_length=500)  # Path of the rekordbox.xml / master.db
+    playlist_name = models.CharField(max_length=255)
+    content_hash = models.CharField(max_length=64)
+    target_signature = models.CharField(max_length=64, blank=True, default='')  # Size/mtime after our write
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['target', 'playlist_name']
+
+    def __str__(self):
+        return f"{self.playlist_name} -> {self.target}"
+
+class PendingRemoval(models.Model):
+    """A file or playlist folder for the reconciler to delete, unless it's wanted again"""
+    FILE = 'file'
+    FOLDER = 'folder'
+    KIND_CHOICES = [
+        (FILE, 'File'),
+        (FOLDER, 'Playlist folder'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    path = models.CharField(max_length=1000)  # File path, or playlist name for folders
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['kind', 'path']
+
+    def __str__(self):
+        return f"{self.kind} {self.path}"
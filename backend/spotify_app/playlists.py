@@ -0,0 +1,213 @@
+"""
+Playlist membership operations
+
+PlaylistSong.position is a sparse sort key: songs are spaced POSITION_GAP
+apart, so appending takes the last position plus the gap and moving a song
+gives it the midpoint of its new neighbours. Only that one row is written;
+the rest of the playlist is renumbered (one bulk UPDATE) only in the rare
+case that the neighbours have no integer left between them. Positions are
+therefore ordered but not contiguous.
+
+Each operation works on a list of songs and runs in one transaction.
+SpotifySong.in_playlist is kept in step with set-based UPDATEs (an EXISTS
+subquery on PlaylistSong) rather than per-song reads and saves.
+
+The playlist listing (counts, duration, BPM range per playlist) is one
+aggregate query whose result is cached until membership or downloads change.
+The cache is shared between processes (see CACHES), so changes made by
+management commands invalidate it for the server too.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Exists, Max, Min, OuterRef, Q, Sum
+
+from .models import Playlist, PlaylistSong, SpotifySong
+
+POSITION_GAP = 1024
+
+SUMMARIES_CACHE_KEY = 'playlist_summaries'
+
+_MATCH = 'songs__spotify_song__soundcloud_match__'
+
+
+def playlist_summaries():
+    """Every playlist with its song count, downloaded count, total duration and BPM range"""
+    summaries = cache.get(SUMMARIES_CACHE_KEY)
+    if summaries is not None:
+        return summaries
+
+    summaries = list(
+        Playlist.objects.annotate(
+            song_count=Count('songs'),
+            completed_count=Count('songs', filter=Q(**{f'{_MATCH}download_status': 'completed'})),
+            total_duration_ms=Sum(f'{_MATCH}duration_ms'),
+            min_bpm=Min(f'{_MATCH}bpm'),
+            max_bpm=Max(f'{_MATCH}bpm'),
+        ).values(
+            'id', 'name', 'created_at', 'song_count', 'completed_count',
+            'total_duration_ms', 'min_bpm', 'max_bpm',
+        ).order_by('name')  # Meta.ordering doesn't apply to aggregate queries
+    )
+    cache.set(SUMMARIES_CACHE_KEY, summaries, timeout=settings.PLAYLIST_SUMMARY_CACHE_TTL)
+    return summaries
+
+
+def invalidate_playlist_summaries():
+    """Drop the cached listing once the current transaction (if any) commits"""
+    transaction.on_commit(lambda: cache.delete(SUMMARIES_CACHE_KEY))
+
+
+def _songs_by_spotify_id(spotify_ids):
+    """({spotify_id: SpotifySong}, [unknown spotify_ids]), keeping the given order"""
+    songs = SpotifySong.objects.in_bulk(spotify_ids, field_name='spotify_id')
+    return songs, [spotify_id for spotify_id in spotify_ids if spotify_id not in songs]
+
+
+def _dedupe(items):
+    return list(dict.fromkeys(items))
+
+
+def _listed(exclude_playlist=None):
+    """Condition: the outer SpotifySong is in a playlist (other than exclude_playlist)"""
+    entries = PlaylistSong.objects.filter(spotify_song=OuterRef('pk'))
+    if exclude_playlist is not None:
+        entries = entries.exclude(playlist=exclude_playlist)
+    return Exists(entries)
+
+
+def refresh_in_playlist(songs=None):
+    """
+    Recompute in_playlist of songs (a SpotifySong queryset, default all songs)
+    from PlaylistSong in two UPDATEs. Returns the number of songs corrected.
+    """
+    songs = SpotifySong.objects.all() if songs is None else songs
+    listed = _listed()
+    marked = songs.filter(in_playlist=False).filter(listed).update(in_playlist=True)
+    cleared = songs.filter(in_playlist=True).filter(~listed).update(in_playlist=False)
+    return marked + cleared
+
+
+def remove_playlist(playlist):
+    """Delete a playlist and its entries, clearing in_playlist of songs left in no playlist"""
+    with transaction.atomic():
+        SpotifySong.objects.filter(in_playlist=True, playlistsong__playlist=playlist).filter(
+            ~_listed(exclude_playlist=playlist)
+        ).update(in_playlist=False)
+        playlist.delete()
+        invalidate_playlist_summaries()
+
+
+def add_songs(playlist, spotify_ids):
+    """
+    Append songs to the end of a playlist.
+    Returns (added, already_in_playlist, not_found) lists of spotify_ids.
+    """
+    spotify_ids = _dedupe(spotify_ids)
+    with transaction.atomic():
+        songs, not_found = _songs_by_spotify_id(spotify_ids)
+        existing = set(
+            PlaylistSong.objects.filter(playlist=playlist, spotify_song__in=songs.values())
+            .values_list('spotify_song__spotify_id', flat=True)
+        )
+        added = [spotify_id for spotify_id in spotify_ids if spotify_id in songs and spotify_id not in existing]
+
+        last = PlaylistSong.objects.filter(playlist=playlist).aggregate(last=Max('position'))['last'] or 0
+        PlaylistSong.objects.bulk_create([
+            PlaylistSong(playlist=playlist, spotify_song=songs[spotify_id], position=last + (i + 1) * POSITION_GAP)
+            for i, spotify_id in enumerate(added)
+        ])
+        SpotifySong.objects.filter(spotify_id__in=added, in_playlist=False).update(in_playlist=True)
+        if added:
+            invalidate_playlist_summaries()
+
+    already = [spotify_id for spotify_id in spotify_ids if spotify_id in existing]
+    return added, already, not_found
+
+
+def remove_songs(playlist, spotify_ids):
+    """
+    Remove songs from a playlist. Positions of the remaining songs are left as is.
+    Returns (removed, not_in_playlist) lists of spotify_ids.
+    """
+    spotify_ids = _dedupe(spotify_ids)
+    with transaction.atomic():
+        entries = dict(
+            PlaylistSong.objects.filter(playlist=playlist, spotify_song__spotify_id__in=spotify_ids)
+            .values_list('spotify_song__spotify_id', 'spotify_song_id')
+        )
+        PlaylistSong.objects.filter(playlist=playlist, spotify_song_id__in=entries.values()).delete()
+
+        refresh_in_playlist(SpotifySong.objects.filter(id__in=entries.values()))
+        if entries:
+            invalidate_playlist_summaries()
+
+    removed = [spotify_id for spotify_id in spotify_ids if spotify_id in entries]
+    not_in_playlist = [spotify_id for spotify_id in spotify_ids if spotify_id not in entries]
+    return removed, not_in_playlist
+
+
+def _positions_between(low, high, count):
+    """count increasing integers strictly between low and high (high None = open end), or None"""
+    if high is None:
+        return [low + (i + 1) * POSITION_GAP for i in range(count)]
+    step = (high - low) // (count + 1)
+    if step < 1:
+        return None
+    return [low + (i + 1) * step for i in range(count)]
+
+
+def move_songs(playlist, spotify_ids, index):
+    """
+    Move songs so they sit together, in the given order, at index of the playlist
+    (counted among the songs not being moved; past the end appends them).
+    Writes only the moved rows unless the playlist has to be renumbered.
+    Returns (moved, not_in_playlist) lists of spotify_ids.
+    """
+    spotify_ids = _dedupe(spotify_ids)
+    with transaction.atomic():
+        moving = {
+            entry.spotify_song.spotify_id: entry
+            for entry in PlaylistSong.objects.select_for_update()
+            .filter(playlist=playlist, spotify_song__spotify_id__in=spotify_ids)
+            .select_related('spotify_song')
+        }
+        moved = [spotify_id for spotify_id in spotify_ids if spotify_id in moving]
+        not_in_playlist = [spotify_id for spotify_id in spotify_ids if spotify_id not in moving]
+        if not moved:
+            return moved, not_in_playlist
+
+        others = PlaylistSong.objects.filter(playlist=playlist).exclude(
+            id__in=[entry.id for entry in moving.values()]
+        ).order_by('position', 'id')
+        entries = [moving[spotify_id] for spotify_id in moved]
+        index = max(index, 0)
+
+        # Positions of the neighbours around the target slot
+        if index == 0:
+            before = None
+            after = others.values_list('position', flat=True).first()
+        else:
+            neighbours = list(others.values_list('position', flat=True)[index - 1:index + 1])
+            if not neighbours:
+                neighbours = [others.values_list('position', flat=True).last()]  # Past the end
+            before = neighbours[0]
+            after = neighbours[1] if len(neighbours) > 1 else None
+
+        if before is None:
+            before = after - (len(entries) + 1) * POSITION_GAP if after is not None else 0
+        positions = _positions_between(before, after, len(entries))
+
+        if positions is None:
+            # No room left between the neighbours: respace the whole playlist in the new order
+            ordered = list(others)
+            ordered[index:index] = entries
+            for i, entry in enumerate(ordered):
+                entry.position = (i + 1) * POSITION_GAP
+            PlaylistSong.objects.bulk_update(ordered, ['position'], batch_size=500)
+        else:
+            for entry, position in zip(entries, positions):
+                entry.position = position
+            PlaylistSong.objects.bulk_update(entries, ['position'])
+
+    return moved, not_in_playlist
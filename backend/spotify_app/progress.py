@@ -0,0 +1,176 @@
+"""
+In-memory progress of active download jobs
+
+Progress callbacks from yt-dlp fire many times per second; they only update
+this registry, and the database is written at phase transitions (status
+changes). Readers (the batch status endpoint and the server-sent event
+stream) overlay the registry on the persisted status, and stream consumers
+block on a condition variable until something changes instead of polling.
+
+Finished jobs stay in the registry for FINISHED_RETENTION_SECONDS so a
+stream that reconnects shortly afterwards still sees their final state.
+
+ProgressWriter persists in-phase progress as well, for clients that read
+download_progress from the database, without a write per callback: it keeps
+only the latest percentage per job (ignoring callbacks that don't change it)
+and a background thread writes all changed jobs in one UPDATE every
+PROGRESS_FLUSH_INTERVAL_MS.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, F, IntegerField, Value, When
+
+from . import metrics
+from .models import SoundCloudSong
+
+FINISHED_RETENTION_SECONDS = 60
+
+TERMINAL_STATUSES = ('completed', 'failed')
+
+
+class ProgressRegistry:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._jobs = {}  # spotify_id -> job dict
+        self._version = 0
+
+    def _prune(self):
+        cutoff = time.time() - FINISHED_RETENTION_SECONDS
+        for spotify_id, job in list(self._jobs.items()):
+            if job['download_status'] in TERMINAL_STATUSES and job['updated_at'] < cutoff:
+                del self._jobs[spotify_id]
+
+    def update(self, spotify_id, status=None, progress=None):
+        """Record a job's status and/or progress (0-100); wakes stream readers on change"""
+        with self._cond:
+            job = self._jobs.get(spotify_id)
+            if job is None:
+                job = self._jobs[spotify_id] = {
+                    'spotify_id': spotify_id,
+                    'download_status': 'pending',
+                    'download_progress': 0,
+                }
+                changed = True
+            else:
+                changed = False
+            if status is not None and status != job['download_status']:
+                job['download_status'] = status
+                changed = True
+            if progress is not None and progress != job['download_progress']:
+                job['download_progress'] = progress
+                changed = True
+            if not changed:
+                return
+
+            self._version += 1
+            job['version'] = self._version
+            job['updated_at'] = time.time()
+            self._prune()
+            self._cond.notify_all()
+
+    def get(self, spotify_id):
+        with self._cond:
+            job = self._jobs.get(spotify_id)
+            return dict(job) if job else None
+
+    def wait_for_changes(self, version, timeout):
+        """
+        Block until some job changed after version (or timeout).
+        Returns (current version, [jobs changed after version]).
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._version > version, timeout=timeout)
+            changed = [
+                {'spotify_id': job['spotify_id'],
+                 'download_status': job['download_status'],
+                 'download_progress': job['download_progress']}
+                for job in self._jobs.values() if job['version'] > version
+            ]
+            return self._version, changed
+
+
+download_progress = ProgressRegistry()
+
+
+class ProgressWriter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = False
+        self._pending = {}  # SoundCloudSong id -> progress not yet written
+        self._written = {}  # SoundCloudSong id -> progress last written (active jobs only)
+        self._callbacks = 0
+        self._rows_written = 0
+        self._flushes = 0
+
+    def _start(self):
+        # Called with the lock held
+        if not self._started:
+            self._started = True
+            threading.Thread(target=self._loop, name='progress-writer', daemon=True).start()
+
+    def record(self, soundcloud_song_id, progress):
+        """Note a job's current progress; it is written by the next flush if it changed"""
+        with self._lock:
+            self._callbacks += 1
+            if self._written.get(soundcloud_song_id) == progress:
+                self._pending.pop(soundcloud_song_id, None)
+            else:
+                self._pending[soundcloud_song_id] = progress
+            self._start()
+
+    def discard(self, soundcloud_song_id):
+        """Forget a job, e.g. before its status change writes the progress itself"""
+        with self._lock:
+            self._pending.pop(soundcloud_song_id, None)
+            self._written.pop(soundcloud_song_id, None)
+
+    def _loop(self):
+        while True:
+            time.sleep(settings.PROGRESS_FLUSH_INTERVAL_MS / 1000)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error writing download progress: {e}")
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Write the progress of every changed job in one UPDATE; returns the rows written"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        started_at = time.monotonic()
+        # Only jobs still downloading: a status change may have happened since they were recorded
+        written = SoundCloudSong.objects.filter(id__in=pending, download_status='downloading').update(
+            download_progress=Case(
+                *[When(id=song_id, then=Value(progress)) for song_id, progress in pending.items()],
+                default=F('download_progress'),
+                output_field=IntegerField(),
+            )
+        )
+        metrics.observe('progress_writer.flush', time.monotonic() - started_at)
+
+        with self._lock:
+            self._written.update(pending)
+            self._rows_written += written
+            self._flushes += 1
+        metrics.incr('progress_writer.rows_written', written)
+        return written
+
+    def stats(self):
+        with self._lock:
+            return {
+                'callbacks': self._callbacks,
+                'rows_written': self._rows_written,
+                'flushes': self._flushes,
+                'writes_avoided': self._callbacks - self._rows_written,
+                'pending': len(self._pending),
+            }
+
+
+progress_writer = ProgressWriter()
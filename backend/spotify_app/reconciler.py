@@ -0,0 +1,244 @@
+"""
+Background reconciliation of playlist folders
+
+Playlist membership in the database is the source of truth for what
+/downloads/<playlist>/ should contain. Views only change the database and
+call request(); a background thread then compares the desired state with
+the folders on disk and applies the missing link/unlink operations in
+batches, so API latency no longer depends on disk I/O. A periodic run also
+picks up downloads that finished after their song was added to a playlist.
+
+Files in playlist folders are only ever removed if they are named after a
+library track (or were handed to discard()), so files users put there
+themselves are left alone. Removals handed to discard() are stored as
+PendingRemoval rows and only deleted after a run has applied them, so they
+survive a failed run, a restart, and come from any process (management
+commands included). Partial downloads in .incoming that no longer belong to
+a SoundCloudSong are found on every run.
+"""
+import os
+import shutil
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import metrics
+from .materialize import download_path, incoming_path, materialize, playlist_dir
+from .models import PendingRemoval, Playlist, PlaylistSong, SoundCloudSong
+
+# Wait this long after a request so a burst of changes is applied in one run
+DEBOUNCE_SECONDS = 0.5
+
+LINK = 'link'
+UNLINK = 'unlink'
+MKDIR = 'mkdir'
+RMTREE = 'rmtree'
+
+
+def _track_filename(artist, title):
+    return f'{artist} - {title}.mp3'
+
+
+class PlaylistReconciler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._started = False
+        self._running = False
+        self._pending = 0
+        self._last_run = None
+        self._last_error = None
+
+    def start(self):
+        """Start the reconciler thread (idempotent); it runs once right away"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._wake.set()
+        threading.Thread(target=self._loop, name='playlist-reconciler', daemon=True).start()
+
+    def request(self):
+        """Ask for a reconciliation run soon"""
+        self.start()
+        self._wake.set()
+
+    def discard(self, paths=(), folders=()):
+        """Queue files and playlist folders for removal and request a run"""
+        PendingRemoval.objects.bulk_create(
+            [PendingRemoval(kind=PendingRemoval.FILE, path=path) for path in paths]
+            + [PendingRemoval(kind=PendingRemoval.FOLDER, path=name) for name in folders],
+            ignore_conflicts=True,
+        )
+        self.request()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(timeout=settings.PLAYLIST_RECONCILE_INTERVAL)
+            time.sleep(DEBOUNCE_SECONDS)
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                self._last_error = str(e)
+                print(f"Playlist reconciler error: {e}")
+            finally:
+                close_old_connections()
+
+    def _desired(self):
+        """({playlist name: {filename: library path}}, {filenames of library tracks})"""
+        library = download_path()
+        desired = {name: {} for name in Playlist.objects.values_list('name', flat=True)}
+        rows = PlaylistSong.objects.filter(
+            spotify_song__soundcloud_match__download_status='completed'
+        ).values_list(
+            'playlist__name',
+            'spotify_song__soundcloud_match__artist',
+            'spotify_song__soundcloud_match__title',
+        )
+        for name, artist, title in rows:
+            filename = _track_filename(artist, title)
+            desired[name][filename] = os.path.join(library, filename)
+
+        tracks = {
+            _track_filename(artist, title)
+            for artist, title in SoundCloudSong.objects.filter(
+                download_status='completed'
+            ).values_list('artist', 'title')
+        }
+        return desired, tracks
+
+    def _orphaned_partials(self):
+        """Files in .incoming left by downloads of songs that were deleted or rematched"""
+        incoming = incoming_path()
+        if not os.path.isdir(incoming):
+            return []
+        # Listed before reading the songs: a download only starts once its row exists
+        entries = [entry.name for entry in os.scandir(incoming) if entry.is_file()]
+        songs = dict(SoundCloudSong.objects.values_list('id', 'soundcloud_id'))
+        orphans = []
+        for name in entries:
+            song_id, sep, rest = name.partition('-')
+            if not sep or not song_id.isdigit():
+                continue  # Not named by a download
+            soundcloud_id = songs.get(int(song_id))
+            if soundcloud_id is None or not rest.startswith(f'{soundcloud_id}.'):
+                orphans.append(os.path.join(incoming, name))
+        return orphans
+
+    def plan(self, removals=None):
+        """
+        List the operations that bring the playlist folders in line with the
+        database. removals: (kind, path) pairs, by default the pending ones.
+        """
+        if removals is None:
+            removals = PendingRemoval.objects.values_list('kind', 'path')
+        discarded_paths = {path for kind, path in removals if kind == PendingRemoval.FILE}
+        discarded_folders = {path for kind, path in removals if kind == PendingRemoval.FOLDER}
+        discarded_paths.update(self._orphaned_partials())
+
+        desired, tracks = self._desired()
+        library = download_path()
+        wanted_paths = {os.path.join(library, filename) for filename in tracks}
+
+        ops = []
+        for folder in discarded_folders:
+            if folder not in desired:
+                ops.append((RMTREE, playlist_dir(folder)))
+
+        for name, files in desired.items():
+            folder = playlist_dir(name)
+            if os.path.isdir(folder):
+                present = {entry.name for entry in os.scandir(folder) if entry.name.endswith('.mp3')}
+            else:
+                present = set()
+                ops.append((MKDIR, folder))
+
+            for filename, source in files.items():
+                dest = os.path.join(folder, filename)
+                wanted_paths.add(dest)
+                if filename not in present and os.path.exists(source):
+                    ops.append((LINK, source, dest))
+            for filename in (present & tracks) - files.keys():
+                ops.append((UNLINK, os.path.join(folder, filename)))
+
+        for path in discarded_paths - wanted_paths:
+            if os.path.lexists(path):
+                ops.append((UNLINK, path))
+        return ops
+
+    def _apply(self, op):
+        if op[0] == LINK:
+            materialize(op[1], op[2])
+        elif op[0] == UNLINK:
+            os.remove(op[1])
+        elif op[0] == MKDIR:
+            os.makedirs(op[1], exist_ok=True)
+            os.chmod(op[1], 0o777)
+        elif op[0] == RMTREE:
+            shutil.rmtree(op[1], ignore_errors=True)
+
+    def run_once(self):
+        """Plan and apply one reconciliation; returns the counts of the run"""
+        started_at = time.monotonic()
+        with self._lock:
+            self._running = True
+        try:
+            removals = list(PendingRemoval.objects.values_list('id', 'kind', 'path'))
+            ops = self.plan([(kind, path) for _, kind, path in removals])
+            with self._lock:
+                self._pending = len(ops)
+
+            failed = set()
+            counts = {LINK: 0, UNLINK: 0, MKDIR: 0, RMTREE: 0, 'errors': 0}
+            batch_size = settings.PLAYLIST_RECONCILE_BATCH
+            for i in range(0, len(ops), batch_size):
+                batch = ops[i:i + batch_size]
+                for op in batch:
+                    try:
+                        self._apply(op)
+                        counts[op[0]] += 1
+                    except OSError as e:
+                        counts['errors'] += 1
+                        failed.add(op[-1])
+                        print(f"Warning: could not {op[0]} {op[-1]}: {e}")
+                with self._lock:
+                    self._pending -= len(batch)
+
+            # Removals are done (or no longer wanted), except files that couldn't be deleted
+            PendingRemoval.objects.filter(
+                id__in=[id for id, kind, path in removals if kind == PendingRemoval.FOLDER or path not in failed]
+            ).delete()
+        finally:
+            with self._lock:
+                self._running = False
+
+        duration = time.monotonic() - started_at
+        metrics.observe('playlist_reconciler.run', duration)
+        self._last_run = {
+            'finished_at': time.time(),
+            'duration_ms': round(duration * 1000, 1),
+            'operations': len(ops),
+            **counts,
+        }
+        if counts['errors'] == 0:
+            self._last_error = None
+        return self._last_run
+
+    def status(self):
+        pending_removals = PendingRemoval.objects.count()
+        with self._lock:
+            return {
+                'running': self._started,
+                'reconciling': self._running,
+                'requested': self._wake.is_set(),
+                'pending_operations': self._pending,
+                'pending_removals': pending_removals,
+                'last_run': self._last_run,
+                'last_error': self._last_error,
+            }
+
+
+playlist_reconciler = PlaylistReconciler()
@@ -0,0 +1,84 @@
+"""
+Change tracking for Rekordbox syncs
+
+Each playlist's tracks are reduced to a content hash, and the hash last
+written to a target library file is stored in RekordboxSyncState. A sync
+only rewrites playlists whose hash changed, removes playlists that no
+longer exist and leaves everything else untouched, so repeated syncs cost
+O(changes) writes. For XML targets the file's size/mtime after our write
+is stored as well: if the file was replaced since (e.g. by a fresh
+Rekordbox export) the stored hashes can't be trusted and every playlist is
+compared against the file again.
+"""
+import hashlib
+import os
+
+from django.db import transaction
+
+from .models import RekordboxSyncState
+
+
+def playlist_hash(tracks):
+    """Hash of a playlist's ordered tracks and the metadata we write for them"""
+    digest = hashlib.sha256()
+    for track in tracks:
+        digest.update(f"{track['file_path']}\0{track['title']}\0{track['artist']}\0{track['bpm']}\n".encode())
+    return digest.hexdigest()
+
+
+def target_signature(path):
+    stat = os.stat(path)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+class SyncPlan:
+    def __init__(self):
+        self.changed = []  # (name, tracks, hash) to (re)write
+        self.untouched = []  # Names whose content is unchanged since the last sync
+        self.removed = []  # Names synced before that no longer exist
+
+    @property
+    def empty(self):
+        return not self.changed and not self.removed
+
+
+def plan_sync(target, playlist_tracks, signature=None):
+    """
+    Split playlists into changed and untouched ones for a target.
+
+    playlist_tracks: list of (name, [track, ...])
+    signature: current target_signature() of the file, or None to trust the stored hashes
+    """
+    states = {
+        state.playlist_name: state
+        for state in RekordboxSyncState.objects.filter(target=target)
+    }
+
+    plan = SyncPlan()
+    for name, tracks in playlist_tracks:
+        content_hash = playlist_hash(tracks)
+        state = states.pop(name, None)
+        trusted = state is not None and (signature is None or state.target_signature == signature)
+        if trusted and state.content_hash == content_hash:
+            plan.untouched.append(name)
+        else:
+            plan.changed.append((name, tracks, content_hash))
+    plan.removed = list(states)
+    return plan
+
+
+def record_sync(target, plan, signature=''):
+    """Store the hashes written by a sync and forget removed playlists"""
+    with transaction.atomic():
+        RekordboxSyncState.objects.filter(target=target, playlist_name__in=plan.removed).delete()
+        for name, _, content_hash in plan.changed:
+            RekordboxSyncState.objects.update_or_create(
+                target=target,
+                playlist_name=name,
+                defaults={'content_hash': content_hash, 'target_signature': signature},
+            )
+        if signature:
+            # Untouched playlists are still in the file we just wrote
+            RekordboxSyncState.objects.filter(
+                target=target, playlist_name__in=plan.untouched
+            ).update(target_signature=signature)
@@ -0,0 +1,307 @@
+"""
+Sync engine for Rekordbox's SQLite library (master.db)
+
+Works on the tables Rekordbox stores tracks and playlists in: djmdContent,
+djmdArtist, djmdPlaylist and djmdSongPlaylist. Rekordbox 6+ ships master.db
+encrypted with SQLCipher, so this operates on an unencrypted database
+(a decrypted copy, or a fixture built with create_fixture_database()).
+Rekordbox must be closed while syncing.
+
+A sync is one transaction. Existing rows are looked up by indexed keys
+(FolderPath, artist Name, playlist ParentID/PlaylistID), only rows that
+differ are written, and writes are batched with executemany, so re-syncing
+an unchanged library performs no writes at all.
+"""
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+from .rekordbox_xml import APP_FOLDER_NAME
+
+# Parent ID of top-level playlists and folders
+ROOT_ID = 'root'
+
+# djmdPlaylist.Attribute values
+PLAYLIST = 0
+FOLDER = 1
+
+# djmdContent.FileType of MP3 files
+FILE_TYPE_MP3 = 1
+
+# SQLite limits the number of host parameters per statement
+LOOKUP_CHUNK = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS djmdArtist (
+    ID VARCHAR(255) PRIMARY KEY,
+    Name VARCHAR(255),
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+CREATE TABLE IF NOT EXISTS djmdContent (
+    ID VARCHAR(255) PRIMARY KEY,
+    FolderPath VARCHAR(255),
+    FileNameL VARCHAR(255),
+    Title VARCHAR(255),
+    ArtistID VARCHAR(255),
+    BPM INTEGER,
+    FileType INTEGER,
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+CREATE TABLE IF NOT EXISTS djmdPlaylist (
+    ID VARCHAR(255) PRIMARY KEY,
+    Seq INTEGER,
+    Name VARCHAR(255),
+    Attribute INTEGER,
+    ParentID VARCHAR(255),
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+CREATE TABLE IF NOT EXISTS djmdSongPlaylist (
+    ID VARCHAR(255) PRIMARY KEY,
+    PlaylistID VARCHAR(255),
+    ContentID VARCHAR(255),
+    TrackNo INTEGER,
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+CREATE INDEX IF NOT EXISTS djmdArtist_Name ON djmdArtist (Name);
+CREATE INDEX IF NOT EXISTS djmdContent_FolderPath ON djmdContent (FolderPath);
+CREATE INDEX IF NOT EXISTS djmdPlaylist_ParentID ON djmdPlaylist (ParentID);
+CREATE INDEX IF NOT EXISTS djmdSongPlaylist_PlaylistID ON djmdSongPlaylist (PlaylistID);
+"""
+
+
+def create_fixture_database(db_path):
+    """Create an empty database with the Rekordbox tables used by the sync"""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(SCHEMA)
+    finally:
+        conn.close()
+
+
+def _now():
+    # Rekordbox timestamp format
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3] + ' +00:00'
+
+
+def _chunks(items, size=LOOKUP_CHUNK):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class _IdAllocator:
+    """Hands out new numeric string IDs above the current maximum of a table"""
+
+    def __init__(self, conn, table):
+        row = conn.execute(f'SELECT MAX(CAST(ID AS INTEGER)) FROM {table}').fetchone()
+        self.next_id = (row[0] or 0) + 1
+
+    def __call__(self):
+        new_id = str(self.next_id)
+        self.next_id += 1
+        return new_id
+
+
+class _Sync:
+    def __init__(self, conn):
+        self.conn = conn
+        self.now = _now()
+        self.stats = {
+            'added_tracks': 0,
+            'updated_tracks': 0,
+            'added_playlists': 0,
+            'removed_playlists': 0,
+            'added_entries': 0,
+            'removed_entries': 0,
+            'reordered_entries': 0,
+        }
+
+    def _lookup(self, sql, keys):
+        """Run sql (with a single IN (...) placeholder list) over keys in chunks"""
+        rows = []
+        for chunk in _chunks(keys):
+            placeholders = ','.join('?' * len(chunk))
+            rows.extend(self.conn.execute(sql.format(placeholders), chunk).fetchall())
+        return rows
+
+    def artist_ids(self, names):
+        """ID of each artist name, creating the missing ones"""
+        ids = dict(self._lookup('SELECT Name, ID FROM djmdArtist WHERE Name IN ({})', names))
+        missing = [name for name in names if name not in ids]
+        if missing:
+            new_id = _IdAllocator(self.conn, 'djmdArtist')
+            for name in missing:
+                ids[name] = new_id()
+            self.conn.executemany(
+                'INSERT INTO djmdArtist (ID, Name, created_at, updated_at) VALUES (?, ?, ?, ?)',
+                [(ids[name], name, self.now, self.now) for name in missing],
+            )
+        return ids
+
+    def upsert_contents(self, tracks):
+        """
+        Insert or update a djmdContent row per track (keyed by FolderPath).
+        Returns {file_path: content ID}.
+        """
+        by_path = {track['file_path']: track for track in tracks}
+        artist_ids = self.artist_ids({track['artist'] for track in by_path.values()})
+
+        existing = {
+            row[1]: row for row in self._lookup(
+                'SELECT ID, FolderPath, Title, ArtistID, BPM FROM djmdContent WHERE FolderPath IN ({})',
+                by_path,
+            )
+        }
+
+        content_ids = {}
+        inserts = []
+        updates = []
+        new_id = None
+        for path, track in by_path.items():
+            values = (
+                track['title'],
+                artist_ids[track['artist']],
+                int(round(track['bpm'] * 100)) if track['bpm'] else None,
+            )
+            row = existing.get(path)
+            if row is None:
+                new_id = new_id or _IdAllocator(self.conn, 'djmdContent')
+                content_id = new_id()
+                inserts.append((content_id, path, os.path.basename(path), *values, FILE_TYPE_MP3, self.now, self.now))
+            else:
+                content_id = row[0]
+                if tuple(row[2:]) != values:
+                    updates.append((*values, self.now, content_id))
+            content_ids[path] = content_id
+
+        self.conn.executemany(
+            'INSERT INTO djmdContent (ID, FolderPath, FileNameL, Title, ArtistID, BPM, FileType, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            inserts,
+        )
+        self.conn.executemany(
+            'UPDATE djmdContent SET Title = ?, ArtistID = ?, BPM = ?, updated_at = ? WHERE ID = ?',
+            updates,
+        )
+        self.stats['added_tracks'] += len(inserts)
+        self.stats['updated_tracks'] += len(updates)
+        return content_ids
+
+    def child_playlists(self, parent_id):
+        """{name: ID} of the playlists and folders directly under parent_id"""
+        rows = self.conn.execute(
+            'SELECT Name, ID FROM djmdPlaylist WHERE ParentID = ?', (parent_id,)
+        ).fetchall()
+        return dict(rows)
+
+    def create_playlist(self, name, parent_id, attribute):
+        new_id = _IdAllocator(self.conn, 'djmdPlaylist')()
+        seq = self.conn.execute(
+            'SELECT COALESCE(MAX(Seq), 0) + 1 FROM djmdPlaylist WHERE ParentID = ?', (parent_id,)
+        ).fetchone()[0]
+        self.conn.execute(
+            'INSERT INTO djmdPlaylist (ID, Seq, Name, Attribute, ParentID, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (new_id, seq, name, attribute, parent_id, self.now, self.now),
+        )
+        return new_id
+
+    def app_folder_id(self):
+        folder_id = self.child_playlists(ROOT_ID).get(APP_FOLDER_NAME)
+        return folder_id or self.create_playlist(APP_FOLDER_NAME, ROOT_ID, FOLDER)
+
+    def remove_playlists(self, playlist_ids):
+        """Delete playlists and their entries"""
+        rows = [(playlist_id,) for playlist_id in playlist_ids]
+        self.conn.executemany('DELETE FROM djmdSongPlaylist WHERE PlaylistID = ?', rows)
+        self.conn.executemany('DELETE FROM djmdPlaylist WHERE ID = ?', rows)
+        self.stats['removed_playlists'] += len(rows)
+
+    def sync_entries(self, playlist_ids, desired):
+        """
+        Make djmdSongPlaylist match desired {playlist ID: [content ID, ...]}:
+        remove entries no longer wanted, add missing ones, fix TrackNo of moved ones.
+        """
+        existing = {}
+        for entry_id, playlist_id, content_id, track_no in self._lookup(
+            'SELECT ID, PlaylistID, ContentID, TrackNo FROM djmdSongPlaylist WHERE PlaylistID IN ({})',
+            playlist_ids,
+        ):
+            existing.setdefault(playlist_id, {})[content_id] = (entry_id, track_no)
+
+        deletes = []
+        inserts = []
+        updates = []
+        new_id = None
+        for playlist_id in playlist_ids:
+            current = existing.get(playlist_id, {})
+            wanted = {}
+            for content_id in desired.get(playlist_id, []):
+                wanted.setdefault(content_id, len(wanted) + 1)  # TrackNo is 1-based
+
+            for content_id, (entry_id, _) in current.items():
+                if content_id not in wanted:
+                    deletes.append((entry_id,))
+            for content_id, track_no in wanted.items():
+                if content_id not in current:
+                    new_id = new_id or _IdAllocator(self.conn, 'djmdSongPlaylist')
+                    inserts.append((new_id(), playlist_id, content_id, track_no, self.now, self.now))
+                elif current[content_id][1] != track_no:
+                    updates.append((track_no, self.now, current[content_id][0]))
+
+        self.conn.executemany('DELETE FROM djmdSongPlaylist WHERE ID = ?', deletes)
+        self.conn.executemany(
+            'INSERT INTO djmdSongPlaylist (ID, PlaylistID, ContentID, TrackNo, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            inserts,
+        )
+        self.conn.executemany(
+            'UPDATE djmdSongPlaylist SET TrackNo = ?, updated_at = ? WHERE ID = ?',
+            updates,
+        )
+        self.stats['removed_entries'] += len(deletes)
+        self.stats['added_entries'] += len(inserts)
+        self.stats['reordered_entries'] += len(updates)
+
+
+def sync_database(db_path, playlist_tracks, removed_playlists=()):
+    """
+    Sync playlists into a Rekordbox master.db, in a single transaction.
+
+    playlist_tracks: list of (name, [track, ...]) where each track is a dict
+    with title, artist, file_path and bpm (see load_playlist_tracks).
+    Playlists of the app folder not listed are left alone.
+    removed_playlists: names of app folder playlists to delete.
+    Returns counts of added/updated rows.
+    Raises sqlite3.DatabaseError if the file is not an (unencrypted) Rekordbox database.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            # Take the write lock up front so reads and writes see one snapshot
+            conn.execute('BEGIN IMMEDIATE')
+            sync = _Sync(conn)
+            content_ids = sync.upsert_contents(
+                [track for _, tracks in playlist_tracks for track in tracks]
+            )
+
+            folder_id = sync.app_folder_id()
+            playlist_ids = sync.child_playlists(folder_id)
+            sync.remove_playlists([
+                playlist_ids.pop(name) for name in removed_playlists if name in playlist_ids
+            ])
+            desired = {}
+            for name, tracks in playlist_tracks:
+                if name not in playlist_ids:
+                    playlist_ids[name] = sync.create_playlist(name, folder_id, PLAYLIST)
+                    sync.stats['added_playlists'] += 1
+                desired[playlist_ids[name]] = [content_ids[track['file_path']] for track in tracks]
+
+            sync.sync_entries([playlist_ids[name] for name, _ in playlist_tracks], desired)
+            return sync.stats
+    finally:
+        conn.close()
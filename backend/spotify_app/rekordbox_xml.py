@@ -0,0 +1,283 @@
+"""
+Streaming reader/writer for Rekordbox XML exports
+
+Large collections (tens of thousands of tracks, 100+ MB) are never loaded
+as a whole tree. index_xml() makes one iterparse pass, keeping only what
+the sync needs (track locations and IDs, playlist names, the app folder)
+and discarding each element once it has been read. write_xml() makes a
+second SAX pass that copies the document through unchanged while splicing
+new collection tracks in and replacing, adding or removing playlist nodes
+in the app folder, writing to a temporary file that replaces the original
+only once it is complete.
+"""
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+from urllib.parse import quote, unquote
+from xml.sax import make_parser
+from xml.sax.handler import ContentHandler
+from xml.sax.saxutils import XMLGenerator
+from xml.sax.xmlreader import AttributesImpl
+
+# Folder under the playlist tree holding the playlists managed by this app
+APP_FOLDER_NAME = 'Rekordbox Manager'
+
+INDENT = '  '
+
+
+def track_location(file_path):
+    """Rekordbox Location URL of a local file"""
+    return f'file://localhost{quote(file_path)}'
+
+
+def location_key(location):
+    """
+    Location compared without percent-encoding: earlier syncs wrote paths
+    unquoted, so 'A B.mp3' and 'A%20B.mp3' are the same track
+    """
+    return unquote(location)
+
+
+class XmlIndex:
+    def __init__(self):
+        self.has_collection = False
+        self.has_playlists = False
+        self.tracks = {}  # location_key(Location) -> TrackID
+        self.max_track_id = 0
+        self.playlist_names = set()
+        self.has_app_folder = False
+        self.app_playlists = {}  # Name -> [TrackID, ...] of playlists in the app folder
+
+
+def index_xml(xml_path):
+    """
+    Index tracks and playlists of a Rekordbox XML file in one streaming pass.
+    Raises xml.etree.ElementTree.ParseError on malformed XML.
+    """
+    index = XmlIndex()
+    path = []  # Open elements from the root down
+    app_folder = None
+
+    for event, elem in ET.iterparse(xml_path, events=('start', 'end')):
+        if event == 'start':
+            parent = path[-1] if path else None
+            path.append(elem)
+            if elem.tag == 'COLLECTION':
+                index.has_collection = True
+            elif elem.tag == 'PLAYLISTS':
+                index.has_playlists = True
+            elif elem.tag == 'NODE' and elem.get('Type') == '0' and elem.get('Name') == APP_FOLDER_NAME:
+                if app_folder is None:
+                    app_folder = elem
+                    index.has_app_folder = True
+            elif elem.tag == 'NODE' and parent is not None and parent is app_folder and elem.get('Type') == '1':
+                index.app_playlists[elem.get('Name')] = []
+            continue
+
+        path.pop()
+        parent = path[-1] if path else None
+        grandparent = path[-2] if len(path) > 1 else None
+
+        if elem.tag == 'TRACK' and parent is not None and parent.tag == 'COLLECTION':
+            track_id = elem.get('TrackID')
+            location = elem.get('Location')
+            if location and track_id:
+                index.tracks.setdefault(location_key(location), track_id)
+            if track_id and track_id.isdigit():
+                index.max_track_id = max(index.max_track_id, int(track_id))
+        elif elem.tag == 'TRACK' and grandparent is not None and grandparent is app_folder:
+            index.app_playlists[parent.get('Name')].append(elem.get('Key'))
+        elif elem.tag == 'NODE' and elem.get('Type') == '1':
+            name = elem.get('Name')
+            if name:
+                index.playlist_names.add(name)
+
+        # Drop the element so memory stays bounded by the tree depth
+        if parent is not None:
+            parent.remove(elem)
+
+    return index
+
+
+class _SpliceHandler(ContentHandler):
+    """Copies SAX events to an XMLGenerator, splicing in tracks and app folder playlists"""
+
+    def __init__(self, out, index, new_tracks, playlists, removed_playlists):
+        super().__init__()
+        self.out = out
+        self.index = index
+        self.new_tracks = new_tracks
+        # Playlists replacing an existing node of the app folder, and ones appended to it
+        self.replaced = {name: track_ids for name, track_ids in playlists if name in index.app_playlists}
+        self.appended = [(name, track_ids) for name, track_ids in playlists if name not in index.app_playlists]
+        self.removed = {name for name in removed_playlists if name in index.app_playlists}
+        self.path = []  # (name, attrs) of open elements
+        self.app_folder_depth = None
+        self.playlist_root_depth = None
+        self.skip_depth = None  # Set while skipping the events of a replaced/removed node
+        self.pending_text = []  # Character data not yet written
+
+    def _flush_text(self, drop_whitespace=False):
+        text = ''.join(self.pending_text)
+        self.pending_text = []
+        if drop_whitespace and not text.strip():
+            return  # Replaced by our own indentation around inserted elements
+        self.out.characters(text)
+
+    def _in_playlists(self):
+        return any(name == 'PLAYLISTS' for name, _ in self.path)
+
+    def _indent(self, depth):
+        self.out.ignorableWhitespace('\n' + INDENT * depth)
+
+    def _element(self, name, attrs, depth, children=()):
+        self._indent(depth)
+        self.out.startElement(name, AttributesImpl(attrs))
+        for child_name, child_attrs in children:
+            self._element(child_name, child_attrs, depth + 1)
+        if children:
+            self._indent(depth)
+        self.out.endElement(name)
+
+    def _playlist_node(self, name, track_ids, depth):
+        self._element('NODE', {
+            'Type': '1',
+            'Name': name,
+            'KeyType': '0',
+            'Entries': str(len(track_ids)),
+        }, depth, [('TRACK', {'Key': str(track_id)}) for track_id in track_ids])
+
+    def _playlist_nodes(self, depth):
+        for name, track_ids in self.appended:
+            self._playlist_node(name, track_ids, depth)
+
+    def startDocument(self):
+        self.out.startDocument()
+
+    def endDocument(self):
+        self._flush_text()
+        self.out.endDocument()
+
+    def characters(self, content):
+        if self.skip_depth is None:
+            self.pending_text.append(content)
+
+    def ignorableWhitespace(self, content):
+        if self.skip_depth is None:
+            self.pending_text.append(content)
+
+    def startElement(self, name, attrs):
+        if self.skip_depth is not None:
+            self.path.append((name, None))
+            return
+
+        attrs = dict(attrs)
+        depth = len(self.path)
+        parent = self.path[-1][0] if self.path else None
+
+        if (name == 'NODE' and self.app_folder_depth is not None and depth == self.app_folder_depth + 1
+                and attrs.get('Type') == '1'):
+            playlist_name = attrs.get('Name')
+            if playlist_name in self.removed:
+                self._flush_text(drop_whitespace=True)
+                self.skip_depth = depth
+                self.path.append((name, attrs))
+                return
+            if playlist_name in self.replaced:
+                self._flush_text(drop_whitespace=True)
+                self._playlist_node(playlist_name, self.replaced[playlist_name], depth)
+                self.skip_depth = depth
+                self.path.append((name, attrs))
+                return
+
+        self._flush_text()
+
+        if name == 'COLLECTION' and self.new_tracks:
+            attrs['Entries'] = str(int(attrs.get('Entries', 0)) + len(self.new_tracks))
+        elif name == 'NODE' and self._in_playlists():
+            if (self.app_folder_depth is None and attrs.get('Type') == '0'
+                    and attrs.get('Name') == APP_FOLDER_NAME):
+                self.app_folder_depth = depth
+                count = int(attrs.get('Count', 0)) + len(self.appended) - len(self.removed)
+                attrs['Count'] = str(max(count, 0))
+            elif parent == 'PLAYLISTS' and self.playlist_root_depth is None:
+                # Top-level ROOT node: the app folder is created under it when missing
+                self.playlist_root_depth = depth
+                if not self.index.has_app_folder:
+                    attrs['Count'] = str(int(attrs.get('Count', 0)) + 1)
+
+        self.path.append((name, attrs))
+        self.out.startElement(name, AttributesImpl(attrs))
+
+    def endElement(self, name):
+        self.path.pop()
+        depth = len(self.path)
+
+        if self.skip_depth is not None:
+            if depth == self.skip_depth:
+                self.skip_depth = None
+            return
+
+        if name == 'COLLECTION' and self.new_tracks:
+            self._flush_text(drop_whitespace=True)
+            for attrs in self.new_tracks:
+                self._element('TRACK', attrs, depth + 1)
+            self._indent(depth)
+        elif name == 'NODE' and depth == self.app_folder_depth and self.appended:
+            self._flush_text(drop_whitespace=True)
+            self._playlist_nodes(depth + 1)
+            self._indent(depth)
+        elif not self.index.has_app_folder and (
+                (name == 'NODE' and depth == self.playlist_root_depth)
+                or (name == 'PLAYLISTS' and self.playlist_root_depth is None)):
+            # No app folder yet: create it at the end of the ROOT node
+            # (or of PLAYLISTS itself if the file has no ROOT node)
+            self._flush_text(drop_whitespace=True)
+            self._indent(depth + 1)
+            self.out.startElement('NODE', AttributesImpl({
+                'Type': '0',
+                'Name': APP_FOLDER_NAME,
+                'Count': str(len(self.appended)),
+            }))
+            self._playlist_nodes(depth + 2)
+            if self.appended:
+                self._indent(depth + 1)
+            self.out.endElement('NODE')
+            self._indent(depth)
+
+        self._flush_text()
+        self.out.endElement(name)
+
+
+def write_xml(xml_path, index, new_tracks, playlists, removed_playlists=()):
+    """
+    Rewrite xml_path in a streaming pass, adding new tracks to COLLECTION
+    and writing playlists into the app folder. Other nodes are copied as is.
+
+    new_tracks: list of TRACK attribute dicts
+    playlists: list of (name, [TrackID, ...]) replacing the app folder
+        playlist of the same name, or appended to the folder
+    removed_playlists: names of app folder playlists to drop
+    """
+    directory = os.path.dirname(os.path.abspath(xml_path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.rekordbox-', suffix='.xml', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as out:
+            parser = make_parser()
+            parser.setContentHandler(_SpliceHandler(
+                XMLGenerator(out, encoding='utf-8', short_empty_elements=True),
+                index, new_tracks, playlists, removed_playlists,
+            ))
+            parser.parse(xml_path)
+            out.write('\n')
+            out.flush()
+            os.fsync(out.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(xml_path).st_mode & 0o777)
+        except OSError:
+            pass
+        os.replace(tmp_path, xml_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
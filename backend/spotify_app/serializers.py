@@ -9,4 +9,19 @@ class SpotifySongSerializer(serializers.ModelSerializer):
 class SoundCloudSongSerializer(serializers.ModelSerializer):
     class Meta:
         model = SoundCloudSong
-        fields = ['id', 'spotify_song', 'soundcloud_id', 'title', 'artist', 'icon', 'duration_ms', 'url', 'stream_url', 'created_at', 'download_status', 'download_progress', 'bpm', 'key']
\ No newline at end of file
+        fields = ['id', 'spotify_song', 'soundcloud_id', 'title', 'artist', 'icon', 'duration_ms', 'url', 'stream_url', 'created_at', 'download_status', 'download_progress', 'bpm', 'key', 'download_bytes', 'download_seconds', 'download_resumed_bytes', 'download_throughput']
+
+class SpotifySongListSerializer(serializers.Serializer):
+    """Flat row for the saved songs list, read from a values() queryset joined with SoundCloudSong"""
+    id = serializers.IntegerField()
+    icon = serializers.URLField()
+    title = serializers.CharField()
+    artist = serializers.CharField()
+    added_at = serializers.DateTimeField()
+    saved_at = serializers.DateTimeField()
+    spotify_id = serializers.CharField()
+    is_saved = serializers.BooleanField()
+    in_playlist = serializers.BooleanField()
+    bpm = serializers.FloatField()
+    key = serializers.CharField()
+    download_status = serializers.CharField()
@@ -0,0 +1,112 @@
+"""
+SoundCloud client_id provider
+
+SoundCloud's public API needs the client_id embedded in the soundcloud.com
+web app. Scraping it means downloading the homepage and its JS bundles, so
+the value is kept in memory and in the database (ServiceCredential) and is
+only scraped again once it is older than SOUNDCLOUD_CLIENT_ID_TTL or the API
+rejects it. When a scrape is needed the bundles are fetched concurrently.
+"""
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+from .http_client import soundcloud_web
+from .models import ServiceCredential
+
+CREDENTIAL_NAME = 'soundcloud_client_id'
+
+BUNDLE_FETCH_WORKERS = 8
+
+
+def _find_client_id(js_url):
+    js_code = soundcloud_web.get(js_url).text
+    match = re.search(r'client_id:"([a-zA-Z0-9]+)"', js_code)
+    return match.group(1) if match else None
+
+
+def scrape_client_id():
+    """Fetch a fresh SoundCloud client_id from the public web app."""
+    homepage = soundcloud_web.get("https://soundcloud.com")
+    # Find JavaScript bundles
+    js_urls = re.findall(r'src="(https://a-v2\.sndcdn\.com/assets/[^"]+\.js)"', homepage.text)
+    if not js_urls:
+        return None
+
+    executor = ThreadPoolExecutor(max_workers=min(BUNDLE_FETCH_WORKERS, len(js_urls)))
+    try:
+        # The client_id usually lives in one of the last bundles
+        futures = [executor.submit(_find_client_id, url) for url in reversed(js_urls)]
+        for future in as_completed(futures):
+            try:
+                client_id = future.result()
+            except requests.RequestException:
+                continue
+            if client_id:
+                return client_id
+    finally:
+        # Don't wait for the remaining bundles once the client_id is found
+        executor.shutdown(wait=False, cancel_futures=True)
+    return None
+
+
+class SoundCloudClientIdProvider:
+    def __init__(self):
+        self._client_id = None
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def _fresh(self, fetched_at):
+        ttl = timedelta(seconds=settings.SOUNDCLOUD_CLIENT_ID_TTL)
+        return fetched_at is not None and timezone.now() - fetched_at < ttl
+
+    def get_client_id(self):
+        """Return a cached client_id, scraping a new one only when needed"""
+        if self._client_id and self._fresh(self._fetched_at):
+            metrics.incr('soundcloud_client_id.hit')
+            return self._client_id
+
+        with self._lock:
+            if self._client_id and self._fresh(self._fetched_at):
+                metrics.incr('soundcloud_client_id.hit')
+                return self._client_id
+
+            stored = ServiceCredential.objects.filter(name=CREDENTIAL_NAME).first()
+            if stored and self._fresh(stored.fetched_at):
+                metrics.incr('soundcloud_client_id.db_hit')
+                self._client_id, self._fetched_at = stored.value, stored.fetched_at
+                return self._client_id
+
+            metrics.incr('soundcloud_client_id.scrape')
+            try:
+                client_id = scrape_client_id()
+            except requests.RequestException as e:
+                print(f"Error getting SoundCloud client_id: {e}")
+                client_id = None
+            if not client_id:
+                metrics.incr('soundcloud_client_id.scrape_error')
+                return None
+
+            self._client_id, self._fetched_at = client_id, timezone.now()
+            ServiceCredential.objects.update_or_create(
+                name=CREDENTIAL_NAME,
+                defaults={'value': client_id, 'fetched_at': self._fetched_at},
+            )
+            return client_id
+
+    def invalidate(self, client_id):
+        """Forget a client_id the API rejected (no-op if it was already replaced)"""
+        with self._lock:
+            if self._client_id == client_id:
+                self._client_id = None
+                self._fetched_at = None
+            ServiceCredential.objects.filter(name=CREDENTIAL_NAME, value=client_id).delete()
+
+
+soundcloud_client_id_provider = SoundCloudClientIdProvider()
@@ -0,0 +1,120 @@
+"""
+Spotify client-credentials token provider
+
+The access token is cached in-process and in Django's cache (shared between
+the processes of the container, see CACHES) until shortly before it
+expires. Only one thread per process refreshes it at a time; the others
+wait for that refresh and reuse its token. Spotify API calls answered with
+401 invalidate the token (see http_client).
+"""
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+from .http_client import spotify_accounts
+
+TOKEN_URL = 'https://accounts.spotify.com/api/token'
+CACHE_KEY = 'spotify_access_token'
+
+# Refresh this many seconds before the token actually expires
+EXPIRY_MARGIN = 60
+
+
+class SpotifyTokenError(Exception):
+    """Spotify answered the token request with 200 but no usable access token"""
+
+
+class SpotifyTokenProvider:
+    def __init__(self):
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def _valid(self, expires_at):
+        return expires_at - EXPIRY_MARGIN > time.time()
+
+    def get_token(self):
+        """Return a valid access token, or None if Spotify refused to issue one"""
+        if self._token and self._valid(self._expires_at):
+            metrics.incr('spotify_token.hit')
+            return self._token
+
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            if self._token and self._valid(self._expires_at):
+                metrics.incr('spotify_token.hit')
+                return self._token
+
+            cached = cache.get(CACHE_KEY)
+            if cached and cached[0] and self._valid(cached[1]):
+                metrics.incr('spotify_token.shared_cache_hit')
+                self._token, self._expires_at = cached
+                return self._token
+
+            try:
+                return self._refresh()
+            except SpotifyTokenError as e:
+                print(f"Error getting Spotify access token: {e}")
+                return None
+
+    def _refresh(self):
+        """
+        Request a new token and cache it. Returns None when the request fails;
+        raises SpotifyTokenError when Spotify answers without a token.
+        """
+        metrics.incr('spotify_token.refresh')
+        started_at = time.monotonic()
+        try:
+            response = spotify_accounts.post(TOKEN_URL, {
+                'grant_type': 'client_credentials',
+                'client_id': settings.SPOTIFY_CLIENT_ID,
+                'client_secret': settings.SPOTIFY_CLIENT_SECRET,
+            })
+        except requests.RequestException as e:
+            metrics.incr('spotify_token.refresh_error')
+            print(f"Error getting Spotify access token: {e}")
+            return None
+        finally:
+            metrics.observe('spotify_token.refresh', time.monotonic() - started_at)
+
+        if response.status_code != 200:
+            metrics.incr('spotify_token.refresh_error')
+            return None
+
+        try:
+            data = response.json()
+            token = data['access_token']
+            expires_in = int(data.get('expires_in', 3600))
+        except (ValueError, KeyError, TypeError) as e:
+            # Never cache a missing token: callers would send "Bearer None"
+            metrics.incr('spotify_token.refresh_error')
+            raise SpotifyTokenError(f'Malformed Spotify token response: {e!r}') from e
+        if not token:
+            metrics.incr('spotify_token.refresh_error')
+            raise SpotifyTokenError('Spotify token response has an empty access_token')
+
+        self._token = token
+        self._expires_at = time.time() + expires_in
+        cache.set(CACHE_KEY, (self._token, self._expires_at), timeout=max(expires_in - EXPIRY_MARGIN, 1))
+        return self._token
+
+    def invalidate(self, token=None):
+        """
+        Drop the cached token, e.g. after Spotify answered 401. With token, only
+        if that is still the cached one, so a token another thread has just
+        refreshed isn't thrown away.
+        """
+        with self._lock:
+            if token is None or self._token == token:
+                self._token = None
+                self._expires_at = 0
+            cached = cache.get(CACHE_KEY)
+            if cached and (token is None or cached[0] == token):
+                cache.delete(CACHE_KEY)
+
+
+spotify_token_provider = SpotifyTokenProvider()
@@ -0,0 +1,156 @@
+"""
+Spotify track metadata, served locally where possible
+
+Library songs store their metadata on SpotifySong (filled by the playlist
+sync or by the enrich_spotify_metadata command). Tracks looked up recently
+stay in an in-memory LRU of TRACK_CACHE_SIZE entries, refreshed whenever
+this process stores new metadata and expiring after TRACK_CACHE_TTL so
+metadata stored by other processes shows up too. Everything else is fetched
+with the batch tracks endpoint, 50 ids per call, and stored for next time.
+An access token is only needed (and only requested) for that last step.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.utils import timezone
+
+from .http_client import spotify_api
+from .models import SpotifySong
+from .spotify_auth import spotify_token_provider
+
+# Maximum number of ids accepted by Spotify's /v1/tracks
+TRACKS_BATCH = 50
+TRACK_CACHE_SIZE = 2000
+TRACK_CACHE_TTL = 600
+
+METADATA_FIELDS = ['title', 'artist', 'icon', 'album_name', 'duration_ms', 'release_date', 'preview_url']
+
+
+class TokenUnavailable(Exception):
+    """Tracks had to be fetched from Spotify but no access token could be obtained"""
+
+
+class _LRUCache:
+    def __init__(self, size, ttl):
+        self._size = size
+        self._ttl = ttl
+        self._items = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            found = {}
+            for key in keys:
+                if key not in self._items:
+                    continue
+                expires_at, value = self._items[key]
+                if expires_at <= now:
+                    del self._items[key]
+                    continue
+                self._items.move_to_end(key)
+                found[key] = value
+            return found
+
+    def set_many(self, items):
+        expires_at = time.monotonic() + self._ttl
+        with self._lock:
+            for key, value in items.items():
+                self._items[key] = (expires_at, value)
+                self._items.move_to_end(key)
+            while len(self._items) > self._size:
+                self._items.popitem(last=False)
+
+
+_cache = _LRUCache(TRACK_CACHE_SIZE, TRACK_CACHE_TTL)
+
+
+def metadata_from_track(track):
+    """SpotifySong field values from a Spotify track object"""
+    album = track.get('album') or {}
+    return {
+        'title': track.get('name', ''),
+        'artist': ', '.join(artist['name'] for artist in track.get('artists', [])),
+        'icon': (album.get('images') or [{}])[0].get('url'),
+        'album_name': album.get('name') or '',
+        'duration_ms': track.get('duration_ms'),
+        'release_date': album.get('release_date') or '',
+        'preview_url': track.get('preview_url'),
+    }
+
+
+def _from_song(song):
+    return {'spotify_id': song.spotify_id, **{field: getattr(song, field) for field in METADATA_FIELDS}}
+
+
+def fetch_tracks(spotify_ids, access_token):
+    """
+    {spotify_id: metadata} fetched from Spotify, TRACKS_BATCH ids per call.
+    Ids Spotify doesn't know are left out. Raises requests.RequestException.
+    """
+    tracks = {}
+    for i in range(0, len(spotify_ids), TRACKS_BATCH):
+        response = spotify_api.get(
+            'https://api.spotify.com/v1/tracks',
+            headers={'Authorization': f'Bearer {access_token}'},
+            params={'ids': ','.join(spotify_ids[i:i + TRACKS_BATCH])},
+        )
+        response.raise_for_status()
+        for track in response.json().get('tracks', []):
+            if track:
+                tracks[track['id']] = {'spotify_id': track['id'], **metadata_from_track(track)}
+    return tracks
+
+
+def store_tracks(tracks):
+    """
+    Save fetched metadata on the library songs among tracks ({spotify_id: metadata})
+    and refresh it in the LRU
+    """
+    now = timezone.now()
+    songs = list(SpotifySong.objects.filter(spotify_id__in=list(tracks)))
+    for song in songs:
+        for field in METADATA_FIELDS:
+            setattr(song, field, tracks[song.spotify_id][field])
+        song.metadata_fetched_at = now
+    SpotifySong.objects.bulk_update(songs, METADATA_FIELDS + ['metadata_fetched_at'], batch_size=500)
+    _cache.set_many(tracks)
+    return len(songs)
+
+
+def get_tracks(spotify_ids, access_token=None):
+    """
+    {spotify_id: metadata} from the LRU, then the database, then Spotify.
+    Without access_token one is requested only if tracks have to be fetched.
+    Ids Spotify doesn't know are left out. When tracks have to be fetched,
+    raises TokenUnavailable without a token and requests.RequestException
+    when Spotify can't be reached.
+    """
+    spotify_ids = list(dict.fromkeys(spotify_ids))
+    tracks = _cache.get_many(spotify_ids)
+
+    missing = [spotify_id for spotify_id in spotify_ids if spotify_id not in tracks]
+    if missing:
+        stored = {
+            song.spotify_id: _from_song(song)
+            for song in SpotifySong.objects.filter(spotify_id__in=missing, metadata_fetched_at__isnull=False)
+        }
+        _cache.set_many(stored)
+        tracks.update(stored)
+
+    missing = [spotify_id for spotify_id in spotify_ids if spotify_id not in tracks]
+    if missing:
+        access_token = access_token or spotify_token_provider.get_token()
+        if not access_token:
+            raise TokenUnavailable('Unable to retrieve Spotify access token')
+        fetched = fetch_tracks(missing, access_token)
+        store_tracks(fetched)
+        tracks.update(fetched)
+    # Copies, so callers can't modify the cached entries
+    return {spotify_id: dict(track) for spotify_id, track in tracks.items()}
+
+
+def get_track(spotify_id, access_token=None):
+    """Metadata of one track, or None if Spotify doesn't know it"""
+    return get_tracks([spotify_id], access_token).get(spotify_id)
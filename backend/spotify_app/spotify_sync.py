@@ -0,0 +1,196 @@
+"""
+Incremental Spotify playlist sync
+
+The playlist's snapshot_id changes whenever its contents change, so a sync
+first asks Spotify for the snapshot only and stops there when it matches
+the stored one. Otherwise it pages through the playlist's track ids only
+(tracks can have been removed, added or moved anywhere, so no position can
+be trusted), fetches full track objects for the ids not yet known with the
+batch tracks endpoint and inserts them in a single transaction.
+
+An unchanged playlist costs one call. A changed one costs one call per
+PAGE_SIZE tracks (100 calls for 10,000 tracks, ids only) plus one per 50
+new tracks. Spotify has no change feed that would allow less without
+missing tracks added after a removal or a reorder.
+
+The membership index (SpotifyPlaylistTrack) mirrors which tracks are in the
+playlist right now, so membership checks are a local lookup. It is updated
+from the same id list, by sync_playlist or by refresh_membership when only
+the index is needed, and only the difference is written.
+"""
+import os
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .http_client import spotify_api
+from .materialize import download_path
+from .models import PlaylistSong, SoundCloudSong, SpotifyPlaylistSyncState, SpotifyPlaylistTrack, SpotifySong
+from .playlists import invalidate_playlist_summaries
+from .reconciler import playlist_reconciler
+from .spotify_metadata import TRACKS_BATCH, fetch_tracks
+
+# Maximum page size of the playlist items endpoint
+PAGE_SIZE = 100
+
+ITEM_FIELDS = 'items(track(id),added_at)'
+
+
+def sync_playlist(playlist_id, access_token):
+    """
+    Bring SpotifySong rows and the membership index up to date with the Spotify playlist.
+    Returns a summary with the number of songs created and HTTP calls made.
+    Raises requests.RequestException when Spotify can't be reached.
+    """
+    url = f'https://api.spotify.com/v1/playlists/{playlist_id}'
+    headers = {'Authorization': f'Bearer {access_token}'}
+
+    snapshot_id, total = _snapshot(url, headers)
+    http_calls = 1
+
+    state, _ = SpotifyPlaylistSyncState.objects.get_or_create(playlist_id=playlist_id)
+    if state.snapshot_id == snapshot_id:
+        return {'unchanged': True, 'created': 0, 'http_calls': http_calls}
+
+    items, calls = _playlist_items(url, headers, total)
+    http_calls += calls
+
+    known_ids = set(SpotifySong.objects.values_list('spotify_id', flat=True))
+    new_items = {spotify_id: added_at for spotify_id, added_at in items.items() if spotify_id not in known_ids}
+    tracks = fetch_tracks(list(new_items), access_token) if new_items else {}
+    http_calls += -(-len(new_items) // TRACKS_BATCH)
+
+    now = timezone.now()
+    new_songs = [
+        SpotifySong(
+            **tracks[spotify_id],
+            metadata_fetched_at=now,
+            is_saved=False,
+            added_at=added_at or now,  # Store the Spotify added_at timestamp
+        )
+        for spotify_id, added_at in new_items.items() if spotify_id in tracks
+    ]
+
+    with transaction.atomic():
+        SpotifySong.objects.bulk_create(new_songs, batch_size=500, ignore_conflicts=True)
+        _update_index(playlist_id, set(items))
+        state.snapshot_id = snapshot_id
+        state.membership_snapshot_id = snapshot_id
+        state.save(update_fields=['snapshot_id', 'membership_snapshot_id', 'synced_at'])
+
+    return {'unchanged': False, 'created': len(new_songs), 'http_calls': http_calls}
+
+
+def refresh_membership(playlist_id, access_token):
+    """
+    Bring the membership index up to date with the Spotify playlist.
+    Returns a summary with the number of tracks added/removed and HTTP calls made.
+    Raises requests.RequestException when Spotify can't be reached.
+    """
+    url = f'https://api.spotify.com/v1/playlists/{playlist_id}'
+    headers = {'Authorization': f'Bearer {access_token}'}
+
+    snapshot_id, total = _snapshot(url, headers)
+    http_calls = 1
+
+    state, _ = SpotifyPlaylistSyncState.objects.get_or_create(playlist_id=playlist_id)
+    if state.membership_snapshot_id == snapshot_id:
+        return {'unchanged': True, 'added': 0, 'removed': 0, 'http_calls': http_calls}
+
+    items, calls = _playlist_items(url, headers, total)
+    http_calls += calls
+
+    with transaction.atomic():
+        added, removed = _update_index(playlist_id, set(items))
+        # If the playlist changed while paging, the next refresh sees a newer snapshot and rescans
+        state.membership_snapshot_id = snapshot_id
+        state.save(update_fields=['membership_snapshot_id', 'synced_at'])
+
+    return {'unchanged': False, 'added': added, 'removed': removed, 'http_calls': http_calls}
+
+
+def _playlist_items(url, headers, total):
+    """({spotify_id: added_at} of every track in the playlist, HTTP calls made)"""
+    items = {}
+    http_calls = 0
+    for offset in range(0, total, PAGE_SIZE):
+        response = spotify_api.get(
+            f'{url}/tracks',
+            headers=headers,
+            params={'limit': PAGE_SIZE, 'offset': offset, 'fields': ITEM_FIELDS},
+        )
+        response.raise_for_status()
+        http_calls += 1
+        for item in response.json().get('items', []):
+            track_id = (item.get('track') or {}).get('id')
+            if track_id:  # Local files and unavailable tracks have no id
+                items.setdefault(track_id, item.get('added_at'))
+    return items, http_calls
+
+
+def _update_index(playlist_id, remote_ids):
+    """Make the membership index hold exactly remote_ids; returns (added, removed) counts"""
+    index = SpotifyPlaylistTrack.objects.filter(playlist_id=playlist_id)
+    indexed_ids = set(index.values_list('spotify_id', flat=True))
+    removed = indexed_ids - remote_ids
+    added = remote_ids - indexed_ids
+    if removed:
+        index.filter(spotify_id__in=removed).delete()
+    SpotifyPlaylistTrack.objects.bulk_create(
+        [SpotifyPlaylistTrack(playlist_id=playlist_id, spotify_id=track_id) for track_id in added],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+    return len(added), len(removed)
+
+
+def is_listed(playlist_id, spotify_id):
+    """Whether the membership index has the track (call refresh_membership first)"""
+    return SpotifyPlaylistTrack.objects.filter(playlist_id=playlist_id, spotify_id=spotify_id).exists()
+
+
+def prune_removed_songs(playlist_id):
+    """
+    Delete every SpotifySong no longer in the playlist (with its matches and
+    playlist entries), and hand their downloaded files to the reconciler.
+    Returns the deleted spotify_ids. Does nothing while the index is empty,
+    so a missing refresh can't wipe the library.
+    """
+    from .views.utils import partial_downloads  # views import this module
+
+    if not SpotifyPlaylistTrack.objects.filter(playlist_id=playlist_id).exists():
+        return []
+    listed = Exists(SpotifyPlaylistTrack.objects.filter(playlist_id=playlist_id, spotify_id=OuterRef('spotify_id')))
+    removed = SpotifySong.objects.filter(~listed)
+    library = download_path()
+    with transaction.atomic():
+        spotify_ids = list(removed.values_list('spotify_id', flat=True))
+        if not spotify_ids:
+            return []
+
+        # The library file, partial downloads and playlist folder copies of each match
+        discarded = []
+        for soundcloud_song_id, artist, title in SoundCloudSong.objects.filter(
+            spotify_song__in=removed
+        ).values_list('id', 'artist', 'title'):
+            discarded.append(os.path.join(library, f'{artist} - {title}.mp3'))
+            discarded.extend(partial_downloads(soundcloud_song_id))
+        for name, artist, title in PlaylistSong.objects.filter(
+            spotify_song__in=removed, spotify_song__soundcloud_match__isnull=False
+        ).values_list('playlist__name', 'spotify_song__soundcloud_match__artist',
+                      'spotify_song__soundcloud_match__title'):
+            discarded.append(os.path.join(library, name, f'{artist} - {title}.mp3'))
+
+        removed.delete()
+        playlist_reconciler.discard(paths=discarded)
+        invalidate_playlist_summaries()
+    return spotify_ids
+
+
+def _snapshot(url, headers):
+    """(snapshot_id, number of tracks) of a playlist, in one small request"""
+    response = spotify_api.get(url, headers=headers, params={'fields': 'snapshot_id,tracks.total'})
+    response.raise_for_status()
+    playlist = response.json()
+    return playlist['snapshot_id'], playlist['tracks']['total']
@@ -0,0 +1,1328 @@
+import base64
+import contextlib
+import errno
+import importlib
+import json
+import os
+import sqlite3
+import tempfile
+import xml.etree.ElementTree as ET
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.apps import apps as django_apps
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from urllib3.response import HTTPResponse
+
+from .analysis import AnalysisEngine
+from .apps import _is_server_process
+from .bandwidth import MIN_JOB_RATE, BandwidthBudget
+from .db import configure_connection, describe_connection
+from .download_queue import DownloadQueue
+from .http_client import MAX_RETRY_AFTER, _Retry, soundcloud_api, soundcloud_web, spotify_accounts, spotify_api
+from .matching import rank_candidates, score_candidate
+from .materialize import AUTO, COPY, HARDLINK, SYMLINK, is_materialized, materialize
+from .models import (
+    DownloadClaim, PendingRemoval, Playlist, PlaylistSong, RekordboxSyncState, ServiceCredential, SoundCloudSong,
+    SpotifyPlaylistTrack, SpotifySong,
+)
+from .playlists import POSITION_GAP, add_songs, move_songs, refresh_in_playlist, remove_playlist, remove_songs
+from .progress import ProgressWriter
+from .reconciler import PlaylistReconciler, playlist_reconciler
+from .rekordbox_changes import target_signature
+from .rekordbox_db import create_fixture_database, sync_database
+from .rekordbox_xml import APP_FOLDER_NAME, index_xml, write_xml
+from .soundcloud_auth import CREDENTIAL_NAME as SOUNDCLOUD_CREDENTIAL, SoundCloudClientIdProvider
+from .spotify_auth import CACHE_KEY, SpotifyTokenError, SpotifyTokenProvider, spotify_token_provider
+from .spotify_sync import is_listed, prune_removed_songs, sync_playlist
+from .spotify_metadata import TRACK_CACHE_SIZE, TRACK_CACHE_TTL, _LRUCache, get_track, store_tracks
+from .views import get_soundcloud_matches, get_spotify_song, get_spotify_songs
+from .views.rekordbox_views import sync_rekordbox_xml
+from .views.utils import search_soundcloud
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self._data = data
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+class FakeSpotifyPlaylist:
+    """Answers the playlist, playlist items and batch tracks endpoints from a list of track ids"""
+
+    def __init__(self, track_ids):
+        self.track_ids = list(track_ids)
+        self.snapshot = 0
+        self.calls = []
+
+    def change(self, track_ids):
+        self.track_ids = list(track_ids)
+        self.snapshot += 1
+
+    def get(self, url, headers=None, params=None):
+        self.calls.append(url)
+        if url.endswith('/v1/tracks'):
+            return FakeResponse({'tracks': [
+                {'id': track_id, 'name': f'Title {track_id}', 'artists': [{'name': 'Artist'}],
+                 'duration_ms': 200000, 'album': {'name': 'Album', 'images': []}}
+                for track_id in params['ids'].split(',')
+            ]})
+        if url.endswith('/tracks'):
+            page = self.track_ids[params['offset']:params['offset'] + params['limit']]
+            return FakeResponse({'items': [
+                {'track': {'id': track_id}, 'added_at': '2024-01-01T00:00:00Z'} for track_id in page
+            ]})
+        return FakeResponse({'snapshot_id': str(self.snapshot), 'tracks': {'total': len(self.track_ids)}})
+
+
+class SyncPlaylistTests(TestCase):
+    def setUp(self):
+        self.playlist = FakeSpotifyPlaylist([f't{i}' for i in range(100)])
+        patcher = mock.patch.object(spotify_api, 'get', side_effect=self.playlist.get)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_first_sync_creates_all_songs(self):
+        result = sync_playlist('P', 'token')
+        self.assertEqual(result['created'], 100)
+        self.assertEqual(SpotifySong.objects.count(), 100)
+        self.assertEqual(SpotifySong.objects.get(spotify_id='t7').title, 'Title t7')
+
+    def test_unchanged_snapshot_makes_one_call(self):
+        sync_playlist('P', 'token')
+        self.playlist.calls.clear()
+        result = sync_playlist('P', 'token')
+        self.assertTrue(result['unchanged'])
+        self.assertEqual(len(self.playlist.calls), 1)
+
+    def test_remove_then_add_keeping_the_length(self):
+        sync_playlist('P', 'token')
+        # Remove 5 tracks and add 5 new ones: the playlist length stays 100
+        self.playlist.change([f't{i}' for i in range(5, 100)] + [f'new{i}' for i in range(5)])
+        result = sync_playlist('P', 'token')
+        self.assertEqual(result['created'], 5)
+        self.assertTrue(SpotifySong.objects.filter(spotify_id='new4').exists())
+        self.assertTrue(is_listed('P', 'new0'))
+        self.assertFalse(is_listed('P', 't0'))
+
+    def test_reorder_with_new_track_in_the_middle(self):
+        sync_playlist('P', 'token')
+        ids = [f't{i}' for i in range(100)]
+        self.playlist.change(ids[:50] + ['inserted'] + ids[50:99])
+        self.assertEqual(sync_playlist('P', 'token')['created'], 1)
+        self.assertTrue(SpotifySong.objects.filter(spotify_id='inserted').exists())
+
+
+class SpotifySongListQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('tester')
+        now = timezone.now()
+        songs = SpotifySong.objects.bulk_create([
+            SpotifySong(spotify_id=f's{i}', title=f'Song {i}', artist='Artist', added_at=now,
+                        is_saved=True, saved_at=now - timedelta(minutes=i))
+            for i in range(40)
+        ])
+        # Only half of the songs have a SoundCloud match
+        SoundCloudSong.objects.bulk_create([
+            SoundCloudSong(spotify_song=song, soundcloud_id=f'sc{song.pk}', title=song.title, artist=song.artist,
+                           duration_ms=0, url='https://soundcloud.com/', bpm=120.0, key='Am',
+                           download_status='completed')
+            for song in SpotifySong.objects.order_by('id')[:20]
+        ])
+
+    def _get(self, **params):
+        request = APIRequestFactory().get('/api/spotify/songs/', params)
+        force_authenticate(request, user=self.user)
+        return get_spotify_songs(request)
+
+    def test_page_is_one_query_whatever_its_size(self):
+        for page_size in (5, 40):
+            with self.assertNumQueries(1):
+                response = self._get(page=0, page_size=page_size)
+            self.assertEqual(len(response.data['songs']), page_size)
+            self.assertEqual(response.data['total'], 40)
+
+    def test_rows_with_and_without_soundcloud_match(self):
+        with self.assertNumQueries(1):
+            songs = {song['spotify_id']: song for song in self._get(page=0, page_size=40).data['songs']}
+        matched = SoundCloudSong.objects.values_list('spotify_song__spotify_id', flat=True)
+        for spotify_id, song in songs.items():
+            if spotify_id in matched:
+                self.assertEqual((song['bpm'], song['key'], song['download_status']), (120.0, 'Am', 'completed'))
+            else:
+                self.assertEqual((song['bpm'], song['key'], song['download_status']), (None, None, None))
+
+    def test_cursor_page_query_count(self):
+        for page_size in (5, 40):
+            with self.assertNumQueries(1):
+                response = self._get(cursor='', page_size=page_size)
+            self.assertEqual(len(response.data['songs']), page_size)
+
+
+class SpotifySongCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('tester')
+        now = timezone.now()
+        # Songs saved in the same batch share saved_at: only the id orders them
+        for i in range(7):
+            SpotifySong.objects.create(spotify_id=f's{i}', title=f'Song {i}', artist='Artist', added_at=now,
+                                       is_saved=True, saved_at=now - timedelta(minutes=i // 3))
+
+    def _get(self, **params):
+        request = APIRequestFactory().get('/api/spotify/songs/', params)
+        force_authenticate(request, user=self.user)
+        return get_spotify_songs(request)
+
+    def test_pages_follow_saved_at_then_id(self):
+        expected = list(SpotifySong.objects.order_by('-saved_at', '-id').values_list('spotify_id', flat=True))
+        seen = []
+        cursor = ''
+        while True:
+            response = self._get(cursor=cursor, page_size=2)
+            self.assertEqual(response.status_code, 200)
+            seen += [song['spotify_id'] for song in response.data['songs']]
+            if not response.data['has_more']:
+                break
+            cursor = response.data['next_cursor']
+        # Ties on saved_at across page boundaries are neither repeated nor skipped
+        self.assertEqual(seen, expected)
+
+    def test_last_page(self):
+        first = self._get(cursor='', page_size=5)
+        self.assertTrue(first.data['has_more'])
+        last = self._get(cursor=first.data['next_cursor'], page_size=5)
+        self.assertEqual(len(last.data['songs']), 2)
+        self.assertFalse(last.data['has_more'])
+        self.assertIsNone(last.data['next_cursor'])
+
+        # A page that exactly fills the rest has no next page either
+        exact = self._get(cursor='', page_size=7)
+        self.assertEqual(len(exact.data['songs']), 7)
+        self.assertFalse(exact.data['has_more'])
+        self.assertIsNone(exact.data['next_cursor'])
+
+    def test_malformed_cursor(self):
+        for cursor in (
+            'not base64!',
+            base64.urlsafe_b64encode(b'no separator').decode(),
+            base64.urlsafe_b64encode(b'yesterday|1').decode(),
+            base64.urlsafe_b64encode(b'2024-01-01T00:00:00+00:00|x').decode(),
+            base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+        ):
+            response = self._get(cursor=cursor, page_size=2)
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertEqual(response.data, {'error': 'Invalid cursor'})
+
+
+class PlaylistReconcilerTests(TestCase):
+    def setUp(self):
+        self.library = tempfile.TemporaryDirectory()
+        self.addCleanup(self.library.cleanup)
+        self.incoming = os.path.join(self.library.name, '.incoming')
+        os.makedirs(self.incoming)
+        patcher = override_settings(DOWNLOAD_ROOT=self.library.name)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.reconciler = PlaylistReconciler()
+        # Queue removals without starting the background thread
+        self.reconciler.request = mock.Mock()
+
+    def _file(self, *parts):
+        path = os.path.join(self.library.name, *parts)
+        with open(path, 'w'):
+            pass
+        return path
+
+    def test_discarded_files_survive_a_failed_run(self):
+        path = self._file('Gone - Track.mp3')
+        self.reconciler.discard(paths=[path])
+        with mock.patch.object(PlaylistReconciler, '_desired', side_effect=RuntimeError('database down')):
+            with self.assertRaises(RuntimeError):
+                self.reconciler.run_once()
+        self.assertTrue(os.path.exists(path))
+
+        # A later run, e.g. after a restart, still removes the file
+        self.assertEqual(PlaylistReconciler().run_once()['unlink'], 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(PendingRemoval.objects.exists())
+
+    def test_folder_of_deleted_playlist_is_removed_but_not_a_recreated_one(self):
+        os.makedirs(os.path.join(self.library.name, 'Deleted'))
+        os.makedirs(os.path.join(self.library.name, 'Recreated'))
+        Playlist.objects.create(name='Recreated')
+        self.reconciler.discard(folders=['Deleted', 'Recreated'])
+        self.reconciler.run_once()
+        self.assertFalse(os.path.isdir(os.path.join(self.library.name, 'Deleted')))
+        self.assertTrue(os.path.isdir(os.path.join(self.library.name, 'Recreated')))
+        self.assertFalse(PendingRemoval.objects.exists())
+
+    def test_orphaned_partial_downloads_are_removed(self):
+        song = SpotifySong.objects.create(spotify_id='s1', title='Song', artist='Artist', added_at=timezone.now())
+        soundcloud_song = SoundCloudSong.objects.create(
+            spotify_song=song, soundcloud_id='111', title='Song', artist='Artist',
+            duration_ms=0, url='https://soundcloud.com/',
+        )
+        current = self._file('.incoming', f'{soundcloud_song.id}-111.mp3.part')
+        rematched = self._file('.incoming', f'{soundcloud_song.id}-999.mp3.part')
+        deleted = self._file('.incoming', f'{soundcloud_song.id + 1}-222.m4a.part')
+        unrelated = self._file('.incoming', 'notes.txt')
+        self.reconciler.run_once()
+        self.assertTrue(os.path.exists(current))
+        self.assertTrue(os.path.exists(unrelated))
+        self.assertFalse(os.path.exists(rematched))
+        self.assertFalse(os.path.exists(deleted))
+
+
+class DownloadProgressStreamTests(TestCase):
+    def test_unauthenticated_request_gets_a_json_error(self):
+        response = APIClient().get('/api/spotify/download-progress/stream/', HTTP_ACCEPT='text/event-stream')
+        self.assertIn(response.status_code, (401, 403))
+        self.assertIn('detail', json.loads(response.content))
+
+
+class SpotifyUnauthorizedRetryTests(TestCase):
+    def setUp(self):
+        self.requests = []
+        patchers = [
+            mock.patch('requests.Session.request', side_effect=self._request),
+            mock.patch.object(SpotifyTokenProvider, '_refresh', autospec=True, side_effect=self._refresh),
+            mock.patch.multiple(spotify_token_provider, _token='revoked', _expires_at=time.time() + 3600),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache.delete(CACHE_KEY)
+
+    def _request(self, method, url, headers=None, **kwargs):
+        self.requests.append(headers['Authorization'])
+        if headers['Authorization'] == 'Bearer revoked':
+            return FakeResponse({'error': {'status': 401}}, status_code=401)
+        return FakeResponse({'id': 't1'})
+
+    def _refresh(self, provider):
+        provider._token, provider._expires_at = 'fresh', time.time() + 3600
+        return provider._token
+
+    def test_401_refreshes_the_token_and_retries_once(self):
+        response = spotify_api.get('https://api.spotify.com/v1/tracks/t1',
+                                   headers={'Authorization': 'Bearer revoked'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.requests, ['Bearer revoked', 'Bearer fresh'])
+        self.assertEqual(spotify_token_provider.get_token(), 'fresh')
+
+    def test_stale_token_of_a_caller_does_not_discard_a_fresh_one(self):
+        spotify_token_provider._token = 'fresh'
+        response = spotify_api.get('https://api.spotify.com/v1/tracks/t1',
+                                   headers={'Authorization': 'Bearer revoked'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(SpotifyTokenProvider._refresh.call_count, 0)
+
+
+class RekordboxDatabaseSyncTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = os.path.join(directory.name, 'master.db')
+        create_fixture_database(self.db_path)
+        self.tracks = [
+            {'title': f'Track {i}', 'artist': f'Artist {i % 2}', 'file_path': f'/music/Artist - Track {i}.mp3',
+             'bpm': 120.0 + i}
+            for i in range(4)
+        ]
+
+    def _entries(self, name):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return [row[0] for row in conn.execute(
+                'SELECT c.Title FROM djmdSongPlaylist s JOIN djmdContent c ON c.ID = s.ContentID '
+                'JOIN djmdPlaylist p ON p.ID = s.PlaylistID WHERE p.Name = ? ORDER BY s.TrackNo', (name,)
+            )]
+        finally:
+            conn.close()
+
+    def test_first_sync(self):
+        stats = sync_database(self.db_path, [('Warmup', self.tracks), ('Peak', self.tracks[2:])])
+        self.assertEqual(stats['added_tracks'], 4)
+        self.assertEqual(stats['added_playlists'], 2)
+        self.assertEqual(stats['added_entries'], 6)
+        self.assertEqual(self._entries('Warmup'), ['Track 0', 'Track 1', 'Track 2', 'Track 3'])
+        self.assertEqual(self._entries('Peak'), ['Track 2', 'Track 3'])
+
+    def test_unchanged_resync_writes_nothing(self):
+        sync_database(self.db_path, [('Warmup', self.tracks)])
+        with open(self.db_path, 'rb') as f:
+            before = f.read()
+        stats = sync_database(self.db_path, [('Warmup', self.tracks)])
+        self.assertEqual(set(stats.values()), {0})
+        with open(self.db_path, 'rb') as f:
+            self.assertEqual(f.read(), before)
+
+    def test_reorder_only_updates_track_numbers(self):
+        sync_database(self.db_path, [('Warmup', self.tracks)])
+        reordered = [self.tracks[3], self.tracks[0], self.tracks[1], self.tracks[2]]
+        stats = sync_database(self.db_path, [('Warmup', reordered)])
+        self.assertEqual(stats['reordered_entries'], 4)
+        self.assertEqual((stats['added_entries'], stats['removed_entries'], stats['added_tracks']), (0, 0, 0))
+        self.assertEqual(self._entries('Warmup'), ['Track 3', 'Track 0', 'Track 1', 'Track 2'])
+
+
+@override_settings(DOWNLOAD_BANDWIDTH_LIMIT_KBPS=512)
+class BandwidthBudgetTests(SimpleTestCase):
+    def test_total_never_exceeds_the_limit(self):
+        budget = BandwidthBudget()
+        limit = 512 * 1024
+        self.assertEqual(budget.max_jobs(), limit // MIN_JOB_RATE)
+
+        with contextlib.ExitStack() as stack:
+            jobs = [{} for _ in range(budget.max_jobs())]
+            for i, params in enumerate(jobs):
+                stack.enter_context(budget.share(params, connections=4 if i % 2 else 1))
+            self.assertLessEqual(budget.stats()['effective_bytes_per_second'], limit)
+            self.assertTrue(all(params['ratelimit'] for params in jobs))
+
+            # One job more than the budget has room for waits for a running one to finish
+            started = threading.Event()
+
+            def extra_job():
+                with budget.share({}):
+                    started.set()
+
+            thread = threading.Thread(target=extra_job)
+            thread.start()
+            self.assertFalse(started.wait(0.2))
+            self.assertEqual(budget.stats()['waiting_jobs'], 1)
+        self.assertTrue(started.wait(5))
+        thread.join()
+        self.assertEqual(budget.stats()['active_jobs'], 0)
+
+    def test_share_is_split_across_connections(self):
+        budget = BandwidthBudget()
+        first, second = {}, {}
+        with budget.share(first), budget.share(second, connections=4):
+            self.assertEqual(first['ratelimit'], 256 * 1024)
+            self.assertEqual(second['ratelimit'], 64 * 1024)
+            self.assertEqual(budget.stats()['effective_bytes_per_second'], 512 * 1024)
+        self.assertEqual(budget.stats()['effective_bytes_per_second'], 0)
+
+
+class LocalTrackMetadataTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('tester')
+        SpotifySong.objects.create(
+            spotify_id='local', title='Local Song', artist='Artist', added_at=timezone.now(),
+            duration_ms=180000, metadata_fetched_at=timezone.now(),
+        )
+
+    def setUp(self):
+        self.get_token = mock.patch.object(spotify_token_provider, 'get_token', return_value=None).start()
+        mock.patch('spotify_app.spotify_metadata._cache', _LRUCache(TRACK_CACHE_SIZE, TRACK_CACHE_TTL)).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _get(self, view, spotify_id):
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=self.user)
+        return view(request, spotify_id=spotify_id)
+
+    def test_local_song_is_served_without_a_token(self):
+        response = self._get(get_spotify_song, 'local')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'Local Song')
+        self.get_token.assert_not_called()
+
+    def test_local_song_matches_are_searched_without_a_token(self):
+        with mock.patch('spotify_app.views.soundcloud_views.search_soundcloud', return_value=[]):
+            response = self._get(get_soundcloud_matches, 'local')
+        self.assertEqual(response.status_code, 200)
+        self.get_token.assert_not_called()
+
+    def test_unknown_song_needs_a_token(self):
+        response = self._get(get_spotify_song, 'unknown')
+        self.assertEqual(response.status_code, 400)
+        self.get_token.assert_called_once()
+
+    def test_stored_metadata_refreshes_the_cache(self):
+        self.assertEqual(get_track('local')['title'], 'Local Song')
+        store_tracks({'local': {**get_track('local'), 'title': 'Renamed'}})
+        self.assertEqual(get_track('local')['title'], 'Renamed')
+
+
+class DownloadQueueRecoveryTests(TestCase):
+    def setUp(self):
+        self.queue = DownloadQueue()
+        self.songs = {}
+        for status in ('running_elsewhere', 'stale', 'unclaimed', 'pending'):
+            spotify_song = SpotifySong.objects.create(spotify_id=status, title=status, artist='Artist',
+                                                      added_at=timezone.now())
+            self.songs[status] = SoundCloudSong.objects.create(
+                spotify_song=spotify_song, soundcloud_id=status, title=status, artist='Artist', duration_ms=0,
+                url='https://soundcloud.com/', download_progress=40,
+                download_status='pending' if status == 'pending' else 'downloading',
+            )
+        DownloadClaim.objects.create(soundcloud_song=self.songs['running_elsewhere'], owner='other:1:a',
+                                     heartbeat=timezone.now())
+        DownloadClaim.objects.create(soundcloud_song=self.songs['stale'], owner='gone:1:b',
+                                     heartbeat=timezone.now() - timedelta(hours=1))
+
+    def _status(self, name):
+        return SoundCloudSong.objects.get(id=self.songs[name].id).download_status
+
+    def test_only_jobs_of_dead_processes_are_reset(self):
+        self.assertEqual(self.queue.recover(), 2)
+        self.assertEqual(self._status('running_elsewhere'), 'downloading')
+        self.assertEqual(self._status('stale'), 'pending')
+        self.assertEqual(self._status('unclaimed'), 'pending')
+        self.assertEqual(list(DownloadClaim.objects.values_list('owner', flat=True)), ['other:1:a'])
+
+    def test_heartbeat_renews_only_own_claims(self):
+        DownloadClaim.objects.filter(owner='gone:1:b').update(owner=self.queue.owner)
+        self.queue.heartbeat()
+        self.assertEqual(self.queue.recover(), 1)  # Only the unclaimed row
+        self.assertEqual(self._status('stale'), 'downloading')
+
+    def test_enqueue_without_a_running_queue_leaves_the_job_pending(self):
+        self.queue.enqueue(self.songs['pending'].id)
+        self.assertEqual(self.queue.stats()['queued'], 0)
+        self.assertFalse(self.queue.stats()['running'])
+
+    def test_background_services_only_start_in_the_server(self):
+        cases = [
+            (['/usr/bin/gunicorn', 'spotify_project.wsgi'], '', True),
+            (['manage.py', 'runserver'], 'true', True),
+            (['manage.py', 'runserver'], '', False),  # The autoreloader parent
+            (['manage.py', 'auto_match_songs'], '', False),
+            (['/usr/bin/pytest'], '', False),
+            (['some_script.py'], '', False),
+        ]
+        for argv, run_main, expected in cases:
+            with self.subTest(argv=argv), mock.patch('sys.argv', argv), \
+                    mock.patch.dict(os.environ, {'RUN_MAIN': run_main}):
+                self.assertEqual(_is_server_process(), expected)
+
+
+class PruneRemovedSongsTests(TestCase):
+    def setUp(self):
+        self.library = tempfile.TemporaryDirectory()
+        self.addCleanup(self.library.cleanup)
+        patcher = override_settings(DOWNLOAD_ROOT=self.library.name)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        mock.patch.object(playlist_reconciler, 'request').start()
+        self.addCleanup(mock.patch.stopall)
+
+        now = timezone.now()
+        self.kept, self.removed = [
+            SpotifySong.objects.create(spotify_id=spotify_id, title=spotify_id, artist='Artist', added_at=now,
+                                       is_saved=True)
+            for spotify_id in ('kept', 'removed')
+        ]
+        SpotifyPlaylistTrack.objects.create(playlist_id='P', spotify_id='kept')
+        match = SoundCloudSong.objects.create(
+            spotify_song=self.removed, soundcloud_id='555', title='Removed', artist='Artist', duration_ms=0,
+            url='https://soundcloud.com/', download_status='completed',
+        )
+        playlist = Playlist.objects.create(name='Set')
+        PlaylistSong.objects.create(playlist=playlist, spotify_song=self.removed, position=1024)
+
+        os.makedirs(os.path.join(self.library.name, 'Set'))
+        os.makedirs(os.path.join(self.library.name, '.incoming'))
+        self.files = [os.path.join(self.library.name, 'Artist - Removed.mp3'),
+                      os.path.join(self.library.name, 'Set', 'Artist - Removed.mp3'),
+                      os.path.join(self.library.name, '.incoming', f'{match.id}-555.mp3.part')]
+        for path in self.files:
+            with open(path, 'w'):
+                pass
+
+    def test_removed_songs_and_their_files_are_deleted(self):
+        self.assertEqual(prune_removed_songs('P'), ['removed'])
+        self.assertEqual(list(SpotifySong.objects.values_list('spotify_id', flat=True)), ['kept'])
+        self.assertFalse(SoundCloudSong.objects.exists())
+        self.assertEqual(set(PendingRemoval.objects.values_list('path', flat=True)), set(self.files))
+
+        PlaylistReconciler().run_once()
+        self.assertFalse(any(os.path.exists(path) for path in self.files))
+
+    def test_empty_index_prunes_nothing(self):
+        SpotifyPlaylistTrack.objects.all().delete()
+        self.assertEqual(prune_removed_songs('P'), [])
+        self.assertEqual(SpotifySong.objects.count(), 2)
+        self.assertFalse(PendingRemoval.objects.exists())
+
+
+REKORDBOX_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<DJ_PLAYLISTS Version="1.0.0">
+  <PRODUCT Name="rekordbox" Version="6.0.0"/>
+  <COLLECTION Entries="3">
+    <TRACK TrackID="1" Name="Night &amp; Day" Artist="Old Form" Location="file://localhost/downloads/Old Form - Night &amp; Day.mp3"/>
+    <TRACK TrackID="2" Name="Quoted" Artist="New Form" Location="file://localhost/downloads/New%20Form%20-%20Quoted.mp3"/>
+    <TRACK TrackID="7" Name="Mine" Artist="User" Location="file://localhost/music/User%20-%20Mine.mp3"/>
+  </COLLECTION>
+  <PLAYLISTS>
+    <NODE Type="0" Name="ROOT" Count="1">
+      <NODE Type="1" Name="User playlist" KeyType="0" Entries="1">
+        <TRACK Key="7"/>
+      </NODE>
+    </NODE>
+  </PLAYLISTS>
+</DJ_PLAYLISTS>
+"""
+
+
+@override_settings(DOWNLOAD_ROOT='/downloads')
+class RekordboxXmlSyncTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.xml_path = os.path.join(directory.name, 'rekordbox.xml')
+        with open(self.xml_path, 'w', encoding='utf-8') as f:
+            f.write(REKORDBOX_XML)
+        self.playlist = Playlist.objects.create(name='Set')
+
+    def _add_song(self, artist, title, playlist=None, position=None):
+        song = SpotifySong.objects.create(spotify_id=f'{artist}-{title}', title=title, artist=artist,
+                                          added_at=timezone.now(), is_saved=True)
+        SoundCloudSong.objects.create(spotify_song=song, soundcloud_id=song.spotify_id, title=title, artist=artist,
+                                      duration_ms=0, url='https://soundcloud.com/', download_status='completed',
+                                      bpm=124.0)
+        PlaylistSong.objects.create(playlist=playlist or self.playlist, spotify_song=song,
+                                    position=position or 1024 * (PlaylistSong.objects.count() + 1))
+        return song
+
+    def _collection(self):
+        return ET.parse(self.xml_path).getroot().find('COLLECTION')
+
+    def _app_playlists(self):
+        root = ET.parse(self.xml_path).getroot()
+        folder = root.find(f".//NODE[@Name='{APP_FOLDER_NAME}']")
+        if folder is None:
+            return {}
+        return {node.get('Name'): [track.get('Key') for track in node] for node in folder}
+
+    def test_tracks_match_in_either_location_encoding(self):
+        self._add_song('Old Form', 'Night & Day')
+        self._add_song('New Form', 'Quoted')
+        response = sync_rekordbox_xml(self.xml_path)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['added_tracks'], 0)
+        self.assertEqual(len(self._collection()), 3)
+        self.assertEqual(self._app_playlists(), {'Set': ['1', '2']})
+
+    def test_index_keys_locations_without_percent_encoding(self):
+        index = index_xml(self.xml_path)
+        self.assertEqual(index.tracks['file://localhost/downloads/New Form - Quoted.mp3'], '2')
+        self.assertEqual(index.tracks['file://localhost/downloads/Old Form - Night & Day.mp3'], '1')
+
+    def _read(self):
+        with open(self.xml_path, encoding='utf-8') as f:
+            return f.read()
+
+    def test_round_trip_keeps_the_rest_of_the_file(self):
+        self._add_song('Old Form', 'Night & Day')
+        self._add_song('Fresh', 'Track')
+        response = sync_rekordbox_xml(self.xml_path)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['added_tracks'], 1)
+        self.assertEqual(response.data['changed_playlists'],
+                         {'Set': {'added': 2, 'removed': 0, 'reordered': 0, 'created': True}})
+
+        root = ET.parse(self.xml_path).getroot()
+        self.assertEqual(root.find('COLLECTION').get('Entries'), '4')
+        new_track = root.find("COLLECTION/TRACK[@TrackID='8']")
+        self.assertEqual(new_track.get('Location'), 'file://localhost/downloads/Fresh%20-%20Track.mp3')
+        self.assertEqual(new_track.get('AverageBpm'), '124.0')
+        self.assertEqual(root.find('PLAYLISTS/NODE').get('Count'), '2')
+        self.assertEqual(root.find(f".//NODE[@Name='{APP_FOLDER_NAME}']").get('Count'), '1')
+        self.assertEqual(self._app_playlists(), {'Set': ['1', '8']})
+
+        # Nodes we don't manage are copied through as they were
+        xml = self._read()
+        for line in ('<PRODUCT Name="rekordbox" Version="6.0.0"/>',
+                     '<TRACK TrackID="7" Name="Mine" Artist="User" '
+                     'Location="file://localhost/music/User%20-%20Mine.mp3"/>',
+                     '<NODE Type="1" Name="User playlist" KeyType="0" Entries="1">\n        <TRACK Key="7"/>'):
+            self.assertIn(line, xml)
+
+    def test_unchanged_playlists_are_skipped(self):
+        other = Playlist.objects.create(name='Other')
+        self._add_song('Fresh', 'Track')
+        self._add_song('Other', 'Song', playlist=other)
+        sync_rekordbox_xml(self.xml_path)
+        written = self._read()
+        signature = target_signature(self.xml_path)
+
+        response = sync_rekordbox_xml(self.xml_path)
+        self.assertEqual(response.data['message'], 'Rekordbox is up to date')
+        self.assertEqual(sorted(response.data['untouched_playlists']), ['Other', 'Set'])
+        self.assertEqual(self._read(), written)
+        self.assertEqual(target_signature(self.xml_path), signature)
+
+        self._add_song('Another', 'Song', playlist=other)
+        response = sync_rekordbox_xml(self.xml_path)
+        self.assertEqual(list(response.data['changed_playlists']), ['Other'])
+        self.assertEqual(response.data['untouched_playlists'], ['Set'])
+        self.assertEqual(response.data['changed_playlists']['Other']['added'], 1)
+
+    def test_replaced_file_invalidates_stored_hashes(self):
+        self._add_song('Fresh', 'Track')
+        sync_rekordbox_xml(self.xml_path)
+
+        # A fresh export from Rekordbox no longer has our folder
+        with open(self.xml_path, 'w', encoding='utf-8') as f:
+            f.write(REKORDBOX_XML)
+        response = sync_rekordbox_xml(self.xml_path)
+        self.assertEqual(list(response.data['changed_playlists']), ['Set'])
+        self.assertTrue(response.data['changed_playlists']['Set']['created'])
+        self.assertEqual(self._app_playlists(), {'Set': ['8']})
+
+    def test_removed_playlists_are_dropped(self):
+        other = Playlist.objects.create(name='Other')
+        self._add_song('Fresh', 'Track')
+        self._add_song('Other', 'Song', playlist=other)
+        sync_rekordbox_xml(self.xml_path)
+        self.assertEqual(set(self._app_playlists()), {'Set', 'Other'})
+
+        other.delete()
+        response = sync_rekordbox_xml(self.xml_path)
+        self.assertEqual(response.data['removed_playlists'], ['Other'])
+        self.assertEqual(response.data['changed_playlists'], {})
+        # Playlists are written by name, so Other's song took TrackID 8
+        self.assertEqual(self._app_playlists(), {'Set': ['9']})
+        root = ET.parse(self.xml_path).getroot()
+        self.assertEqual(root.find(f".//NODE[@Name='{APP_FOLDER_NAME}']").get('Count'), '1')
+        self.assertFalse(RekordboxSyncState.objects.filter(playlist_name='Other').exists())
+        # The track stays in the collection, it may be used elsewhere
+        self.assertEqual(len(self._collection()), 5)
+
+    def test_splice_writer_replaces_appends_and_removes(self):
+        self._add_song('Fresh', 'Track')
+        sync_rekordbox_xml(self.xml_path)
+        index = index_xml(self.xml_path)
+        self.assertEqual(index.app_playlists, {'Set': ['8']})
+
+        new_track = {'TrackID': '9', 'Name': 'N', 'Artist': 'A', 'Location': 'file://localhost/n.mp3'}
+        write_xml(self.xml_path, index, [new_track], [('Set', ['9', '8']), ('Later', ['7'])])
+        self.assertEqual(self._app_playlists(), {'Set': ['9', '8'], 'Later': ['7']})
+        self.assertEqual(self._collection().get('Entries'), '5')
+
+        write_xml(self.xml_path, index_xml(self.xml_path), [], [], ['Set'])
+        self.assertEqual(self._app_playlists(), {'Later': ['7']})
+        self.assertEqual(index_xml(self.xml_path).playlist_names, {'User playlist', 'Later'})
+        # No temporary file is left next to the library
+        self.assertEqual(os.listdir(os.path.dirname(self.xml_path)), ['rekordbox.xml'])
+
+
+class SpotifyTokenRefreshTests(TestCase):
+    def setUp(self):
+        cache.delete(CACHE_KEY)
+        self.addCleanup(cache.delete, CACHE_KEY)
+
+    def _provider_answering(self, data):
+        provider = SpotifyTokenProvider()
+        patcher = mock.patch('spotify_app.spotify_auth.spotify_accounts.post', return_value=FakeResponse(data))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return provider
+
+    def test_token_is_cached(self):
+        provider = self._provider_answering({'access_token': 'abc', 'expires_in': 3600})
+        self.assertEqual(provider.get_token(), 'abc')
+        self.assertEqual(cache.get(CACHE_KEY)[0], 'abc')
+
+    def test_response_without_token_is_not_cached(self):
+        for data in ({'token_type': 'Bearer'}, {'access_token': ''}, {'access_token': None}):
+            with self.subTest(data=data):
+                provider = self._provider_answering(data)
+                with self.assertRaises(SpotifyTokenError):
+                    provider._refresh()
+                self.assertIsNone(provider.get_token())
+                self.assertIsNone(provider._token)
+                self.assertIsNone(cache.get(CACHE_KEY))
+
+
+class PlaylistPositionTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        for i in range(5):
+            SpotifySong.objects.create(spotify_id=f's{i}', title=f'Song {i}', artist='Artist', added_at=now)
+        self.playlist = Playlist.objects.create(name='Set')
+
+    def _order(self):
+        return list(PlaylistSong.objects.filter(playlist=self.playlist).order_by('position', 'id')
+                    .values_list('spotify_song__spotify_id', flat=True))
+
+    def _positions(self):
+        return dict(PlaylistSong.objects.filter(playlist=self.playlist)
+                    .values_list('spotify_song__spotify_id', 'position'))
+
+    def test_add_appends_a_gap_after_the_last_song(self):
+        self.assertEqual(add_songs(self.playlist, ['s0', 's1', 's0', 'unknown']), (['s0', 's1'], [], ['unknown']))
+        self.assertEqual(add_songs(self.playlist, ['s1', 's2']), (['s2'], ['s1'], []))
+        self.assertEqual(self._positions(), {'s0': POSITION_GAP, 's1': 2 * POSITION_GAP, 's2': 3 * POSITION_GAP})
+
+    def test_remove_leaves_other_positions(self):
+        add_songs(self.playlist, ['s0', 's1', 's2'])
+        self.assertEqual(remove_songs(self.playlist, ['s1', 's4']), (['s1'], ['s4']))
+        self.assertEqual(self._positions(), {'s0': POSITION_GAP, 's2': 3 * POSITION_GAP})
+
+    def test_move_into_a_gap_writes_only_the_moved_songs(self):
+        add_songs(self.playlist, ['s0', 's1', 's2', 's3', 's4'])
+        # Savepoint, the moved rows, their neighbours, one UPDATE of the moved row
+        with self.assertNumQueries(5):
+            self.assertEqual(move_songs(self.playlist, ['s4', 'unknown'], 1), (['s4'], ['unknown']))
+        self.assertEqual(self._order(), ['s0', 's4', 's1', 's2', 's3'])
+        positions = self._positions()
+        self.assertEqual(positions['s4'], POSITION_GAP + POSITION_GAP // 2)
+        self.assertEqual([positions[s] for s in ('s0', 's1', 's2', 's3')], [i * POSITION_GAP for i in range(1, 5)])
+
+    def test_move_respaces_when_neighbours_are_adjacent(self):
+        add_songs(self.playlist, ['s0', 's1', 's2'])
+        PlaylistSong.objects.filter(spotify_song__spotify_id='s1').update(position=POSITION_GAP + 1)
+        move_songs(self.playlist, ['s2'], 1)
+        self.assertEqual(self._order(), ['s0', 's2', 's1'])
+        self.assertEqual(self._positions(), {'s0': POSITION_GAP, 's2': 2 * POSITION_GAP, 's1': 3 * POSITION_GAP})
+
+    def test_move_to_start(self):
+        add_songs(self.playlist, ['s0', 's1', 's2', 's3', 's4'])
+        move_songs(self.playlist, ['s4', 's3'], 0)
+        self.assertEqual(self._order(), ['s4', 's3', 's0', 's1', 's2'])
+        positions = self._positions()
+        self.assertEqual([positions[s] for s in ('s0', 's1', 's2')], [i * POSITION_GAP for i in range(1, 4)])
+
+    def test_move_to_end(self):
+        add_songs(self.playlist, ['s0', 's1', 's2', 's3'])
+        for index in (3, 100):
+            with self.subTest(index=index):
+                move_songs(self.playlist, ['s1', 's0'], index)
+                self.assertEqual(self._order(), ['s2', 's3', 's1', 's0'])
+                move_songs(self.playlist, ['s0', 's1'], 0)
+                self.assertEqual(self._order(), ['s0', 's1', 's2', 's3'])
+
+    def test_move_whole_playlist(self):
+        add_songs(self.playlist, ['s0', 's1'])
+        move_songs(self.playlist, ['s1', 's0'], 0)
+        self.assertEqual(self._order(), ['s1', 's0'])
+
+    def test_migration_spaces_existing_positions(self):
+        migration = importlib.import_module('spotify_app.migrations.0015_playlistsong_gap_positions')
+        other = Playlist.objects.create(name='Other')
+        for playlist, spotify_ids in ((self.playlist, ['s2', 's0', 's1']), (other, ['s3', 's4'])):
+            for position, spotify_id in enumerate(spotify_ids):
+                PlaylistSong.objects.create(playlist=playlist, position=position,
+                                            spotify_song=SpotifySong.objects.get(spotify_id=spotify_id))
+
+        migration.space_positions(django_apps, None)
+        self.assertEqual(self._positions(), {'s2': POSITION_GAP, 's0': 2 * POSITION_GAP, 's1': 3 * POSITION_GAP})
+        self.assertEqual(dict(PlaylistSong.objects.filter(playlist=other)
+                              .values_list('spotify_song__spotify_id', 'position')),
+                         {'s3': POSITION_GAP, 's4': 2 * POSITION_GAP})
+
+        migration.compact_positions(django_apps, None)
+        self.assertEqual(self._positions(), {'s2': 0, 's0': 1, 's1': 2})
+
+
+class InPlaylistFlagTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        for i in range(3):
+            SpotifySong.objects.create(spotify_id=f's{i}', title=f'Song {i}', artist='Artist', added_at=now)
+        self.first = Playlist.objects.create(name='First')
+        self.second = Playlist.objects.create(name='Second')
+
+    def _flagged(self):
+        return set(SpotifySong.objects.filter(in_playlist=True).values_list('spotify_id', flat=True))
+
+    def test_add_and_remove(self):
+        add_songs(self.first, ['s0', 's1'])
+        add_songs(self.second, ['s1'])
+        self.assertEqual(self._flagged(), {'s0', 's1'})
+
+        remove_songs(self.first, ['s0', 's1'])
+        # s1 is still in the second playlist
+        self.assertEqual(self._flagged(), {'s1'})
+        remove_songs(self.second, ['s1'])
+        self.assertEqual(self._flagged(), set())
+
+    def test_playlist_deletion(self):
+        add_songs(self.first, ['s0', 's1'])
+        add_songs(self.second, ['s1', 's2'])
+        remove_playlist(self.first)
+        self.assertEqual(self._flagged(), {'s1', 's2'})
+        remove_playlist(self.second)
+        self.assertEqual(self._flagged(), set())
+
+    def test_refresh_in_playlist(self):
+        add_songs(self.first, ['s0'])
+        SpotifySong.objects.filter(spotify_id='s0').update(in_playlist=False)
+        SpotifySong.objects.filter(spotify_id='s2').update(in_playlist=True)
+        self.assertEqual(refresh_in_playlist(), 2)
+        self.assertEqual(self._flagged(), {'s0'})
+        self.assertEqual(refresh_in_playlist(), 0)
+
+    def test_check_in_playlist_command(self):
+        add_songs(self.first, ['s0'])
+        out = StringIO()
+        call_command('check_in_playlist', stdout=out)
+        self.assertIn('in_playlist is consistent', out.getvalue())
+
+        SpotifySong.objects.filter(spotify_id='s0').update(in_playlist=False)
+        SpotifySong.objects.filter(spotify_id='s1').update(in_playlist=True)
+        with self.assertRaisesMessage(CommandError, '2 inconsistent songs'):
+            call_command('check_in_playlist', stdout=StringIO())
+        # Without --fix nothing is written
+        self.assertEqual(self._flagged(), {'s1'})
+
+        out = StringIO()
+        call_command('check_in_playlist', '--fix', stdout=out)
+        self.assertIn('1 songs in a playlist but not flagged: s0', out.getvalue())
+        self.assertIn('1 songs flagged but in no playlist: s1', out.getvalue())
+        self.assertIn('Fixed 2 songs', out.getvalue())
+        self.assertEqual(self._flagged(), {'s0'})
+
+
+class MaterializeTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source = os.path.join(tmp.name, 'Artist - Title.mp3')
+        with open(self.source, 'wb') as f:
+            f.write(b'library file')
+        self.dest = os.path.join(tmp.name, 'Set', 'Artist - Title.mp3')
+        self.tmp_path = os.path.join(tmp.name, 'Set', '.Artist - Title.mp3.tmp')
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_hardlink(self):
+        self.assertEqual(materialize(self.source, self.dest, HARDLINK), HARDLINK)
+        self.assertEqual(os.stat(self.source).st_ino, os.stat(self.dest).st_ino)
+        self.assertTrue(is_materialized(self.source, self.dest))
+
+    def test_symlink_is_relative(self):
+        self.assertEqual(materialize(self.source, self.dest, SYMLINK), SYMLINK)
+        self.assertEqual(os.readlink(self.dest), os.path.join('..', 'Artist - Title.mp3'))
+        self.assertTrue(is_materialized(self.source, self.dest))
+
+    def test_unsupported_link_falls_back_to_copy(self):
+        for mode, error in ((HARDLINK, errno.EXDEV), (AUTO, errno.EOPNOTSUPP)):
+            with self.subTest(mode=mode), \
+                    mock.patch('os.link', side_effect=OSError(error, os.strerror(error))), \
+                    mock.patch('fcntl.ioctl', side_effect=OSError(error, os.strerror(error))):
+                self.assertEqual(materialize(self.source, self.dest, mode), COPY)
+                self.assertEqual(self._read(self.dest), b'library file')
+                self.assertFalse(is_materialized(self.source, self.dest))
+                self.assertFalse(os.path.lexists(self.tmp_path))
+
+    def test_io_errors_are_raised(self):
+        with mock.patch('os.link', side_effect=OSError(errno.EIO, 'I/O error')):
+            with self.assertRaises(OSError):
+                materialize(self.source, self.dest, HARDLINK)
+        self.assertFalse(os.path.lexists(self.dest))
+
+    def test_written_under_tmp_name_then_replaced(self):
+        os.makedirs(os.path.dirname(self.dest))
+        with open(self.dest, 'wb') as f:
+            f.write(b'old copy')
+        # Left behind by an interrupted earlier run
+        with open(self.tmp_path, 'wb') as f:
+            f.write(b'partial')
+
+        with mock.patch('os.replace', wraps=os.replace) as replace:
+            materialize(self.source, self.dest, COPY)
+        replace.assert_called_once_with(self.tmp_path, self.dest)
+        self.assertEqual(self._read(self.dest), b'library file')
+        self.assertFalse(os.path.lexists(self.tmp_path))
+
+    def test_is_materialized(self):
+        self.assertFalse(is_materialized(self.source, self.dest))
+        materialize(self.source, self.dest, COPY)
+        self.assertFalse(is_materialized(self.source, self.dest))
+        materialize(self.source, self.dest, HARDLINK)
+        self.assertTrue(is_materialized(self.source, self.dest))
+        os.remove(self.source)
+        self.assertFalse(is_materialized(self.source, self.dest))
+
+
+class DedupePlaylistFoldersTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.library = tmp.name
+        patcher = override_settings(DOWNLOAD_ROOT=self.library)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        Playlist.objects.create(name='Set')
+
+        self._write(os.path.join(self.library, 'a.mp3'), b'a')
+        self._write(os.path.join(self.library, 'b.mp3'), b'b')
+        self._write(self._entry('a.mp3'), b'a')  # Copy of the library file
+        self._write(self._entry('b.mp3'), b'edited')  # The user's own edit
+        self._write(self._entry('c.mp3'), b'c')  # Not in the library
+
+    def _entry(self, name):
+        return os.path.join(self.library, 'Set', name)
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def _run(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command('dedupe_playlist_folders', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_dry_run_changes_nothing(self):
+        out, err = self._run('--mode', HARDLINK, '--dry-run')
+        self.assertIn(f'Would replace {self._entry("a.mp3")}', out)
+        self.assertIn('Would replace 1 copies', out)
+        self.assertIn(self._entry('b.mp3'), err)
+        self.assertFalse(is_materialized(os.path.join(self.library, 'a.mp3'), self._entry('a.mp3')))
+
+    def test_replaces_only_identical_copies(self):
+        out, err = self._run('--mode', HARDLINK)
+        self.assertIn('Replaced 1 copies', out)
+        self.assertIn('1 differing files skipped', out)
+        self.assertTrue(is_materialized(os.path.join(self.library, 'a.mp3'), self._entry('a.mp3')))
+        with open(self._entry('b.mp3'), 'rb') as f:
+            self.assertEqual(f.read(), b'edited')
+        self.assertTrue(os.path.isfile(self._entry('c.mp3')))
+
+        # Already linked entries are not counted again
+        out, _ = self._run('--mode', HARDLINK)
+        self.assertIn('Replaced 0 copies', out)
+
+    def test_copy_mode_is_refused(self):
+        with self.assertRaises(CommandError):
+            self._run('--mode', COPY)
+
+
+class ScoreCandidateTests(SimpleTestCase):
+    SONG = {'title': 'Strobe', 'artist': 'deadmau5', 'duration_ms': 600000}
+
+    def test_scores(self):
+        rows = [
+            # (song overrides, candidate title, uploader, candidate duration, score)
+            ({}, 'Strobe', 'deadmau5', 600000, 1.0),
+            ({}, 'deadmau5 - Strobe (Original Mix)', 'Some Label', 601500, 1.0),
+            ({}, 'Strobe', 'Someone Else', 600000, 0.8),
+            # Remix when the original is wanted, and the other way around
+            ({}, 'Strobe (Someone Remix)', 'deadmau5', 600000, 0.7),
+            ({'title': 'Strobe (Someone Remix)'}, 'Strobe', 'deadmau5', 600000, 0.475),
+            ({'title': 'Strobe (Someone Remix)'}, 'Strobe (Someone Remix)', 'deadmau5', 600000, 1.0),
+            # Durations: tolerance, then linear down to nothing at DURATION_MAX_DELTA_MS
+            ({}, 'Strobe', 'deadmau5', 616000, 0.825),
+            ({}, 'Strobe', 'deadmau5', 900000, 0.65),
+            # Extended mixes may be longer, but no penalty for the version
+            ({}, 'Strobe (Extended Mix)', 'deadmau5', 900000, 0.895),
+            ({}, 'Strobe (Extended Mix)', 'deadmau5', 590000, 0.9),
+            ({'title': 'Strobe (Extended Mix)'}, 'Strobe (Extended Mix)', 'deadmau5', 900000, 0.65),
+            # Without a duration on either side title and artist make up the whole score
+            ({'duration_ms': None}, 'Strobe', 'deadmau5', 600000, 1.0),
+            ({}, 'Strobe', 'deadmau5', 0, 1.0),
+            ({'duration_ms': None}, 'Strobe', 'Someone Else', None, 0.692),
+            ({'duration_ms': None}, 'Strobe (Someone Remix)', 'deadmau5', None, 0.7),
+        ]
+        for overrides, title, uploader, duration_ms, expected in rows:
+            song = {**self.SONG, **overrides}
+            candidate = {'title': title, 'artist': uploader, 'duration_ms': duration_ms}
+            with self.subTest(song=song['title'], candidate=title, duration_ms=duration_ms):
+                self.assertEqual(score_candidate(song, candidate), expected)
+
+    def test_ranking_is_best_first_and_stable(self):
+        candidates = [
+            {'id': 1, 'title': 'Strobe (Someone Remix)', 'artist': 'deadmau5', 'duration_ms': 600000},
+            {'id': 2, 'title': 'Strobe', 'artist': 'deadmau5', 'duration_ms': 600000},
+            {'id': 3, 'title': 'Strobe', 'artist': 'deadmau5', 'duration_ms': 601000},
+        ]
+        ranked = rank_candidates(self.SONG, candidates)
+        self.assertEqual([candidate['id'] for candidate in ranked], [2, 3, 1])
+        self.assertEqual([candidate['score'] for candidate in ranked], [1.0, 1.0, 0.7])
+
+
+class AutoMatchSongsTests(TestCase):
+    CANDIDATES = {
+        'Strobe': [{'id': 11, 'title': 'Strobe', 'artist': 'deadmau5', 'duration_ms': 600000}],
+        'Ghosts': [{'id': 21, 'title': 'Ghosts (Someone Remix)', 'artist': 'deadmau5', 'duration_ms': 600000}],
+    }
+
+    def setUp(self):
+        for spotify_id, title in (('strobe', 'Strobe'), ('ghosts', 'Ghosts')):
+            SpotifySong.objects.create(spotify_id=spotify_id, title=title, artist='deadmau5', added_at=timezone.now(),
+                                       duration_ms=600000, metadata_fetched_at=timezone.now())
+        mock.patch('spotify_app.spotify_metadata._cache', _LRUCache(TRACK_CACHE_SIZE, TRACK_CACHE_TTL)).start()
+        mock.patch('spotify_app.management.commands.auto_match_songs.get_spotify_access_token',
+                   return_value='token').start()
+        mock.patch('spotify_app.views.utils.search_soundcloud',
+                   side_effect=lambda title, artist: self.CANDIDATES[title]).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _run(self, *args):
+        out = StringIO()
+        call_command('auto_match_songs', *args, stdout=out)
+        return out.getvalue()
+
+    def _accepted(self):
+        return dict(SoundCloudSong.objects.values_list('spotify_song__spotify_id', 'soundcloud_id'))
+
+    @override_settings(MATCH_AUTO_ACCEPT_SCORE=0.9)
+    def test_only_matches_at_the_threshold_are_saved(self):
+        out = self._run()
+        self.assertIn('Accepted 1 matches, 1 left for review, 0 searches failed', out)
+        self.assertEqual(self._accepted(), {'strobe': '11'})
+        song = SpotifySong.objects.get(spotify_id='strobe')
+        self.assertTrue(song.is_saved)
+        self.assertEqual(song.soundcloud_match.download_status, 'pending')
+        self.assertFalse(SpotifySong.objects.get(spotify_id='ghosts').is_saved)
+
+    @override_settings(MATCH_AUTO_ACCEPT_SCORE=0.7)
+    def test_lower_threshold_accepts_more(self):
+        self._run()
+        self.assertEqual(self._accepted(), {'strobe': '11', 'ghosts': '21'})
+
+    @override_settings(MATCH_AUTO_ACCEPT_SCORE=0.7)
+    def test_dry_run_saves_nothing(self):
+        out = self._run('--dry-run')
+        self.assertIn('Would accept 2 matches', out)
+        self.assertEqual(self._accepted(), {})
+        self.assertFalse(SpotifySong.objects.filter(is_saved=True).exists())
+
+
+class AnalysisEngineTests(SimpleTestCase):
+    def _done(self, result=None, error=None):
+        future = Future()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+        return future
+
+    @override_settings(ANALYSIS_PROCESSES=3)
+    def test_one_pool_sized_from_settings(self):
+        with mock.patch('spotify_app.analysis.ProcessPoolExecutor') as pool_class:
+            engine = AnalysisEngine()
+            engine.submit('a.mp3')
+            engine.submit('b.mp3')
+        pool_class.assert_called_once()
+        self.assertEqual(pool_class.call_args.kwargs['max_workers'], 3)
+        self.assertEqual(pool_class.call_args.kwargs['mp_context'].get_start_method(), 'spawn')
+        self.assertEqual(pool_class.return_value.submit.call_count, 2)
+
+    def test_broken_pool_is_replaced(self):
+        broken, healthy = mock.Mock(), mock.Mock()
+        broken.submit.side_effect = BrokenProcessPool()
+        healthy.submit.return_value = 'future'
+        with mock.patch('spotify_app.analysis.ProcessPoolExecutor', side_effect=[broken, healthy]):
+            engine = AnalysisEngine(processes=1)
+            self.assertEqual(engine.submit('a.mp3'), 'future')
+        broken.shutdown.assert_called_once_with(wait=False)
+        self.assertIs(engine._executor, healthy)
+
+    def test_batch_yields_results_and_errors(self):
+        engine = AnalysisEngine(processes=1)
+        outcomes = {
+            'good.mp3': self._done({'bpm': 124, 'key': '8A'}),
+            'bad.mp3': self._done(error=RuntimeError('corrupt')),
+        }
+        with mock.patch.object(engine, 'submit', side_effect=outcomes.get):
+            results = {path: (result, error) for path, result, error in engine.analyze_batch(list(outcomes))}
+        self.assertEqual(results['good.mp3'], ({'bpm': 124, 'key': '8A'}, None))
+        self.assertIsNone(results['bad.mp3'][0])
+        self.assertIsInstance(results['bad.mp3'][1], RuntimeError)
+
+
+@override_settings(SOUNDCLOUD_CLIENT_ID_TTL=3600)
+class SoundCloudClientIdTests(TestCase):
+    def setUp(self):
+        self.scrape = mock.patch('spotify_app.soundcloud_auth.scrape_client_id',
+                                 side_effect=['first', 'second']).start()
+        self.addCleanup(mock.patch.stopall)
+        self.provider = SoundCloudClientIdProvider()
+
+    def _age(self, seconds):
+        """Pretend the current client_id was scraped this many seconds ago"""
+        fetched_at = timezone.now() - timedelta(seconds=seconds)
+        self.provider._fetched_at = fetched_at
+        ServiceCredential.objects.filter(name=SOUNDCLOUD_CREDENTIAL).update(fetched_at=fetched_at)
+
+    def test_cached_until_ttl(self):
+        self.assertEqual(self.provider.get_client_id(), 'first')
+        self._age(3599)
+        self.assertEqual(self.provider.get_client_id(), 'first')
+        self.assertEqual(self.scrape.call_count, 1)
+
+        self._age(3601)
+        self.assertEqual(self.provider.get_client_id(), 'second')
+        self.assertEqual(self.scrape.call_count, 2)
+        self.assertEqual(ServiceCredential.objects.get(name=SOUNDCLOUD_CREDENTIAL).value, 'second')
+
+    def test_stored_client_id_is_shared(self):
+        self.provider.get_client_id()
+        # Another process (or a restart) reads it from the database
+        self.assertEqual(SoundCloudClientIdProvider().get_client_id(), 'first')
+        self.assertEqual(self.scrape.call_count, 1)
+
+    def test_invalidate_only_the_rejected_client_id(self):
+        self.provider.get_client_id()
+        self.provider.invalidate('older')
+        self.assertEqual(self.provider.get_client_id(), 'first')
+        self.provider.invalidate('first')
+        self.assertFalse(ServiceCredential.objects.exists())
+        self.assertEqual(self.provider.get_client_id(), 'second')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_search_rescrapes_after_401(self):
+        track = {'id': 1, 'title': 'Strobe', 'user': {'username': 'deadmau5'}, 'duration': 600000}
+        responses = iter([FakeResponse({}, status_code=401), FakeResponse({'collection': [track]})])
+        client_ids = []
+
+        def get(url, params):
+            client_ids.append(params['client_id'])
+            return next(responses)
+
+        api = mock.Mock(get=get)
+        with mock.patch('spotify_app.views.utils.soundcloud_client_id_provider', self.provider), \
+                mock.patch('spotify_app.views.utils.soundcloud_api', api):
+            matches = search_soundcloud('Strobe', 'deadmau5')
+        self.assertEqual([match['id'] for match in matches], [1])
+        self.assertEqual(client_ids, ['first', 'second'])
+        self.assertEqual(ServiceCredential.objects.get(name=SOUNDCLOUD_CREDENTIAL).value, 'second')
+
+
+class RetryAfterCapTests(SimpleTestCase):
+    def _response(self, retry_after=None):
+        headers = {'Retry-After': retry_after} if retry_after is not None else {}
+        return HTTPResponse(status=429, headers=headers)
+
+    def _retry(self):
+        return soundcloud_api.get_adapter('https://api-v2.soundcloud.com').max_retries
+
+    def test_sessions_use_the_capped_retry(self):
+        for session in (spotify_accounts, spotify_api, soundcloud_api, soundcloud_web):
+            self.assertIsInstance(session.get_adapter('https://example.com').max_retries, _Retry)
+
+    def test_retry_after_is_capped(self):
+        retry = self._retry()
+        for header, expected in (('5', 5), (str(MAX_RETRY_AFTER), MAX_RETRY_AFTER), ('3600', MAX_RETRY_AFTER)):
+            with self.subTest(header=header):
+                self.assertEqual(retry.get_retry_after(self._response(header)), expected)
+        self.assertIsNone(retry.get_retry_after(self._response()))
+
+    def test_sleeps_at_most_the_cap(self):
+        # The retry state is copied on every attempt; the copies must keep the cap
+        retry = self._retry().increment(method='GET', url='/search', response=self._response('3600'))
+        self.assertIsInstance(retry, _Retry)
+        with mock.patch('time.sleep') as sleep:
+            retry.sleep(self._response('3600'))
+        sleep.assert_called_once_with(MAX_RETRY_AFTER)
+
+
+class ProgressWriterTests(TestCase):
+    def setUp(self):
+        self.writer = ProgressWriter()
+        # Flush by hand instead of from the background thread
+        mock.patch.object(self.writer, '_start').start()
+        self.addCleanup(mock.patch.stopall)
+        self.downloading = self._job('downloading', 'a')
+        self.completed = self._job('completed', 'b')
+
+    def _job(self, status, spotify_id):
+        song = SpotifySong.objects.create(spotify_id=spotify_id, title='Song', artist='Artist', added_at=timezone.now())
+        return SoundCloudSong.objects.create(spotify_song=song, soundcloud_id=spotify_id, title='Song', artist='Artist',
+                                             duration_ms=0, url='https://soundcloud.com/', download_status=status,
+                                             download_progress=100 if status == 'completed' else 0)
+
+    def _progress(self, job):
+        job.refresh_from_db()
+        return job.download_progress
+
+    def test_flush_writes_latest_progress_of_downloading_jobs(self):
+        for progress in (10, 20, 35):
+            self.writer.record(self.downloading.id, progress)
+        # Recorded before the job finished: its final status must not be overwritten
+        self.writer.record(self.completed.id, 50)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.writer.flush(), 1)
+        self.assertEqual(self._progress(self.downloading), 35)
+        self.assertEqual(self._progress(self.completed), 100)
+        self.assertEqual(self.writer.stats()['pending'], 0)
+
+    def test_unchanged_progress_is_not_written_again(self):
+        self.writer.record(self.downloading.id, 40)
+        self.writer.flush()
+        self.writer.record(self.downloading.id, 40)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.writer.flush(), 0)
+
+        self.writer.record(self.downloading.id, 60)
+        self.writer.discard(self.downloading.id)
+        self.assertEqual(self.writer.flush(), 0)
+        self.assertEqual(self._progress(self.downloading), 40)
+
+    def test_stats(self):
+        for progress in (1, 2, 3, 3):
+            self.writer.record(self.downloading.id, progress)
+        self.writer.flush()
+        self.writer.record(self.downloading.id, 3)
+        self.writer.record(self.completed.id, 4)
+        self.writer.flush()
+        self.assertEqual(self.writer.stats(), {
+            'callbacks': 6,
+            'rows_written': 1,
+            'flushes': 2,
+            'writes_avoided': 5,
+            'pending': 0,
+        })
+
+
+class SqliteConnectionTests(SimpleTestCase):
+    def _connect(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        default = connections['default']
+        wrapper = default.__class__({
+            **default.settings_dict,
+            'NAME': os.path.join(directory.name, 'db.sqlite3'),
+            'OPTIONS': {'timeout': 7},  # As settings sets it from SQLITE_BUSY_TIMEOUT
+        })
+        self.addCleanup(wrapper.close)
+        # Fires connection_created, so configure_connection runs as in the server
+        wrapper.ensure_connection()
+        return wrapper
+
+    def test_new_connections_use_wal(self):
+        info = describe_connection(self._connect())
+        self.assertEqual(info['vendor'], 'sqlite')
+        self.assertEqual(info['journal_mode'], 'wal')
+        self.assertEqual(info['synchronous'], 1)  # NORMAL
+        self.assertEqual(info['busy_timeout_ms'], 7000)
+
+    @override_settings(SQLITE_JOURNAL_MODE='delete', SQLITE_SYNCHRONOUS='full')
+    def test_pragmas_follow_settings(self):
+        info = describe_connection(self._connect())
+        self.assertEqual((info['journal_mode'], info['synchronous']), ('delete', 2))
+
+    def test_other_databases_are_left_alone(self):
+        other = mock.Mock(vendor='postgresql')
+        configure_connection(sender=None, connection=other)
+        other.cursor.assert_not_called()
@@ -5,12 +5,17 @@ urlpatterns = [
     path('songs/', views.get_spotify_songs, name='get-songs'),
     path('new-songs/', views.get_new_spotify_songs, name='get-new-songs'),
     path('song/<str:spotify_id>/', views.get_spotify_song, name='get-spotify-song'),
+    path('soundcloud-matches/batch/', views.get_soundcloud_matches_batch, name='get-soundcloud-matches-batch'),
     path('soundcloud-matches/<str:spotify_id>/', views.get_soundcloud_matches, name='get-soundcloud-matches'),
     path('save-match/', views.save_soundcloud_match, name='save-soundcloud-match'),
     path('delete-match/<str:spotify_id>/', views.delete_soundcloud_match, name='delete-soundcloud-match'),
     path('check-song/<str:spotify_id>/', views.check_song_in_playlist, name='check-song-in-playlist'),
+    path('validate-songs/', views.validate_spotify_songs, name='validate-spotify-songs'),
+    path('download-status/batch/', views.get_download_statuses, name='get-download-statuses'),
     path('download-status/<str:spotify_id>/', views.get_download_status, name='get-download-status'),
+    path('download-progress/stream/', views.stream_download_progress, name='stream-download-progress'),
     path('retry-download/<str:spotify_id>/', views.retry_download, name='retry-download'),
+    path('download-queue/', views.get_download_queue_stats, name='get-download-queue-stats'),
     # Playlist management
     path('playlists/', views.get_playlists, name='get-playlists'),
     path('playlists/create/', views.create_playlist, name='create-playlist'),
@@ -18,6 +23,12 @@ urlpatterns = [
     path('playlists/<int:playlist_id>/add-song/', views.add_song_to_playlist, name='add-song-to-playlist'),
     path('playlists/<int:playlist_id>/remove-song/<str:spotify_id>/', views.remove_song_from_playlist, name='remove-song-from-playlist'),
     path('playlists/<int:playlist_id>/delete/', views.delete_playlist, name='delete-playlist'),
+    path('playlists/<int:playlist_id>/songs/bulk-add/', views.bulk_add_songs_to_playlist, name='bulk-add-songs-to-playlist'),
+    path('playlists/<int:playlist_id>/songs/bulk-remove/', views.bulk_remove_songs_from_playlist, name='bulk-remove-songs-from-playlist'),
+    path('playlists/<int:playlist_id>/songs/move/', views.move_playlist_songs, name='move-playlist-songs'),
+    path('playlists/reconciler/', views.get_playlist_reconciler_status, name='get-playlist-reconciler-status'),
     # Rekordbox sync
     path('rekordbox/sync/', views.sync_rekordbox, name='sync-rekordbox'),
+    # Metrics
+    path('metrics/', views.get_metrics, name='get-metrics'),
 ]
\ No newline at end of file
@@ -7,15 +7,20 @@ from .spotify_views import (
     get_new_spotify_songs,
     get_spotify_song,
     check_song_in_playlist,
+    validate_spotify_songs,
 )
 
 # SoundCloud views
 from .soundcloud_views import (
     get_soundcloud_matches,
+    get_soundcloud_matches_batch,
     save_soundcloud_match,
     delete_soundcloud_match,
     get_download_status,
+    get_download_statuses,
+    stream_download_progress,
     retry_download,
+    get_download_queue_stats,
 )
 
 # Playlist views
@@ -28,6 +33,10 @@ from .playlist_views import (
 )
 from .playlist_views import (
     delete_playlist,
+    bulk_add_songs_to_playlist,
+    bulk_remove_songs_from_playlist,
+    move_playlist_songs,
+    get_playlist_reconciler_status,
 )
 
 # Rekordbox views
@@ -35,6 +44,11 @@ from .rekordbox_views import (
     sync_rekordbox,
 )
 
+# Metrics views
+from .metrics_views import (
+    get_metrics,
+)
+
 # Export all views
 __all__ = [
     # Spotify
@@ -42,12 +56,17 @@ __all__ = [
     'get_new_spotify_songs',
     'get_spotify_song',
     'check_song_in_playlist',
+    'validate_spotify_songs',
     # SoundCloud
     'get_soundcloud_matches',
+    'get_soundcloud_matches_batch',
     'save_soundcloud_match',
     'delete_soundcloud_match',
     'get_download_status',
+    'get_download_statuses',
+    'stream_download_progress',
     'retry_download',
+    'get_download_queue_stats',
     # Playlist
     'get_playlists',
     'create_playlist',
@@ -55,6 +74,12 @@ __all__ = [
     'get_playlist_songs',
     'remove_song_from_playlist',
     'delete_playlist',
+    'bulk_add_songs_to_playlist',
+    'bulk_remove_songs_from_playlist',
+    'move_playlist_songs',
+    'get_playlist_reconciler_status',
     # Rekordbox
     'sync_rekordbox',
+    # Metrics
+    'get_metrics',
 ]
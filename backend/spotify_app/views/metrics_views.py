@@ -0,0 +1,14 @@
+"""
+Runtime metrics views
+"""
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from .. import metrics
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_metrics(request):
+    """Get in-process counters and timings"""
+    return Response(metrics.snapshot())
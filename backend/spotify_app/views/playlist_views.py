@@ -4,22 +4,25 @@ Playlist management views
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from ..models import SpotifySong, SoundCloudSong, Playlist, PlaylistSong
+from ..models import SpotifySong, Playlist, PlaylistSong
+from ..playlists import (
+    add_songs,
+    invalidate_playlist_summaries,
+    move_songs,
+    playlist_summaries,
+    remove_playlist,
+    remove_songs,
+)
+from ..materialize import playlist_dir
+from ..reconciler import playlist_reconciler
 import os
-import shutil
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_playlists(request):
-    """Get all playlists"""
-    playlists = Playlist.objects.all()
-    return Response([{
-        'id': p.id,
-        'name': p.name,
-        'song_count': p.songs.count(),
-        'created_at': p.created_at
-    } for p in playlists])
+    """Get all playlists with their song counts, total duration and BPM range"""
+    return Response(playlist_summaries())
 
 
 @api_view(['POST'])
@@ -33,12 +36,12 @@ def create_playlist(request):
     try:
         # Create playlist in database
         playlist = Playlist.objects.create(name=name)
+        invalidate_playlist_summaries()
         
         # Create directory in downloads folder
-        download_path = os.getenv('DOWNLOAD_PATH', '/downloads')
-        playlist_dir = os.path.join(download_path, name)
-        os.makedirs(playlist_dir, exist_ok=True)
-        os.chmod(playlist_dir, 0o777)  # Make it accessible
+        folder = playlist_dir(name)
+        os.makedirs(folder, exist_ok=True)
+        os.chmod(folder, 0o777)  # Make it accessible
         
         return Response({
             'id': playlist.id,
@@ -60,49 +63,20 @@ def add_song_to_playlist(request, playlist_id):
     
     try:
         playlist = Playlist.objects.get(id=playlist_id)
-        spotify_song = SpotifySong.objects.get(spotify_id=spotify_id)
         
-        # Get the highest position in the playlist
-        max_position = PlaylistSong.objects.filter(playlist=playlist).count()
-
-        # Add song to playlist. Rely on unique_together constraint to prevent duplicates in the same playlist.
-        playlist_song, created = PlaylistSong.objects.get_or_create(
-            playlist=playlist,
-            spotify_song=spotify_song,
-            defaults={'position': max_position}
-        )
-
-        if not created:
+        # Append the song and mark it as in at least one playlist
+        added, already, not_found = add_songs(playlist, [spotify_id])
+        if not_found:
+            return Response({'error': 'Song not found'}, status=404)
+        if already:
             return Response({'error': 'Song already in playlist'}, status=400)
-
-        # Mark song as in at least one playlist
-        spotify_song.in_playlist = True
-        spotify_song.save()
         
-        # Copy mp3 file to playlist directory if it exists
-        try:
-            soundcloud_song = SoundCloudSong.objects.get(spotify_song=spotify_song)
-            if soundcloud_song.download_status == 'completed':
-                download_path = os.getenv('DOWNLOAD_PATH', '/downloads')
-                source_file = os.path.join(download_path, f'{soundcloud_song.artist} - {soundcloud_song.title}.mp3')
-                playlist_dir = os.path.join(download_path, playlist.name)
-                dest_file = os.path.join(playlist_dir, f'{soundcloud_song.artist} - {soundcloud_song.title}.mp3')
-                
-                if os.path.exists(source_file):
-                    os.makedirs(playlist_dir, exist_ok=True)
-                    shutil.copy2(source_file, dest_file)
-                    os.chmod(dest_file, 0o666)
-                    print(f"Copied file to playlist: {dest_file}")
-        except SoundCloudSong.DoesNotExist:
-            pass  # Song doesn't have a SoundCloud match yet
-        except Exception as e:
-            print(f"Warning: Could not copy file to playlist: {e}")
+        # The mp3 file is linked into the playlist directory in the background
+        playlist_reconciler.request()
         
         return Response({'success': True}, status=201)
     except Playlist.DoesNotExist:
         return Response({'error': 'Playlist not found'}, status=404)
-    except SpotifySong.DoesNotExist:
-        return Response({'error': 'Song not found'}, status=404)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
@@ -113,36 +87,14 @@ def delete_playlist(request, playlist_id):
     """Delete a playlist and remove associated playlist files (but keep SpotifySong entries)."""
     try:
         playlist = Playlist.objects.get(id=playlist_id)
+        name = playlist.name
 
-        # Collect spotify_song ids for songs that will be affected
-        playlist_songs = PlaylistSong.objects.filter(playlist=playlist).select_related('spotify_song')
-        affected_song_ids = [ps.spotify_song.id for ps in playlist_songs]
+        # Delete the playlist with its PlaylistSong rows, clearing in_playlist of
+        # songs that are in no other playlist in a single UPDATE
+        remove_playlist(playlist)
 
-        # Delete PlaylistSong rows
-        playlist_songs.delete()
-
-        # For each affected spotify song, update its in_playlist flag depending on whether it is in any other playlist
-        for song_id in affected_song_ids:
-            try:
-                sp = SpotifySong.objects.get(id=song_id)
-                still_in_any = PlaylistSong.objects.filter(spotify_song=sp).exists()
-                sp.in_playlist = bool(still_in_any)
-                sp.save()
-            except Exception:
-                pass
-
-        # Optionally remove playlist directory in downloads
-        try:
-            download_path = os.getenv('DOWNLOAD_PATH', '/downloads')
-            playlist_dir = os.path.join(download_path, playlist.name)
-            if os.path.exists(playlist_dir) and os.path.isdir(playlist_dir):
-                shutil.rmtree(playlist_dir)
-        except Exception as e:
-            # Non-fatal: log and continue
-            print(f"Warning: could not remove playlist directory: {e}")
-
-        # Finally delete playlist record
-        playlist.delete()
+        # Its directory is removed in the background
+        playlist_reconciler.discard(folders=[name])
 
         return Response({'success': True}, status=200)
     except Playlist.DoesNotExist:
@@ -195,54 +147,105 @@ def remove_song_from_playlist(request, playlist_id, spotify_id):
     """Remove a song from a playlist"""
     try:
         playlist = Playlist.objects.get(id=playlist_id)
-        spotify_song = SpotifySong.objects.get(spotify_id=spotify_id)
+        if not SpotifySong.objects.filter(spotify_id=spotify_id).exists():
+            return Response({'error': 'Song not found'}, status=404)
         
-        # Find and delete the PlaylistSong entry
-        playlist_song = PlaylistSong.objects.filter(
-            playlist=playlist,
-            spotify_song=spotify_song
-        ).first()
-
-        if not playlist_song:
+        # Delete the PlaylistSong entry and update the song's in_playlist flag;
+        # positions of the remaining songs stay ordered, so nothing is renumbered
+        removed, _ = remove_songs(playlist, [spotify_id])
+        if not removed:
             return Response({'error': 'Song not in this playlist'}, status=404)
-
-        # Delete the PlaylistSong entry
-        playlist_song.delete()
-
-        # Mark song as in any playlist depending on remaining PlaylistSong rows
-        try:
-            still_in_any = PlaylistSong.objects.filter(spotify_song=spotify_song).exists()
-            spotify_song.in_playlist = bool(still_in_any)
-            spotify_song.save()
-        except Exception:
-            pass
-        
-        # Delete mp3 file from playlist directory if it exists
-        try:
-            soundcloud_song = SoundCloudSong.objects.get(spotify_song=spotify_song)
-            download_path = os.getenv('DOWNLOAD_PATH', '/downloads')
-            playlist_dir = os.path.join(download_path, playlist.name)
-            playlist_file = os.path.join(playlist_dir, f'{soundcloud_song.artist} - {soundcloud_song.title}.mp3')
-            
-            if os.path.exists(playlist_file):
-                os.remove(playlist_file)
-                print(f"Removed file from playlist: {playlist_file}")
-        except SoundCloudSong.DoesNotExist:
-            pass  # Song doesn't have a SoundCloud match
-        except Exception as e:
-            print(f"Warning: Could not remove file from playlist: {e}")
         
-        # Reorder remaining songs in the playlist
-        remaining_songs = PlaylistSong.objects.filter(playlist=playlist).order_by('position')
-        for index, ps in enumerate(remaining_songs):
-            if ps.position != index:
-                ps.position = index
-                ps.save()
+        # The mp3 file is removed from the playlist directory in the background
+        playlist_reconciler.request()
         
         return Response({'success': True}, status=200)
     except Playlist.DoesNotExist:
         return Response({'error': 'Playlist not found'}, status=404)
-    except SpotifySong.DoesNotExist:
-        return Response({'error': 'Song not found'}, status=404)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
+
+
+def _spotify_ids(request):
+    """List of spotify_ids from the request body, or None if missing/invalid"""
+    spotify_ids = request.data.get('spotify_ids')
+    if not isinstance(spotify_ids, list) or not spotify_ids or not all(isinstance(i, str) for i in spotify_ids):
+        return None
+    return spotify_ids
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_add_songs_to_playlist(request, playlist_id):
+    """Append a list of songs to a playlist in one transaction"""
+    spotify_ids = _spotify_ids(request)
+    if spotify_ids is None:
+        return Response({'error': 'spotify_ids must be a non-empty list'}, status=400)
+    
+    try:
+        playlist = Playlist.objects.get(id=playlist_id)
+        added, already, not_found = add_songs(playlist, spotify_ids)
+        if added:
+            playlist_reconciler.request()
+        return Response({
+            'added': added,
+            'already_in_playlist': already,
+            'not_found': not_found,
+        }, status=201 if added else 200)
+    except Playlist.DoesNotExist:
+        return Response({'error': 'Playlist not found'}, status=404)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_remove_songs_from_playlist(request, playlist_id):
+    """Remove a list of songs from a playlist in one transaction"""
+    spotify_ids = _spotify_ids(request)
+    if spotify_ids is None:
+        return Response({'error': 'spotify_ids must be a non-empty list'}, status=400)
+    
+    try:
+        playlist = Playlist.objects.get(id=playlist_id)
+        removed, not_in_playlist = remove_songs(playlist, spotify_ids)
+        if removed:
+            playlist_reconciler.request()
+        return Response({'removed': removed, 'not_in_playlist': not_in_playlist})
+    except Playlist.DoesNotExist:
+        return Response({'error': 'Playlist not found'}, status=404)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def move_playlist_songs(request, playlist_id):
+    """
+    Move songs to a new place in a playlist
+    Body: spotify_ids (kept together in that order) and index, the position among
+    the other songs to insert them at (past the end moves them to the end)
+    """
+    spotify_ids = _spotify_ids(request)
+    if spotify_ids is None:
+        return Response({'error': 'spotify_ids must be a non-empty list'}, status=400)
+    try:
+        index = int(request.data.get('index'))
+    except (TypeError, ValueError):
+        return Response({'error': 'index must be an integer'}, status=400)
+    
+    try:
+        playlist = Playlist.objects.get(id=playlist_id)
+        moved, not_in_playlist = move_songs(playlist, spotify_ids, index)
+        return Response({'moved': moved, 'not_in_playlist': not_in_playlist})
+    except Playlist.DoesNotExist:
+        return Response({'error': 'Playlist not found'}, status=404)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_playlist_reconciler_status(request):
+    """Pending playlist folder work and the outcome of the last reconciliation run"""
+    return Response(playlist_reconciler.status())
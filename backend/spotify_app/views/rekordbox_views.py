@@ -4,7 +4,12 @@ from rest_framework.response import Response
 import xml.etree.ElementTree as ET
 import sqlite3
 import os
+import time
+from django.db.models import Prefetch
 from spotify_app.models import Playlist, PlaylistSong, SpotifySong
+from spotify_app.rekordbox_changes import plan_sync, record_sync, target_signature
+from spotify_app.rekordbox_db import sync_database
+from spotify_app.rekordbox_xml import index_xml, location_key, track_location, write_xml
 
 
 @api_view(['POST'])
@@ -28,121 +33,154 @@ def sync_rekordbox(request):
         return Response({'error': 'Unsupported file format. Please provide rekordbox.xml or master.db'}, status=400)
 
 
+def load_playlist_tracks():
+    """
+    Load every playlist with its downloaded tracks in playlist order.
+    Runs a constant number of queries (playlists, then their songs joined
+    with SpotifySong and SoundCloudSong) however many playlists there are.
+    Returns a list of (playlist, [track, ...]) where each track is a dict.
+    """
+    playlists = Playlist.objects.prefetch_related(Prefetch(
+        'songs',
+        queryset=PlaylistSong.objects.select_related('spotify_song__soundcloud_match').order_by('position'),
+    ))
+    
+    result = []
+    for playlist in playlists:
+        tracks = []
+        for ps in playlist.songs.all():
+            song = ps.spotify_song
+            # The join already cached the match (or its absence), so no query here
+            sc_song = getattr(song, 'soundcloud_match', None)
+            if sc_song is None or sc_song.download_status != 'completed':
+                continue  # Song not downloaded, skip it
+            tracks.append({
+                'title': song.title,
+                'artist': song.artist,
+                'file_path': sc_song.file_path,
+                'bpm': sc_song.bpm,
+            })
+        result.append((playlist, tracks))
+    return result
+
+
+def _playlist_delta(old_keys, new_keys):
+    """Counts of added, removed and moved tracks between two versions of a playlist"""
+    old_set, new_set = set(old_keys), set(new_keys)
+    kept_old = [key for key in old_keys if key in new_set]
+    kept_new = [key for key in new_keys if key in old_set]
+    return {
+        'added': len(new_set - old_set),
+        'removed': len(old_set - new_set),
+        'reordered': sum(1 for a, b in zip(kept_old, kept_new) if a != b),
+    }
+
+
 def sync_rekordbox_xml(xml_path):
     """
     Sync playlists to Rekordbox XML format
-    This adds new playlists and tracks to the XML file
+    Only playlists whose content changed since the last sync are rewritten
+    (see rekordbox_changes); the file is streamed instead of loaded as a
+    whole document so large collections stay cheap
     """
     try:
         if not os.path.exists(xml_path):
             return Response({'error': f'File not found: {xml_path}'}, status=404)
         
-        # Parse existing XML
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
+        timings = {}
+        target = os.path.abspath(xml_path)
+        
+        # Load all playlists and their tracks from our database
+        started_at = time.perf_counter()
+        playlist_tracks = [(playlist.name, tracks) for playlist, tracks in load_playlist_tracks()]
+        plan = plan_sync(target, playlist_tracks, target_signature(xml_path))
+        timings['db_load'] = time.perf_counter() - started_at
+        
+        if plan.empty:
+            return Response({
+                'success': True,
+                'message': 'Rekordbox is up to date',
+                'added_playlists': 0,
+                'added_tracks': 0,
+                'changed_playlists': {},
+                'untouched_playlists': plan.untouched,
+                'removed_playlists': [],
+                'timings_ms': {phase: round(seconds * 1000, 1) for phase, seconds in timings.items()},
+            })
         
-        # Find COLLECTION and PLAYLISTS nodes
-        collection = root.find('.//COLLECTION')
-        playlists_node = root.find('.//PLAYLISTS')
+        # Index existing tracks and playlists in one pass
+        started_at = time.perf_counter()
+        index = index_xml(xml_path)
+        timings['xml_index'] = time.perf_counter() - started_at
         
-        if collection is None or playlists_node is None:
+        if not index.has_collection or not index.has_playlists:
             return Response({'error': 'Invalid Rekordbox XML format'}, status=400)
         
-        # Get existing track IDs and playlist names
-        existing_tracks = {}
-        for track in collection.findall('TRACK'):
-            location = track.get('Location')
-            if location:
-                existing_tracks[location] = track.get('TrackID')
-        
-        existing_playlist_names = set()
-        for playlist in playlists_node.findall('.//NODE[@Type="1"]'):
-            name = playlist.get('Name')
-            if name:
-                existing_playlist_names.add(name)
-        
-        # Get all playlists from our database
-        playlists = Playlist.objects.all()
-        
-        added_playlists = 0
-        added_tracks = 0
-        next_track_id = max([int(tid) for tid in existing_tracks.values()] + [0]) + 1
-        
-        # Create a folder node for our playlists if it doesn't exist
-        app_folder = None
-        for node in playlists_node.findall('.//NODE[@Type="0"]'):
-            if node.get('Name') == 'Rekordbox Manager':
-                app_folder = node
-                break
-        
-        if app_folder is None:
-            app_folder = ET.SubElement(playlists_node, 'NODE', {
-                'Type': '0',
-                'Name': 'Rekordbox Manager',
-                'Count': '0'
-            })
+        started_at = time.perf_counter()
+        new_tracks = []
+        playlists = []
+        changed = {}
+        next_track_id = index.max_track_id + 1
         
-        # Add each playlist
-        for playlist in playlists:
-            if playlist.name not in existing_playlist_names:
-                # Create playlist node
-                playlist_node = ET.SubElement(app_folder, 'NODE', {
-                    'Type': '1',
-                    'Name': playlist.name,
-                    'KeyType': '0',
-                    'Entries': str(PlaylistSong.objects.filter(playlist=playlist).count())
-                })
-                
-                # Add tracks to playlist
-                playlist_songs = PlaylistSong.objects.filter(playlist=playlist).select_related('spotify_song', 'spotify_song__soundcloud_match')
+        for name, tracks, _ in plan.changed:
+            track_ids = []
+            for track in tracks:
+                location = track_location(track['file_path'])
+                key = location_key(location)
                 
-                for ps in playlist_songs:
-                    song = ps.spotify_song
+                # Add track to collection if not exists (in either Location encoding)
+                if key not in index.tracks:
+                    attrs = {
+                        'TrackID': str(next_track_id),
+                        'Name': track['title'],
+                        'Artist': track['artist'],
+                        'Location': location,
+                    }
+                    
+                    # Add BPM if available
+                    if track['bpm']:
+                        attrs['AverageBpm'] = str(track['bpm'])
                     
-                    # Check if song has a downloaded SoundCloud match
-                    try:
-                        sc_song = song.soundcloud_match
-                        if sc_song.download_status == 'completed' and sc_song.file_path:
-                            file_path = sc_song.file_path
-                            
-                            # Add track to collection if not exists
-                            if file_path not in existing_tracks:
-                                track_elem = ET.SubElement(collection, 'TRACK', {
-                                    'TrackID': str(next_track_id),
-                                    'Name': song.title,
-                                    'Artist': song.artist,
-                                    'Location': f'file://localhost{file_path}',
-                                })
-                                
-                                # Add BPM and Key if available
-                                if sc_song.bpm:
-                                    track_elem.set('AverageBpm', str(sc_song.bpm))
-                                
-                                existing_tracks[file_path] = str(next_track_id)
-                                added_tracks += 1
-                                track_id = next_track_id
-                                next_track_id += 1
-                            else:
-                                track_id = int(existing_tracks[file_path])
-                            
-                            # Add track to playlist
-                            ET.SubElement(playlist_node, 'TRACK', {
-                                'Key': str(track_id)
-                            })
-                    except:
-                        # Song not downloaded, skip it
-                        continue
+                    new_tracks.append(attrs)
+                    index.tracks[key] = str(next_track_id)
+                    next_track_id += 1
                 
-                added_playlists += 1
+                track_ids.append(index.tracks[key])
+            
+            existing = index.app_playlists.get(name)
+            if existing == track_ids:
+                # Already in the file as is (e.g. first sync against an earlier export)
+                plan.untouched.append(name)
+                continue
+            
+            playlists.append((name, track_ids))
+            changed[name] = _playlist_delta(existing or [], track_ids)
+            changed[name]['created'] = existing is None
         
-        # Save XML back to file
-        tree.write(xml_path, encoding='utf-8', xml_declaration=True)
+        # Also drop app folder playlists that no longer exist in our database
+        names = {name for name, _ in playlist_tracks}
+        removed = sorted(set(plan.removed) | (set(index.app_playlists) - names))
+        timings['mutation'] = time.perf_counter() - started_at
         
+        # Write the XML back with the changes spliced in (atomically)
+        started_at = time.perf_counter()
+        if new_tracks or playlists or removed:
+            write_xml(xml_path, index, new_tracks, playlists, removed)
+        record_sync(target, plan, target_signature(xml_path))
+        timings['write'] = time.perf_counter() - started_at
+        
+        added_playlists = sum(1 for delta in changed.values() if delta['created'])
+        added_tracks = len(new_tracks)
         return Response({
             'success': True,
-            'message': f'Successfully synced {added_playlists} playlists and {added_tracks} tracks to Rekordbox',
+            'message': (f'Successfully synced {len(changed)} changed playlists '
+                        f'({added_playlists} new) and {added_tracks} tracks to Rekordbox'),
             'added_playlists': added_playlists,
-            'added_tracks': added_tracks
+            'added_tracks': added_tracks,
+            'changed_playlists': changed,
+            'untouched_playlists': plan.untouched,
+            'removed_playlists': removed,
+            'timings_ms': {phase: round(seconds * 1000, 1) for phase, seconds in timings.items()},
         })
         
     except ET.ParseError as e:
@@ -153,10 +191,43 @@ def sync_rekordbox_xml(xml_path):
 
 def sync_rekordbox_sqlite(db_path):
     """
-    Sync playlists to Rekordbox SQLite database
-    Note: This is more complex and requires understanding Rekordbox's schema
-    For now, return a message directing users to use XML export
+    Sync playlists to a Rekordbox SQLite database (master.db)
+    Tracks and playlist entries are upserted in a single transaction; see
+    rekordbox_db for the supported schema (the database must not be encrypted)
     """
-    return Response({
-        'error': 'SQLite sync not yet implemented. Please export your Rekordbox library as XML (File > Export Collection in XML format) and use that file instead.'
-    }, status=501)
+    try:
+        if not os.path.exists(db_path):
+            return Response({'error': f'File not found: {db_path}'}, status=404)
+        
+        timings = {}
+        
+        target = os.path.abspath(db_path)
+        
+        started_at = time.perf_counter()
+        playlist_tracks = [(playlist.name, tracks) for playlist, tracks in load_playlist_tracks()]
+        # Rekordbox itself rewrites master.db, so its mtime says nothing about our playlists
+        plan = plan_sync(target, playlist_tracks)
+        timings['db_load'] = time.perf_counter() - started_at
+        
+        started_at = time.perf_counter()
+        stats = sync_database(db_path, [(name, tracks) for name, tracks, _ in plan.changed], plan.removed)
+        record_sync(target, plan)
+        timings['write'] = time.perf_counter() - started_at
+        
+        return Response({
+            'success': True,
+            'message': f"Successfully synced {len(plan.changed)} changed playlists and {stats['added_tracks']} tracks to Rekordbox",
+            **stats,
+            'changed_playlists': [name for name, _, _ in plan.changed],
+            'untouched_playlists': plan.untouched,
+            'timings_ms': {phase: round(seconds * 1000, 1) for phase, seconds in timings.items()},
+        })
+        
+    except sqlite3.DatabaseError as e:
+        return Response({
+            'error': f'Failed to read Rekordbox database: {str(e)}. '
+                     'Encrypted master.db files are not supported; use a decrypted copy '
+                     'or export your library as XML (File > Export Collection in XML format).'
+        }, status=400)
+    except Exception as e:
+        return Response({'error': f'Sync failed: {str(e)}'}, status=500)
@@ -1,74 +1,99 @@
 """
 SoundCloud matching and download related views
 """
-from rest_framework.decorators import api_view, permission_classes
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework.response import Response
 from ..models import SpotifySong, SoundCloudSong, PlaylistSong
 from ..serializers import SoundCloudSongSerializer
-from .utils import get_spotify_access_token, search_soundcloud, download_soundcloud_track
+from ..download_queue import download_queue
+from ..progress import TERMINAL_STATUSES, download_progress
+from ..matching import find_matches, match_from_song, rank_candidates, save_match
+from ..materialize import download_path
+from ..spotify_metadata import TokenUnavailable, get_track
+from ..playlists import invalidate_playlist_summaries
+from ..reconciler import playlist_reconciler
+from ..http_client import spotify_api
+from .utils import get_spotify_access_token, partial_download_bytes, partial_downloads, search_soundcloud
+import json
 import requests
 import os
-import threading
+import time
 from datetime import datetime
 
+MAX_BATCH_STATUS_IDS = 500
+MAX_BATCH_MATCH_IDS = 100
+
+# Comment line sent when nothing changed, so proxies keep the connection open
+PROGRESS_KEEPALIVE_SECONDS = 15
+PROGRESS_STREAM_RETRY_MS = 2000
+
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_soundcloud_matches(request, spotify_id):
     """Get SoundCloud matches for a Spotify song"""
-    access_token = get_spotify_access_token()
-    
-    if not access_token:
-        return Response({'error': 'Unable to retrieve Spotify access token'}, status=400)
-
-    url = f'https://api.spotify.com/v1/tracks/{spotify_id}'
-    headers = {'Authorization': f'Bearer {access_token}'}
-    
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        track = response.json()
-        
-        # Get basic song info
-        title = track.get('name', '')
-        artist = ', '.join(artist['name'] for artist in track.get('artists', []))
+        # A Spotify access token is only requested if the track isn't known locally
+        song = get_track(spotify_id)
+        if song is None:
+            return Response({'error': 'Track not found on Spotify'}, status=404)
+        title = song['title']
+        artist = song['artist']
         
-        # Check if this song has a saved SoundCloud match
-        try:
-            spotify_song = SpotifySong.objects.get(spotify_id=spotify_id)
-            if spotify_song.is_saved:
-                # Try to get the saved SoundCloud match
-                try:
-                    soundcloud_song = SoundCloudSong.objects.get(spotify_song=spotify_song)
-                    soundcloud_matches = [{
-                        'id': soundcloud_song.soundcloud_id,
-                        'title': soundcloud_song.title,
-                        'artist': soundcloud_song.artist,
-                        'icon': soundcloud_song.icon,
-                        'duration_ms': soundcloud_song.duration_ms,
-                        'url': soundcloud_song.url,
-                        'stream_url': soundcloud_song.stream_url
-                    }]
-                except SoundCloudSong.DoesNotExist:
-                    # If no SoundCloud match saved, search for matches
-                    soundcloud_matches = search_soundcloud(title, artist)
-            else:
-                # Song exists but not saved, search for matches
-                soundcloud_matches = search_soundcloud(title, artist)
-        except SpotifySong.DoesNotExist:
-            # Song doesn't exist in DB, search for matches
+        # Return the saved SoundCloud match if there is one, otherwise search and rank matches
+        saved_match = SoundCloudSong.objects.filter(
+            spotify_song__spotify_id=spotify_id, spotify_song__is_saved=True
+        ).first()
+        if saved_match:
+            soundcloud_matches = [match_from_song(saved_match)]
+        else:
             soundcloud_matches = search_soundcloud(title, artist)
+            if soundcloud_matches is not None:
+                soundcloud_matches = rank_candidates(song, soundcloud_matches)
         
         return Response({
             'soundcloud_matches': soundcloud_matches,
             'soundcloud_error': soundcloud_matches is None  # Indicate if all retries failed
         })
         
+    except TokenUnavailable as e:
+        return Response({'error': str(e)}, status=400)
     except requests.RequestException as e:
         return Response({'error': str(e)}, status=500)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def get_soundcloud_matches_batch(request):
+    """
+    Get ranked SoundCloud matches for many Spotify songs, searched concurrently
+    Body: spotify_ids (at most MAX_BATCH_MATCH_IDS), auto_accept (optional: save
+    and download matches scoring at least MATCH_AUTO_ACCEPT_SCORE);
+    returns {spotify_id: matches}
+    """
+    spotify_ids = request.data.get('spotify_ids')
+    if not isinstance(spotify_ids, list) or not all(isinstance(i, str) for i in spotify_ids):
+        return Response({'error': 'spotify_ids must be a list'}, status=400)
+    if len(spotify_ids) > MAX_BATCH_MATCH_IDS:
+        return Response({'error': f'At most {MAX_BATCH_MATCH_IDS} spotify_ids per request'}, status=400)
+    
+    try:
+        results = find_matches(spotify_ids, auto_accept=bool(request.data.get('auto_accept')))
+    except TokenUnavailable as e:
+        return Response({'error': str(e)}, status=400)
+    except requests.RequestException as e:
+        return Response({'error': str(e)}, status=500)
+    
+    return Response({
+        'results': results,
+        'not_found': [spotify_id for spotify_id in spotify_ids if spotify_id not in results],
+    })
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def save_soundcloud_match(request):
@@ -95,7 +120,7 @@ def save_soundcloud_match(request):
                 params = {'fields': 'items(track(id),added_at)'}
                 
                 # Search for this track in the playlist to get its added_at
-                response = requests.get(url, headers=headers, params=params)
+                response = spotify_api.get(url, headers=headers, params=params)
                 response.raise_for_status()
                 items = response.json().get('items', [])
                 
@@ -121,34 +146,8 @@ def save_soundcloud_match(request):
                 is_saved=False
             )
         
-        # Create or update the SoundCloud song
-        soundcloud_song, created = SoundCloudSong.objects.update_or_create(
-            spotify_song=spotify_song,
-            defaults={
-                'soundcloud_id': str(soundcloud_data.get('id')),
-                'title': soundcloud_data.get('title', ''),
-                'artist': soundcloud_data.get('artist', ''),
-                'icon': soundcloud_data.get('icon', ''),
-                'duration_ms': soundcloud_data.get('duration_ms', 0),
-                'url': soundcloud_data.get('url', ''),
-                'stream_url': soundcloud_data.get('stream_url', ''),
-                'download_status': 'pending',
-                'download_progress': 0
-            }
-        )
-        
-        # Mark Spotify song as saved and set saved_at timestamp
-        spotify_song.is_saved = True
-        spotify_song.saved_at = datetime.now()
-        spotify_song.save()
-        
-        # Start download in background thread
-        download_thread = threading.Thread(
-            target=download_soundcloud_track,
-            args=(soundcloud_data.get('url', ''), soundcloud_song.title, soundcloud_song.artist, soundcloud_song.id)
-        )
-        download_thread.daemon = True
-        download_thread.start()
+        # Save the match and queue the download for the worker pool
+        save_match(spotify_song, soundcloud_data)
         
         return Response({
             'success': True,
@@ -170,35 +169,22 @@ def delete_soundcloud_match(request, spotify_id):
         try:
             soundcloud_song = SoundCloudSong.objects.get(spotify_song=spotify_song)
             
-            # Delete the downloaded file from main downloads folder
-            try:
-                download_path = '/downloads'
-                download_file = os.path.join(download_path, f'{soundcloud_song.artist} - {soundcloud_song.title}.mp3')
-                if os.path.exists(download_file):
-                    os.remove(download_file)
-                    print(f"Deleted file: {download_file}")
-            except Exception as e:
-                print(f"Warning: Could not delete file: {e}")
-            
-            # Delete files from playlist directories if song is in playlists
+            # The downloaded file and its playlist copies are deleted in the background
+            library = download_path()
+            filename = f'{soundcloud_song.artist} - {soundcloud_song.title}.mp3'
+            discarded = [os.path.join(library, filename)] + partial_downloads(soundcloud_song.id)
             if spotify_song.in_playlist:
-                playlist_songs = PlaylistSong.objects.filter(spotify_song=spotify_song).select_related('playlist')
-                for ps in playlist_songs:
-                    try:
-                        playlist_dir = os.path.join(download_path, ps.playlist.name)
-                        playlist_file = os.path.join(playlist_dir, f'{soundcloud_song.artist} - {soundcloud_song.title}.mp3')
-                        if os.path.exists(playlist_file):
-                            os.remove(playlist_file)
-                            print(f"Deleted file from playlist: {playlist_file}")
-                    except Exception as e:
-                        print(f"Warning: Could not delete file from playlist: {e}")
+                playlist_names = PlaylistSong.objects.filter(spotify_song=spotify_song).values_list('playlist__name', flat=True)
+                discarded.extend(os.path.join(library, name, filename) for name in playlist_names)
             
             soundcloud_song.delete()
+            playlist_reconciler.discard(paths=discarded)
         except SoundCloudSong.DoesNotExist:
             pass
         
         # Remove song from all playlists
         PlaylistSong.objects.filter(spotify_song=spotify_song).delete()
+        invalidate_playlist_summaries()
         
         # Mark Spotify song as not saved, not in playlist, and clear saved_at
         spotify_song.is_saved = False
@@ -227,10 +213,12 @@ def get_download_status(request, spotify_id):
         try:
             soundcloud_song = SoundCloudSong.objects.get(spotify_song=spotify_song)
             serializer = SoundCloudSongSerializer(soundcloud_song)
+            # Progress within a phase is only held in memory
+            live = download_progress.get(spotify_id) if soundcloud_song.download_status not in TERMINAL_STATUSES else None
             return Response({
                 'has_match': True,
                 'download_status': soundcloud_song.download_status,
-                'download_progress': soundcloud_song.download_progress,
+                'download_progress': live['download_progress'] if live else soundcloud_song.download_progress,
                 'bpm': soundcloud_song.bpm,
                 'key': soundcloud_song.key,
                 'soundcloud_data': serializer.data
@@ -250,6 +238,89 @@ def get_download_status(request, spotify_id):
         return Response({'error': str(e)}, status=500)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def get_download_statuses(request):
+    """
+    Get download status for many songs in one query
+    Body: spotify_ids (at most MAX_BATCH_STATUS_IDS); returns {spotify_id: status}
+    """
+    spotify_ids = request.data.get('spotify_ids')
+    if not isinstance(spotify_ids, list) or not all(isinstance(i, str) for i in spotify_ids):
+        return Response({'error': 'spotify_ids must be a list'}, status=400)
+    if len(spotify_ids) > MAX_BATCH_STATUS_IDS:
+        return Response({'error': f'At most {MAX_BATCH_STATUS_IDS} spotify_ids per request'}, status=400)
+    
+    try:
+        rows = SoundCloudSong.objects.filter(spotify_song__spotify_id__in=spotify_ids).values(
+            'spotify_song__spotify_id', 'download_status', 'download_progress', 'bpm', 'key'
+        )
+        statuses = {
+            spotify_id: {
+                'has_match': False,
+                'download_status': None,
+                'download_progress': 0,
+                'bpm': None,
+                'key': None,
+            }
+            for spotify_id in spotify_ids
+        }
+        for row in rows:
+            spotify_id = row.pop('spotify_song__spotify_id')
+            live = download_progress.get(spotify_id) if row['download_status'] not in TERMINAL_STATUSES else None
+            if live:
+                row['download_progress'] = live['download_progress']
+            statuses[spotify_id] = {'has_match': True, **row}
+        return Response(statuses)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets content negotiation accept EventSource requests (Accept: text/event-stream)
+    The stream itself bypasses rendering; this only renders DRF's own responses,
+    such as authentication errors, which are serialised as JSON.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data).encode(self.charset)
+
+
+def _progress_events():
+    """Server-sent events with progress of all active jobs, ending after PROGRESS_STREAM_SECONDS"""
+    deadline = time.monotonic() + settings.PROGRESS_STREAM_SECONDS
+    # EventSource reconnects by itself when the stream ends
+    yield f'retry: {PROGRESS_STREAM_RETRY_MS}\n\n'
+    version = 0  # The first batch is every job the registry knows about
+    while time.monotonic() < deadline:
+        timeout = min(PROGRESS_KEEPALIVE_SECONDS, deadline - time.monotonic())
+        version, jobs = download_progress.wait_for_changes(version, timeout=max(timeout, 0))
+        if jobs:
+            yield f'event: progress\ndata: {json.dumps(jobs)}\n\n'
+        else:
+            yield ': keepalive\n\n'
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@renderer_classes([EventStreamRenderer, JSONRenderer])
+def stream_download_progress(request):
+    """
+    Push download progress of all active jobs over one connection (SSE)
+    Each 'progress' event carries a list of {spotify_id, download_status, download_progress}
+    """
+    response = StreamingHttpResponse(_progress_events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let a reverse proxy buffer the stream
+    return response
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def retry_download(request, spotify_id):
@@ -269,17 +340,15 @@ def retry_download(request, spotify_id):
         soundcloud_song.download_progress = 0
         soundcloud_song.save()
         
-        # Start download in background thread
-        download_thread = threading.Thread(
-            target=download_soundcloud_track,
-            args=(soundcloud_song.url, soundcloud_song.title, soundcloud_song.artist, soundcloud_song.id)
-        )
-        download_thread.daemon = True
-        download_thread.start()
+        # Queue the download for the worker pool; it continues from the partial file, if any
+        resume_from_bytes = partial_download_bytes(soundcloud_song.id)
+        download_progress.update(spotify_id, status='pending', progress=0)
+        download_queue.enqueue(soundcloud_song.id)
         
         return Response({
             'success': True,
-            'message': 'Download retry started'
+            'message': 'Download retry queued',
+            'resume_from_bytes': resume_from_bytes
         }, status=200)
         
     except SpotifySong.DoesNotExist:
@@ -288,3 +357,13 @@ def retry_download(request, spotify_id):
         return Response({'error': 'No SoundCloud match found'}, status=404)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_download_queue_stats(request):
+    """Get download queue depth, worker utilisation and throughput"""
+    try:
+        return Response(download_queue.stats(), status=200)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
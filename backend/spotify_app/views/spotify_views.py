@@ -1,15 +1,27 @@
 """
 Spotify API related views
 """
+from django.db.models import Count, F, Q, Window
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from ..models import SpotifySong
-from ..serializers import SpotifySongSerializer
+from ..playlists import invalidate_playlist_summaries
+from ..serializers import SpotifySongSerializer, SpotifySongListSerializer
+from ..spotify_metadata import TokenUnavailable, get_track
+from ..spotify_sync import is_listed, prune_removed_songs, refresh_membership, sync_playlist
 from .utils import get_spotify_access_token
+from datetime import datetime
+import base64
 import requests
 import os
 
+# Columns selected for each row of the saved songs list
+SONG_LIST_FIELDS = (
+    'id', 'icon', 'title', 'artist', 'added_at', 'saved_at', 'spotify_id',
+    'is_saved', 'in_playlist', 'bpm', 'key', 'download_status',
+)
+
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -34,30 +46,26 @@ def get_spotify_songs(request):
         else:
             query = SpotifySong.objects.filter(is_saved=True)
     
-    # Get total count
-    total_count = query.count()
+    # Keyset pagination: ?cursor= (empty for the first page) switches to cursor mode
+    cursor = request.GET.get('cursor', None)
+    if cursor is not None:
+        return _get_spotify_songs_page_after(query, cursor, page_size)
     
     # Calculate offset
     offset = page * page_size
     
-    # Get paginated songs, ordered by most recent first
-    songs = query.order_by('-saved_at')[offset:offset + page_size]
+    # Get paginated songs, ordered by most recent first, in a single query:
+    # BPM, key and download status come from a LEFT JOIN on SoundCloudSong
+    # and the total count from a window function over the filtered rows
+    rows = list(
+        _with_soundcloud_fields(query.order_by('-saved_at', '-id'))
+        .annotate(total_count=Window(expression=Count('id')))
+        .values(*SONG_LIST_FIELDS, 'total_count')[offset:offset + page_size]
+    )
     
-    # Serialize with additional BPM and key data from SoundCloudSong
-    songs_data = []
-    for song in songs:
-        song_dict = SpotifySongSerializer(song).data
-        # Try to get BPM, key, and download status from related SoundCloudSong
-        try:
-            soundcloud_song = song.soundcloud_match
-            song_dict['bpm'] = soundcloud_song.bpm
-            song_dict['key'] = soundcloud_song.key
-            song_dict['download_status'] = soundcloud_song.download_status
-        except:
-            song_dict['bpm'] = None
-            song_dict['key'] = None
-            song_dict['download_status'] = None
-        songs_data.append(song_dict)
+    # Past the last page there is no row to carry the window count
+    total_count = rows[0]['total_count'] if rows else query.count()
+    songs_data = SpotifySongListSerializer(rows, many=True).data
     
     return Response({
         'songs': songs_data,
@@ -68,6 +76,52 @@ def get_spotify_songs(request):
     })
 
 
+def _with_soundcloud_fields(query):
+    """Annotate BPM, key and download status from the joined SoundCloudSong"""
+    return query.annotate(
+        bpm=F('soundcloud_match__bpm'),
+        key=F('soundcloud_match__key'),
+        download_status=F('soundcloud_match__download_status'),
+    )
+
+
+def _encode_cursor(row):
+    value = f"{row['saved_at'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    saved_at, song_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(saved_at), int(song_id)
+
+
+def _get_spotify_songs_page_after(query, cursor, page_size):
+    """
+    Get the page of songs following the cursor, ordered by (saved_at, id) descending.
+    Seeks through the (is_saved, saved_at, id) index, so deep pages cost the same
+    as the first one and songs saved while scrolling don't shift later pages.
+    """
+    query = query.filter(saved_at__isnull=False).order_by('-saved_at', '-id')
+    if cursor:
+        try:
+            saved_at, song_id = _decode_cursor(cursor)
+        except (ValueError, UnicodeDecodeError):
+            return Response({'error': 'Invalid cursor'}, status=400)
+        query = query.filter(Q(saved_at__lt=saved_at) | Q(saved_at=saved_at, id__lt=song_id))
+    
+    # Fetch one extra row to know whether there is a next page
+    rows = list(_with_soundcloud_fields(query).values(*SONG_LIST_FIELDS)[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    
+    return Response({
+        'songs': SpotifySongListSerializer(rows, many=True).data,
+        'page_size': page_size,
+        'next_cursor': _encode_cursor(rows[-1]) if has_more else None,
+        'has_more': has_more,
+    })
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_new_spotify_songs(request):
@@ -79,120 +133,34 @@ def get_new_spotify_songs(request):
     if not access_token:
         return Response({'error': 'Unable to retrieve Spotify access token'}, status=400)
 
-    url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks'
-    headers = {'Authorization': f'Bearer {access_token}'}
-    
     try:
-        # First, get total number of tracks
-        response = requests.get(
-            url, 
-            headers=headers, 
-            params={"limit": 1}
-        )
-        response.raise_for_status()
-        total_tracks = response.json()['total']
-
-        # Fetch tracks from newest, stopping when we hit an existing song
-        target_new_songs = 15
-        batch_size = 50  # Fetch in batches for efficiency
-        processed_count = 0
-        
-        while processed_count < total_tracks:
-            # Calculate offset for the latest unprocessed tracks
-            offset = max(0, total_tracks - processed_count - batch_size)
-            limit = min(batch_size, total_tracks - processed_count)
-            
-            # Fetch tracks
-            response = requests.get(
-                url,
-                headers=headers,
-                params={
-                    "limit": limit,
-                    "offset": offset,
-                    "fields": "items(track(id,name,artists,album(images)),added_at)"
-                }
-            )
-            response.raise_for_status()
-            
-            # Get tracks and reverse them (newest first)
-            spotify_tracks = list(reversed(response.json().get('items', [])))
-            
-            # Process each track
-            for item in spotify_tracks:
-                track = item.get('track', {})
-                spotify_id = track.get('id')
-                added_at = item.get('added_at')  # Get the added_at timestamp from Spotify
-                
-                if not spotify_id:
-                    continue
-                
-                # Check if song already exists in database
-                if SpotifySong.objects.filter(spotify_id=spotify_id, is_saved=False).exists():
-                    # Stop when we hit an existing song
-                    # Return songs with is_saved=False
-                    new_songs = SpotifySong.objects.filter(is_saved=False).order_by('-added_at')[:target_new_songs]
-                    serializer = SpotifySongSerializer(new_songs, many=True)
-                    return Response(serializer.data)
-                
-                # Create new song with is_saved=False
-                if not SpotifySong.objects.filter(spotify_id=spotify_id).exists():
-                    SpotifySong.objects.create(
-                        spotify_id=spotify_id,
-                        title=track.get('name', ''),
-                        artist=', '.join(artist['name'] for artist in track.get('artists', [])),
-                        icon=track.get('album', {}).get('images', [{}])[0].get('url'),
-                        is_saved=False,
-                        added_at=added_at  # Store the Spotify added_at timestamp
-                    )
-            
-            processed_count += limit
-        
-        # If we processed all tracks without hitting an existing one,
-        # return the newest songs with is_saved=False
-        new_songs = SpotifySong.objects.filter(is_saved=False).order_by('-added_at')[:target_new_songs]
-        serializer = SpotifySongSerializer(new_songs, many=True)
-        return Response(serializer.data)
-        
+        # Pull tracks added since the last sync (a single call when the playlist is unchanged)
+        sync_playlist(playlist_id, access_token)
     except requests.RequestException as e:
         return Response({'error': str(e)}, status=500)
+    
+    # Return the newest songs with is_saved=False
+    target_new_songs = 15
+    new_songs = SpotifySong.objects.filter(is_saved=False).order_by('-added_at')[:target_new_songs]
+    serializer = SpotifySongSerializer(new_songs, many=True)
+    return Response(serializer.data)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_spotify_song(request, spotify_id):
     """Get detailed information about a specific Spotify song"""
-    access_token = get_spotify_access_token()
-    
-    if not access_token:
-        return Response({'error': 'Unable to retrieve Spotify access token'}, status=400)
-
-    url = f'https://api.spotify.com/v1/tracks/{spotify_id}'
-    headers = {'Authorization': f'Bearer {access_token}'}
-    
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        track = response.json()
-        
-        # Get basic song info
-        title = track.get('name', '')
-        artist = ', '.join(artist['name'] for artist in track.get('artists', []))
-        
-        song_data = {
-            'spotify_id': track.get('id'),
-            'title': title,
-            'artist': artist,
-            'icon': track.get('album', {}).get('images', [{}])[0].get('url'),
-            'preview_url': track.get('preview_url'),
-            'duration_ms': track.get('duration_ms'),
-            'album_name': track.get('album', {}).get('name'),
-            'release_date': track.get('album', {}).get('release_date'),
-        }
-            
-        return Response(song_data)
-        
+        # Served from SpotifySong or the in-memory cache; fetched (with a token) only the first time
+        song_data = get_track(spotify_id)
+    except TokenUnavailable as e:
+        return Response({'error': str(e)}, status=400)
     except requests.RequestException as e:
         return Response({'error': str(e)}, status=500)
+    
+    if song_data is None:
+        return Response({'error': 'Track not found on Spotify'}, status=404)
+    return Response(song_data)
 
 
 @api_view(['POST'])
@@ -202,49 +170,16 @@ def check_song_in_playlist(request, spotify_id):
     try:
         spotify_song = SpotifySong.objects.get(spotify_id=spotify_id)
         
-        # Check if song is in the playlist
         playlist_id = os.getenv('SPOTIFY_PLAYLIST_ID')
         access_token = get_spotify_access_token()
         
         if not access_token or not playlist_id:
             return Response({'error': 'Unable to access Spotify API'}, status=500)
         
-        url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks'
-        headers = {'Authorization': f'Bearer {access_token}'}
-        params = {'fields': 'items(track(id))'}
-        
-        # Search through all tracks in the playlist
-        offset = 0
-        limit = 100
-        found = False
+        # One snapshot request when the playlist is unchanged, then a local lookup
+        refresh_membership(playlist_id, access_token)
         
-        while True:
-            params['offset'] = offset
-            params['limit'] = limit
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            
-            items = response.json().get('items', [])
-            if not items:
-                break
-            
-            # Check if our song is in this batch
-            for item in items:
-                track = item.get('track', {})
-                if track and track.get('id') == spotify_id:
-                    found = True
-                    break
-            
-            if found:
-                break
-            
-            offset += limit
-            
-            # Safety check to avoid infinite loop
-            if offset > 10000:
-                break
-        
-        if found:
+        if is_listed(playlist_id, spotify_id):
             return Response({
                 'exists': True,
                 'message': 'Song is still in the playlist'
@@ -252,6 +187,7 @@ def check_song_in_playlist(request, spotify_id):
         else:
             # Song not found in playlist, delete from database
             spotify_song.delete()
+            invalidate_playlist_summaries()
             return Response({
                 'exists': False,
                 'deleted': True,
@@ -262,3 +198,26 @@ def check_song_in_playlist(request, spotify_id):
         return Response({'error': 'Spotify song not found in database'}, status=404)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def validate_spotify_songs(request):
+    """Check every song against the Spotify playlist and delete the ones no longer in it"""
+    playlist_id = os.getenv('SPOTIFY_PLAYLIST_ID')
+    access_token = get_spotify_access_token()
+    
+    if not access_token or not playlist_id:
+        return Response({'error': 'Unable to access Spotify API'}, status=500)
+    
+    try:
+        refresh = refresh_membership(playlist_id, access_token)
+        deleted = prune_removed_songs(playlist_id)
+    except requests.RequestException as e:
+        return Response({'error': str(e)}, status=500)
+    
+    return Response({
+        'deleted_count': len(deleted),
+        'deleted': deleted,
+        'http_calls': refresh['http_calls'],
+    })
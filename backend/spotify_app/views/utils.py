@@ -1,97 +1,51 @@
 """
 Utility functions for Spotify and SoundCloud operations
 """
-import requests
+import contextlib
+import glob
+import hashlib
 import os
-import re
 import time
-import threading
+import subprocess
 import yt_dlp
+from django.conf import settings
+from django.core.cache import cache
+from .. import metrics
+from ..analysis import analysis_engine
+from ..bandwidth import download_bandwidth
+from ..http_client import soundcloud_api
+from ..materialize import incoming_path
 from ..models import SoundCloudSong
+from ..progress import download_progress, progress_writer
+from ..soundcloud_auth import soundcloud_client_id_provider
+from ..spotify_auth import spotify_token_provider
 
 
-def analyze_audio(file_path, soundcloud_song_id):
-    """Analyze audio file to extract BPM and key using Essentia"""
+def analyze_audio(file_path, soundcloud_song_id, spotify_id=None):
+    """Analyze audio file to extract BPM and key using the Essentia process pool"""
     try:
-        import essentia.standard as es
-        
         soundcloud_song = SoundCloudSong.objects.get(id=soundcloud_song_id)
         soundcloud_song.download_status = 'analyzing'
         soundcloud_song.download_progress = 90
         soundcloud_song.save()
+        if spotify_id:
+            download_progress.update(spotify_id, status='analyzing', progress=90)
         
         print(f"Analyzing audio: {file_path}")
         
-        # Load audio file
-        loader = es.MonoLoader(filename=file_path)
-        audio = loader()
-        
-        # BPM Detection
-        soundcloud_song.download_progress = 92
-        soundcloud_song.save(update_fields=['download_progress'])
-        
-        rhythm_extractor = es.RhythmExtractor2013(method="multifeature")
-        bpm, beats, beats_confidence, _, beats_intervals = rhythm_extractor(audio)
-        
-        # Key Detection
-        soundcloud_song.download_progress = 95
-        soundcloud_song.save(update_fields=['download_progress'])
-        
-        key_extractor = es.KeyExtractor()
-        key, scale, strength = key_extractor(audio)
-        
-        # Convert to Camelot key notation
-        # Map includes both spellings (e.g., "Bb" and "B-flat")
-        camelot_map = {
-            # Major keys (outer wheel)
-            ('C', 'major'): '8B',
-            ('Db', 'major'): '3B',
-            ('D-flat', 'major'): '3B',
-            ('D', 'major'): '10B',
-            ('Eb', 'major'): '5B',
-            ('E-flat', 'major'): '5B',
-            ('E', 'major'): '12B',
-            ('F', 'major'): '7B',
-            ('F#', 'major'): '2B',
-            ('Gb', 'major'): '2B',
-            ('G', 'major'): '9B',
-            ('Ab', 'major'): '4B',
-            ('A-flat', 'major'): '4B',
-            ('A', 'major'): '11B',
-            ('Bb', 'major'): '6B',
-            ('B-flat', 'major'): '6B',
-            ('B', 'major'): '1B',
-            # Minor keys (inner wheel)
-            ('C', 'minor'): '5A',
-            ('Db', 'minor'): '12A',
-            ('D-flat', 'minor'): '12A',
-            ('D', 'minor'): '7A',
-            ('Eb', 'minor'): '2A',
-            ('E-flat', 'minor'): '2A',
-            ('E', 'minor'): '9A',
-            ('F', 'minor'): '4A',
-            ('F#', 'minor'): '11A',
-            ('Gb', 'minor'): '11A',
-            ('G', 'minor'): '6A',
-            ('Ab', 'minor'): '1A',
-            ('A-flat', 'minor'): '1A',
-            ('A', 'minor'): '8A',
-            ('Bb', 'minor'): '3A',
-            ('B-flat', 'minor'): '3A',
-            ('B', 'minor'): '10A',
-        }
-        
-        # Get Camelot notation
-        formatted_key = camelot_map.get((key, scale), f"{key} {scale}")
+        # BPM and key detection run in a worker process
+        result = analysis_engine.analyze(file_path)
         
         # Update database with results
-        soundcloud_song.bpm = round(bpm)  # Round to whole number
-        soundcloud_song.key = formatted_key
+        soundcloud_song.bpm = result['bpm']
+        soundcloud_song.key = result['key']
         soundcloud_song.download_status = 'completed'
         soundcloud_song.download_progress = 100
         soundcloud_song.save()
+        if spotify_id:
+            download_progress.update(spotify_id, status='completed', progress=100)
         
-        print(f"Analysis complete - BPM: {round(bpm)}, Key: {formatted_key}")
+        print(f"Analysis complete - BPM: {result['bpm']}, Key: {result['key']}")
         
     except Exception as e:
         print(f"Error analyzing audio: {e}")
@@ -100,25 +54,84 @@ def analyze_audio(file_path, soundcloud_song_id):
             soundcloud_song.download_status = 'completed'  # Still mark as completed even if analysis fails
             soundcloud_song.download_progress = 100
             soundcloud_song.save()
+            if spotify_id:
+                download_progress.update(spotify_id, status='completed', progress=100)
         except:
             pass
 
 
-def download_soundcloud_track(url, title, artist, soundcloud_song_id):
-    """Download SoundCloud track using yt-dlp in background"""
+def transcode_to_mp3(source_file, dest_file):
+    """Transcode a downloaded audio file to a 320 kbps MP3 with ffmpeg"""
+    subprocess.run(
+        [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-i', source_file,
+            '-vn', '-codec:a', 'libmp3lame', '-b:a', '320k',
+            dest_file,
+        ],
+        check=True,
+        capture_output=True,
+    )
+
+
+def partial_downloads(soundcloud_song_id):
+    """Files a download of this song left behind (.part files and fragment state), to resume from"""
+    return glob.glob(os.path.join(glob.escape(incoming_path()), f'{soundcloud_song_id}-*'))
+
+
+def partial_download_bytes(soundcloud_song_id):
+    """Bytes already downloaded by an interrupted download of this song"""
+    total = 0
+    for path in partial_downloads(soundcloud_song_id):
+        if path.endswith('.ytdl'):
+            continue
+        with contextlib.suppress(OSError):
+            total += os.path.getsize(path)
+    return total
+
+
+def download_soundcloud_track(url, title, artist, soundcloud_song_id, stage=None):
+    """
+    Download SoundCloud track using yt-dlp, transcode it and analyze it.
+
+    stage: optional callable taking a stage name ('download', 'transcode' or
+    'analysis') and returning a context manager, used by the download queue
+    to bound how many jobs run each stage at once.
+
+    Progress within a phase goes to the in-memory registry and the coalescing
+    progress writer (spotify_app.progress); the row itself is saved when the
+    status changes.
+
+    Fragmented (HLS) streams are fetched DOWNLOAD_FRAGMENT_CONCURRENCY
+    fragments at a time. The partial file is named after the song and the
+    SoundCloud track, so a retry or a job resumed after a restart continues
+    it instead of starting over, while a different match never reuses it.
+    The download speed is limited to the job's share of the global bandwidth
+    budget (spotify_app.bandwidth).
+    """
+    if stage is None:
+        stage = lambda name: contextlib.nullcontext()
+
+    spotify_id = None
     try:
-        soundcloud_song = SoundCloudSong.objects.get(id=soundcloud_song_id)
+        soundcloud_song = SoundCloudSong.objects.select_related('spotify_song').get(id=soundcloud_song_id)
+        spotify_id = soundcloud_song.spotify_song.spotify_id
         soundcloud_song.download_status = 'downloading'
         soundcloud_song.download_progress = 0
         soundcloud_song.save()
+        download_progress.update(spotify_id, status='downloading', progress=0)
+        
+        # Container path of the downloads volume (mapped to host via volume)
+        download_path = settings.DOWNLOAD_ROOT
         
-        # Use /downloads as the container path (mapped to host via volume)
-        download_path = '/downloads'
+        # Ensure download directories exist
+        os.makedirs(incoming_path(), exist_ok=True)
         
-        # Ensure download directory exists
-        os.makedirs(download_path, exist_ok=True)
+        def report_progress(progress):
+            download_progress.update(spotify_id, progress=progress)
+            progress_writer.record(soundcloud_song_id, progress)
         
-        # Progress hook to update database
+        # Progress hook to update the in-memory progress registry
         def progress_hook(d):
             if d['status'] == 'downloading':
                 try:
@@ -128,51 +141,53 @@ def download_soundcloud_track(url, title, artist, soundcloud_song_id):
                     
                     if total > 0:
                         # Scale download progress to 0-80%
-                        progress = int((downloaded / total) * 80)
-                        # Update database
-                        soundcloud_song.download_progress = progress
-                        soundcloud_song.save(update_fields=['download_progress'])
+                        report_progress(int((downloaded / total) * 80))
                 except Exception as e:
                     print(f"Error updating progress: {e}")
             elif d['status'] == 'finished':
                 # Download finished, conversion starting (80%)
-                soundcloud_song.download_progress = 80
-                soundcloud_song.save(update_fields=['download_progress'])
+                report_progress(80)
         
-        # Post-processing hook to track conversion
-        def postprocessor_hook(d):
-            if d['status'] == 'started':
-                soundcloud_song.download_progress = 80
-                soundcloud_song.save(update_fields=['download_progress'])
-            elif d['status'] == 'processing':
-                soundcloud_song.download_progress = 85
-                soundcloud_song.save(update_fields=['download_progress'])
-            elif d['status'] == 'finished':
-                soundcloud_song.download_progress = 90
-                soundcloud_song.save(update_fields=['download_progress'])
-        
-        # Configure yt-dlp options
+        # Configure yt-dlp options (transcoding runs as its own stage below)
         ydl_opts = {
             'format': 'bestaudio/best',
-            'outtmpl': os.path.join(download_path, f'{artist} - {title}.%(ext)s'),
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '320',
-            }],
+            'outtmpl': os.path.join(incoming_path(), f'{soundcloud_song_id}-%(id)s.%(ext)s'),
             'quiet': True,
             'no_warnings': True,
             'progress_hooks': [progress_hook],
-            'postprocessor_hooks': [postprocessor_hook],
+            'continuedl': True,  # Resume .part files
+            'concurrent_fragment_downloads': settings.DOWNLOAD_FRAGMENT_CONCURRENCY,
+            # Progressive streams are requested in ranges, so a stalled connection only loses one chunk
+            'http_chunk_size': settings.DOWNLOAD_CHUNK_SIZE,
         }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-            print(f"Successfully downloaded: {artist} - {title}")
+        with stage('download'):
+            resumed_bytes = partial_download_bytes(soundcloud_song_id)
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=False)
+                # HLS streams are fetched over several connections, each limited separately
+                connections = settings.DOWNLOAD_FRAGMENT_CONCURRENCY if info.get('protocol', '').startswith('m3u8') else 1
+                # May wait for a turn when the bandwidth budget has no room for another job
+                with download_bandwidth.share(ydl.params, connections):
+                    started_at = time.monotonic()
+                    info = ydl.process_ie_result(info, download=True)
+                source_file = ydl.prepare_filename(info)
+                print(f"Successfully downloaded: {artist} - {title}")
+            size = os.path.getsize(source_file) if os.path.exists(source_file) else None
+            soundcloud_song.download_bytes = max(size - resumed_bytes, 0) if size is not None else None
+            soundcloud_song.download_seconds = round(time.monotonic() - started_at, 3)
+            soundcloud_song.download_resumed_bytes = resumed_bytes
+            soundcloud_song.save(update_fields=['download_bytes', 'download_seconds', 'download_resumed_bytes'])
+        
+        download_file = os.path.join(download_path, f'{artist} - {title}.mp3')
+        
+        with stage('transcode'):
+            report_progress(85)
+            transcode_to_mp3(source_file, download_file)
+            os.remove(source_file)
         
         # Fix file permissions (666 = rw-rw-rw-)
         # This allows the host user to read/write the file
-        download_file = os.path.join(download_path, f'{artist} - {title}.mp3')
         try:
             if os.path.exists(download_file):
                 os.chmod(download_file, 0o666)
@@ -181,100 +196,92 @@ def download_soundcloud_track(url, title, artist, soundcloud_song_id):
         
         # Analyze audio file for BPM and key
         if os.path.exists(download_file):
-            analyze_audio(download_file, soundcloud_song_id)
+            with stage('analysis'):
+                analyze_audio(download_file, soundcloud_song_id, spotify_id)
         else:
             # If file doesn't exist, just mark as completed
             soundcloud_song.download_status = 'completed'
             soundcloud_song.download_progress = 100
             soundcloud_song.save()
+            download_progress.update(spotify_id, status='completed', progress=100)
             
     except Exception as e:
         print(f"Error downloading {artist} - {title}: {e}")
         try:
             soundcloud_song.download_status = 'failed'
             soundcloud_song.save()
+            if spotify_id:
+                download_progress.update(spotify_id, status='failed')
         except:
             pass
+    finally:
+        progress_writer.discard(soundcloud_song_id)
 
 
 def get_soundcloud_client_id():
-    """Fetch a fresh SoundCloud client_id from the public web app."""
-    try:
-        homepage = requests.get("https://soundcloud.com")
-        # Find JavaScript bundles
-        js_urls = re.findall(r'src="(https://a-v2\.sndcdn\.com/assets/[^"]+\.js)"', homepage.text)
-        for js_url in js_urls:
-            js_code = requests.get(js_url).text
-            match = re.search(r'client_id:"([a-zA-Z0-9]+)"', js_code)
-            if match:
-                return match.group(1)
-    except Exception as e:
-        print(f"Error getting SoundCloud client_id: {e}")
-    return None
+    """Get the SoundCloud client_id (cached; scraped from the web app only when needed)"""
+    return soundcloud_client_id_provider.get_client_id()
 
 
-def search_soundcloud(title, artist, limit=5, max_retries=3, initial_delay=1):
+def normalize_query(text):
+    """Search text compared case- and whitespace-insensitively, used as the cache key"""
+    return ' '.join(text.casefold().split())
+
+
+def search_soundcloud(title, artist, limit=5):
     """
-    Search SoundCloud tracks with retries.
-    initial_delay: starting delay in seconds
-    max_retries: maximum number of retry attempts
+    Search SoundCloud tracks; returns None when the search failed.
+    Results are cached per normalised query for SOUNDCLOUD_SEARCH_CACHE_TTL.
+    Transient errors (429/5xx, connection errors) are retried with backoff by the HTTP session.
     """
-    def try_search():
-        client_id = get_soundcloud_client_id()
-        if not client_id:
-            return None
+    query = normalize_query(f"{title} {artist}")
+    cache_key = 'soundcloud_search:' + hashlib.sha1(f'{limit}:{query}'.encode()).hexdigest()
+    matches = cache.get(cache_key)
+    if matches is not None:
+        metrics.incr('soundcloud_search.cache_hit')
+        return matches
+    metrics.incr('soundcloud_search.cache_miss')
 
-        search_text = f"{title} {artist}"
-        params = {
-            "q": search_text,
-            "client_id": client_id,
-            "limit": limit
-        }
-        
-        url = "https://api-v2.soundcloud.com/search/tracks"
-        response = requests.get(url, params=params)
+    client_id = get_soundcloud_client_id()
+    if not client_id:
+        return None
+
+    params = {
+        "q": query,
+        "client_id": client_id,
+        "limit": limit
+    }
+    url = "https://api-v2.soundcloud.com/search/tracks"
+    try:
+        response = soundcloud_api.get(url, params=params)
+        if response.status_code in (401, 403):
+            # The cached client_id was revoked: scrape a new one and retry right away
+            soundcloud_client_id_provider.invalidate(client_id)
+            params["client_id"] = get_soundcloud_client_id()
+            if not params["client_id"]:
+                return None
+            response = soundcloud_api.get(url, params=params)
         response.raise_for_status()
-        return response.json().get('collection', [])
+        tracks = response.json().get('collection', [])
+    except Exception as e:
+        print(f"SoundCloud search for '{query}' failed: {e}")
+        return None
 
-    # Try up to max_retries times with exponential backoff
-    for attempt in range(max_retries):
-        try:
-            tracks = try_search()
-            if tracks is not None:
-                matches = []
-                for track in tracks:
-                    matches.append({
-                        'id': track.get('id'),
-                        'title': track.get('title', ''),
-                        'artist': track.get('user', {}).get('username', ''),
-                        'icon': track.get('artwork_url', ''),
-                        'duration_ms': track.get('duration', 0),
-                        'url': track.get('permalink_url', ''),
-                        'stream_url': track.get('stream_url', '')
-                    })
-                return matches
-        except Exception as e:
-            delay = initial_delay * (2 ** attempt)  # exponential backoff
-            print(f"Attempt {attempt + 1} failed: {e}. Retrying in {delay} seconds...")
-            time.sleep(delay)
-            continue
-    
-    # If we get here, all retries failed
-    return None
+    matches = []
+    for track in tracks:
+        matches.append({
+            'id': track.get('id'),
+            'title': track.get('title', ''),
+            'artist': track.get('user', {}).get('username', ''),
+            'icon': track.get('artwork_url', ''),
+            'duration_ms': track.get('duration', 0),
+            'url': track.get('permalink_url', ''),
+            'stream_url': track.get('stream_url', '')
+        })
+    cache.set(cache_key, matches, settings.SOUNDCLOUD_SEARCH_CACHE_TTL)
+    return matches
 
 
 def get_spotify_access_token():
-    """Get Spotify API access token using client credentials"""
-    client_id = os.getenv('SPOTIFY_CLIENT_ID')
-    client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
-    token_url = 'https://accounts.spotify.com/api/token'
-    
-    response = requests.post(token_url, {
-        'grant_type': 'client_credentials',
-        'client_id': client_id,
-        'client_secret': client_secret,
-    })
-    
-    if response.status_code == 200:
-        return response.json().get('access_token')
-    return None
+    """Get Spotify API access token using client credentials (cached until shortly before expiry)"""
+    return spotify_token_provider.get_token()
@@ -1,3 +1,5 @@
+import os
+
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spotify_project.settings')
@@ -68,11 +68,25 @@ TEMPLATES = [
 WSGI_APPLICATION = 'spotify_project.wsgi.application'
 
 # Database
+# SQLite by default; set DATABASE_URL (e.g. postgres://user:password@db:5432/rekordbox)
+# to use PostgreSQL when several processes write at once
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': env.db('DATABASE_URL', default=f'sqlite:///{BASE_DIR / "db.sqlite3"}'),
+}
+# Keep connections open between requests instead of reconnecting each time (seconds)
+DATABASES['default']['CONN_MAX_AGE'] = env.int('DB_CONN_MAX_AGE', default=60)
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Wait this long (seconds) for another writer's lock instead of failing with "database is locked"
+    DATABASES['default'].setdefault('OPTIONS', {})['timeout'] = env.int('SQLITE_BUSY_TIMEOUT', default=20)
+# Applied to each new SQLite connection (see spotify_app/db.py)
+SQLITE_JOURNAL_MODE = env('SQLITE_JOURNAL_MODE', default='wal')
+SQLITE_SYNCHRONOUS = env('SQLITE_SYNCHRONOUS', default='normal')
+
+# Cache shared by every process of the container (server workers and management
+# commands), so invalidations such as the playlist summaries' reach them all.
+# Set CACHE_URL (e.g. redis://redis:6379/0) to share it between containers.
+CACHES = {
+    'default': env.cache('CACHE_URL', default='filecache:///tmp/rekordbox-manager-cache'),
 }
 
 # Password validation
@@ -108,6 +122,63 @@ SPOTIFY_CLIENT_SECRET = env('SPOTIFY_CLIENT_SECRET')
 SPOTIFY_USERNAME = env('SPOTIFY_USERNAME')
 SPOTIFY_PLAYLIST_ID = env('SPOTIFY_PLAYLIST_ID')
 
+# Outbound HTTP (pooled sessions per external service)
+HTTP_CONNECT_TIMEOUT = env.float('HTTP_CONNECT_TIMEOUT', default=5)
+HTTP_READ_TIMEOUT = env.float('HTTP_READ_TIMEOUT', default=20)
+HTTP_MAX_RETRIES = env.int('HTTP_MAX_RETRIES', default=3)  # On 429/5xx and connection errors
+HTTP_POOL_SIZE = env.int('HTTP_POOL_SIZE', default=10)  # Kept-alive connections per host
+
+# SoundCloud client_id scraped from soundcloud.com is reused for this long (seconds),
+# or until the API rejects it
+SOUNDCLOUD_CLIENT_ID_TTL = env.int('SOUNDCLOUD_CLIENT_ID_TTL', default=7 * 24 * 3600)
+# SoundCloud search results are cached per normalised query (seconds); batch matching
+# runs at most this many searches at once
+SOUNDCLOUD_SEARCH_CACHE_TTL = env.int('SOUNDCLOUD_SEARCH_CACHE_TTL', default=6 * 3600)
+SOUNDCLOUD_SEARCH_CONCURRENCY = env.int('SOUNDCLOUD_SEARCH_CONCURRENCY', default=4)
+# Auto-matching saves a song's best SoundCloud candidate when it scores at least this (0-1)
+MATCH_AUTO_ACCEPT_SCORE = env.float('MATCH_AUTO_ACCEPT_SCORE', default=0.9)
+
+# Container-side path of the downloads volume: the library, playlist folders and
+# .incoming partial downloads. DOWNLOAD_PATH in .env is the host side, used by docker-compose.
+DOWNLOAD_ROOT = env('DOWNLOAD_ROOT', default='/downloads')
+
+# Download queue settings
+# Workers bound how many jobs are in flight; each stage has its own limit
+DOWNLOAD_WORKERS = env.int('DOWNLOAD_WORKERS', default=4)
+DOWNLOAD_CONCURRENCY = env.int('DOWNLOAD_CONCURRENCY', default=3)  # yt-dlp network downloads
+TRANSCODE_CONCURRENCY = env.int('TRANSCODE_CONCURRENCY', default=2)  # ffmpeg transcodes
+# Essentia BPM/key analysis runs in a process pool, one worker per core by default
+ANALYSIS_PROCESSES = env.int('ANALYSIS_PROCESSES', default=os.cpu_count() or 1)
+ANALYSIS_CONCURRENCY = env.int('ANALYSIS_CONCURRENCY', default=ANALYSIS_PROCESSES)
+DOWNLOAD_QUEUE_AUTOSTART = env.bool('DOWNLOAD_QUEUE_AUTOSTART', default=True)
+# The queue polls for pending jobs and renews its claims this often (seconds); jobs
+# whose claim wasn't renewed for DOWNLOAD_CLAIM_TIMEOUT are taken to be interrupted
+DOWNLOAD_HEARTBEAT_SECONDS = env.int('DOWNLOAD_HEARTBEAT_SECONDS', default=30)
+DOWNLOAD_CLAIM_TIMEOUT = env.int('DOWNLOAD_CLAIM_TIMEOUT', default=120)
+# Fragments of HLS streams fetched at once per job, and the range size for progressive streams (bytes)
+DOWNLOAD_FRAGMENT_CONCURRENCY = env.int('DOWNLOAD_FRAGMENT_CONCURRENCY', default=4)
+DOWNLOAD_CHUNK_SIZE = env.int('DOWNLOAD_CHUNK_SIZE', default=10 * 1024 * 1024)
+# Bandwidth shared by all concurrent downloads (KiB/s), 0 for unlimited. A hard cap:
+# each download gets at least 32 KiB/s, further downloads wait for their turn
+DOWNLOAD_BANDWIDTH_LIMIT_KBPS = env.int('DOWNLOAD_BANDWIDTH_LIMIT_KBPS', default=0)
+
+# How playlist folders refer to library files: hardlink, reflink, symlink, copy
+# or auto (hardlink, then reflink, then copy); see spotify_app/materialize.py
+PLAYLIST_LINK_MODE = env('PLAYLIST_LINK_MODE', default='auto')
+# Playlist folders are brought in line with the database in the background,
+# on changes and at least this often (seconds), this many file operations per batch
+PLAYLIST_RECONCILE_INTERVAL = env.int('PLAYLIST_RECONCILE_INTERVAL', default=300)
+PLAYLIST_RECONCILE_BATCH = env.int('PLAYLIST_RECONCILE_BATCH', default=200)
+PLAYLIST_RECONCILER_AUTOSTART = env.bool('PLAYLIST_RECONCILER_AUTOSTART', default=True)
+# The playlist listing is cached until membership or downloads change, and at most this long
+PLAYLIST_SUMMARY_CACHE_TTL = env.int('PLAYLIST_SUMMARY_CACHE_TTL', default=300)
+
+# Download progress event streams are closed (and reopened by the browser) after this
+# many seconds, so each one holds a server thread only for a bounded time
+PROGRESS_STREAM_SECONDS = env.int('PROGRESS_STREAM_SECONDS', default=300)
+# Download progress is written to the database at most this often, all jobs in one UPDATE
+PROGRESS_FLUSH_INTERVAL_MS = env.int('PROGRESS_FLUSH_INTERVAL_MS', default=1000)
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
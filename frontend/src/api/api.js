@@ -76,6 +76,23 @@ export const fetchSongs = async (page = 0, pageSize = 15, excludeInPlaylist = fa
   }
 };
 
+// Cursor-based paging: pass the previous response's next_cursor ('' for the first page)
+export const fetchSongsAfter = async (cursor = '', pageSize = 15, inPlaylist = null) => {
+  try {
+    const params = new URLSearchParams({
+      cursor: cursor || '',
+      page_size: pageSize.toString(),
+    });
+    if (inPlaylist !== null) {
+      params.append('in_playlist', inPlaylist ? 'true' : 'false');
+    }
+    const response = await api.get(`/api/spotify/songs/?${params.toString()}`);
+    return response.data;
+  } catch (error) {
+    throw error.response?.data || error.message;
+  }
+};
+
 export const fetchNewSpotifySongs = async () => {
     try {
         const response = await api.get('/api/spotify/new-songs/');
@@ -103,6 +120,18 @@ export const fetchSoundCloudMatches = async (spotifyId) => {
     }
 };
 
+export const fetchSoundCloudMatchesBatch = async (spotifyIds, autoAccept = false) => {
+    try {
+        const response = await api.post('/api/spotify/soundcloud-matches/batch/', {
+            spotify_ids: spotifyIds,
+            auto_accept: autoAccept,
+        });
+        return response.data;
+    } catch (error) {
+        throw error.response?.data || error.message;
+    }
+};
+
 export const saveSoundCloudMatch = async (spotifyId, spotifyData, soundcloudMatch) => {
     try {
         const response = await api.post('/api/spotify/save-match/', {
@@ -136,6 +165,15 @@ export const checkSongInPlaylist = async (spotifyId) => {
     }
 };
 
+export const validateSpotifySongs = async () => {
+    try {
+        const response = await api.post('/api/spotify/validate-songs/');
+        return response.data;
+    } catch (error) {
+        throw error.response?.data || error.message;
+    }
+};
+
 export const getDownloadStatus = async (spotifyId) => {
     try {
         const response = await api.get(`/api/spotify/download-status/${spotifyId}/`);
@@ -145,6 +183,26 @@ export const getDownloadStatus = async (spotifyId) => {
     }
 };
 
+export const getDownloadStatuses = async (spotifyIds) => {
+    try {
+        const response = await api.post('/api/spotify/download-status/batch/', { spotify_ids: spotifyIds });
+        return response.data;
+    } catch (error) {
+        throw error.response?.data || error.message;
+    }
+};
+
+// Receive download progress of all active jobs over one server-sent event stream.
+// onProgress is called with a list of {spotify_id, download_status, download_progress};
+// the browser reconnects on its own. Returns a function that closes the stream.
+export const subscribeDownloadProgress = (onProgress) => {
+    const source = new EventSource('/api/spotify/download-progress/stream/', { withCredentials: true });
+    source.addEventListener('progress', (event) => {
+        onProgress(JSON.parse(event.data));
+    });
+    return () => source.close();
+};
+
 export const retryDownload = async (spotifyId) => {
     try {
         const response = await api.post(`/api/spotify/retry-download/${spotifyId}/`);
@@ -154,6 +212,15 @@ export const retryDownload = async (spotifyId) => {
     }
 };
 
+export const getDownloadQueueStats = async () => {
+    try {
+        const response = await api.get('/api/spotify/download-queue/');
+        return response.data;
+    } catch (error) {
+        throw error.response?.data || error.message;
+    }
+};
+
 export const getPlaylists = async () => {
     try {
         const response = await api.get('/api/spotify/playlists/');
@@ -208,6 +275,33 @@ export const removeSongFromPlaylist = async (playlistId, spotifyId) => {
     }
 };
 
+export const addSongsToPlaylist = async (playlistId, spotifyIds) => {
+    try {
+        const response = await api.post(`/api/spotify/playlists/${playlistId}/songs/bulk-add/`, { spotify_ids: spotifyIds });
+        return response.data;
+    } catch (error) {
+        throw error.response?.data || error.message;
+    }
+};
+
+export const removeSongsFromPlaylist = async (playlistId, spotifyIds) => {
+    try {
+        const response = await api.post(`/api/spotify/playlists/${playlistId}/songs/bulk-remove/`, { spotify_ids: spotifyIds });
+        return response.data;
+    } catch (error) {
+        throw error.response?.data || error.message;
+    }
+};
+
+export const moveSongsInPlaylist = async (playlistId, spotifyIds, index) => {
+    try {
+        const response = await api.post(`/api/spotify/playlists/${playlistId}/songs/move/`, { spotify_ids: spotifyIds, index });
+        return response.data;
+    } catch (error) {
+        throw error.response?.data || error.message;
+    }
+};
+
 export const syncRekordbox = async (databasePath) => {
     try {
         const response = await api.post('/api/spotify/rekordbox/sync/', { database_path: databasePath });
@@ -217,4 +311,12 @@ export const syncRekordbox = async (databasePath) => {
     }
 };
 
-export default api;
\ No newline at end of file
+export default api;
+export const getPlaylistReconcilerStatus = async () => {
+    try {
+        const response = await api.get('/api/spotify/playlists/reconciler/');
+        return response.data;
+    } catch (error) {
+        throw error.response?.data || error.message;
+    }
+};
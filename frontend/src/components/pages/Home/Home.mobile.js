@@ -2,7 +2,7 @@ import React, { useEffect, useState, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import HeaderMobile from '../../layout/Header.mobile';
 import SongItem from '../../shared/SongItem';
-import { fetchSongs, fetchNewSpotifySongs, deleteSoundCloudMatch, checkSongInPlaylist } from '../../../api/api';
+import { fetchSongsAfter, fetchNewSpotifySongs, deleteSoundCloudMatch, checkSongInPlaylist } from '../../../api/api';
 import { openInNewTabOrNavigate } from '../../../utils/navHelper';
 import { ConfirmDeleteButton } from '../../common';
 import { FaMinus } from 'react-icons/fa';
@@ -30,23 +30,32 @@ const HomeMobile = () => {
   const [confirmDelete, setConfirmDelete] = useState(null); // Track which song is awaiting confirmation
   const [checkingId, setCheckingId] = useState(null); // Track which song is being checked
   const [savedPage, setSavedPage] = useState(0);
-  const [totalSavedPages, setTotalSavedPages] = useState(0);
+  const [hasMoreSaved, setHasMoreSaved] = useState(false);
   const [refreshing, setRefreshing] = useState(false);
 
   const listRef = useRef(null);
+  // Cursor of each saved page visited so far ('' for the first one); page n's
+  // cursor is the next_cursor of page n - 1, so pages are walked one at a time
+  const savedCursors = useRef(['']);
+
+  const fetchSavedPage = async (page) => {
+    const savedData = await fetchSongsAfter(savedCursors.current[page], 15);
+    savedCursors.current[page + 1] = savedData.next_cursor;
+    return savedData;
+  };
 
   useEffect(() => {
     let mounted = true;
     setLoading(true);
 
     Promise.all([
-      fetchSongs(savedPage, 15),
+      fetchSavedPage(savedPage),
       fetchNewSpotifySongs(),
     ])
       .then(([savedData, newOnes]) => {
         if (!mounted) return;
         setSavedSongs(savedData.songs || []);
-        setTotalSavedPages(savedData.total_pages || 0);
+        setHasMoreSaved(!!savedData.has_more);
         setNewSongs(newOnes || []);
       })
       .catch((err) => {
@@ -77,17 +86,17 @@ const HomeMobile = () => {
   };
 
   const handleNext = () => {
-    if (selection !== 'saved') return;
-    setSavedPage((p) => Math.min(totalSavedPages - 1, p + 1));
+    if (selection !== 'saved' || !hasMoreSaved) return;
+    setSavedPage((p) => p + 1);
   };
 
   const handleSync = async () => {
     setRefreshing(true);
     try {
       if (selection === 'saved') {
-        const savedData = await fetchSongs(savedPage, 15);
+        const savedData = await fetchSavedPage(savedPage);
         setSavedSongs(savedData.songs || []);
-        setTotalSavedPages(savedData.total_pages || 0);
+        setHasMoreSaved(!!savedData.has_more);
       } else {
         const newOnes = await fetchNewSpotifySongs();
         setNewSongs(newOnes || []);
@@ -111,11 +120,11 @@ const HomeMobile = () => {
       await deleteSoundCloudMatch(spotifyId);
       // Refresh saved and new lists
       const [savedData, newOnes] = await Promise.all([
-        fetchSongs(savedPage, 15),
+        fetchSavedPage(savedPage),
         fetchNewSpotifySongs(),
       ]);
       setSavedSongs(savedData.songs || []);
-      setTotalSavedPages(savedData.total_pages || 0);
+      setHasMoreSaved(!!savedData.has_more);
       setNewSongs(newOnes || []);
       setConfirmDelete(null);
     } catch (err) {
@@ -187,8 +196,8 @@ const HomeMobile = () => {
         <div className="mobile-actions">
           <div className="pagination-group">
             <button onClick={handlePrev} disabled={selection !== 'saved' || savedPage <= 0} title="Previous page"><FaChevronLeft /></button>
-            <div className="page-indicator">{selection === 'saved' ? (savedPage + 1) : 1}/{selection === 'saved' ? Math.max(1, totalSavedPages) : 1}</div>
-            <button onClick={handleNext} disabled={selection !== 'saved' || savedPage >= totalSavedPages - 1} title="Next page"><FaChevronRight /></button>
+            <div className="page-indicator">{selection === 'saved' ? (savedPage + 1) : 1}</div>
+            <button onClick={handleNext} disabled={selection !== 'saved' || !hasMoreSaved} title="Next page"><FaChevronRight /></button>
           </div>
 
           <div className="sync-group">
@@ -1,6 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
-import { fetchSpotifySong, fetchSoundCloudMatches, deleteSoundCloudMatch, getDownloadStatus, retryDownload } from '../../../api/api';
+import { fetchSpotifySong, fetchSoundCloudMatches, deleteSoundCloudMatch, getDownloadStatus, retryDownload, subscribeDownloadProgress } from '../../../api/api';
 import LoadingSpinner from '../../common/LoadingSpinner';
 import { HeaderDesktop as Header } from '../../layout';
 import { SongHeaderDesktop } from '../../shared/SongHeader';
@@ -53,33 +53,37 @@ const SavedSong = () => {
         fetchData();
     }, [id]);
 
-    // Poll for download status updates
+    // Follow download progress pushed by the server while the download is active
+    const downloadActive = Boolean(downloadStatus) && downloadStatus !== 'completed' && downloadStatus !== 'failed';
     useEffect(() => {
-        if (!downloadStatus || downloadStatus === 'completed' || downloadStatus === 'failed') {
+        if (!downloadActive) {
             return;
         }
 
-        const interval = setInterval(async () => {
-            try {
-                const statusData = await getDownloadStatus(id);
-                if (statusData.has_match) {
-                    setDownloadStatus(statusData.download_status);
-                    setDownloadProgress(statusData.download_progress);
-                    setBpm(statusData.bpm);
-                    setMusicKey(statusData.key);
-                    
-                    // Stop polling when download is complete or failed
-                    if (statusData.download_status === 'completed' || statusData.download_status === 'failed') {
-                        clearInterval(interval);
+        const unsubscribe = subscribeDownloadProgress(async (jobs) => {
+            const job = jobs.find((j) => j.spotify_id === id);
+            if (!job) {
+                return;
+            }
+            setDownloadStatus(job.download_status);
+            setDownloadProgress(job.download_progress);
+
+            // BPM and key are known once the job has finished
+            if (job.download_status === 'completed' || job.download_status === 'failed') {
+                try {
+                    const statusData = await getDownloadStatus(id);
+                    if (statusData.has_match) {
+                        setBpm(statusData.bpm);
+                        setMusicKey(statusData.key);
                     }
+                } catch (err) {
+                    console.error('Error fetching download status:', err);
                 }
-            } catch (err) {
-                console.error('Error fetching download status:', err);
             }
-        }, 1000); // Poll every second
+        });
 
-        return () => clearInterval(interval);
-    }, [id, downloadStatus]);
+        return unsubscribe;
+    }, [id, downloadActive]);
 
     const handleRetryDownload = async () => {
         try {